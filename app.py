@@ -1,89 +1,94 @@
-import os, json, traceback, secrets, re
-from datetime import timedelta
-from flask import Flask, request, jsonify, send_from_directory, render_template_string, session
+import os, csv, json, time, traceback, secrets, hashlib
+from datetime import datetime, timedelta
+from flask import Blueprint, Flask, Response, current_app, request, jsonify, render_template_string, session, stream_with_context, g
 from dotenv import load_dotenv
-import bcrypt
-from openai import OpenAI
-from mailer import send_mail, send_password_reset_email, send_verification_email
+import passwords
+from passwords import is_bcrypt_hash
+from mailer import (
+    send_mail,
+    send_password_reset_email,
+    send_verification_email,
+    password_reset_email,
+    verification_email,
+)
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from models import Base, User, EmailToken, create_tables, safe_migrate
-from db import find_user_by_email, create_user, issue_token
-
-# --- Load config ---
-load_dotenv()
-
-engine = create_engine(os.getenv("DATABASE_URL"))
-SessionLocal = sessionmaker(bind=engine)
-
-
-def get_session():
-    return SessionLocal()
-
-
-create_tables(engine)
-safe_migrate(engine)
-
+from sqlalchemy.exc import IntegrityError
+from models import User
+from db import get_session, find_user_by_email, create_user, issue_token, enqueue_email, add_llm_usage, top_llm_consumers
 from auth_utils import (
     validate_reset_token,
-    set_user_password,
-    validate_verification_token,
-    mark_user_verified,
-    consume_token,
+    verify_email_with_token,
+    reset_password_with_token,
 )
+import reply_cache
+import metrics
+import llm_fallback
+import prompt_compiler
+import conversations
+import journey_state
+import kpis
+import applications
+import export
+import reply_history
+import search
+import llm_quota
+import services
+import static_assets
+
+# --- Load config ---
+load_dotenv()
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 MODEL = os.getenv("MODEL", "gpt-4o-mini")          # safe default
 FALLBACK_MODEL = os.getenv("FALLBACK_MODEL", "gpt-4o-mini")
 PORT = int(os.getenv("PORT", "5055"))              # local dev port only
 ADMIN_SETUP_TOKEN = os.getenv("ADMIN_SETUP_TOKEN")
 ENV = os.getenv("ENV", "development").lower()
 
-if not OPENAI_API_KEY:
-    raise RuntimeError("OPENAI_API_KEY is not set. Put it in .env or export it before running.")
-
-# --- Init app/client ---
-client = OpenAI(api_key=OPENAI_API_KEY)
-app = Flask(__name__, static_folder="web", static_url_path="")
-app.secret_key = os.getenv("FLASK_SECRET", "dev-secret")
-app.permanent_session_lifetime = timedelta(days=30)
-app.config.update(
-    SESSION_COOKIE_NAME="nc_session",
-    SESSION_COOKIE_HTTPONLY=True,
-    SESSION_COOKIE_SAMESITE="Lax",
-)
-if ENV == "production":
-    app.config.update(SESSION_COOKIE_SECURE=True)
-
-storage_uri = os.getenv("RATELIMIT_STORAGE_URI", "memory://")
-try:
-    limiter = Limiter(get_remote_address, app=app, storage_uri=storage_uri)
-except Exception:
-    app.logger.warning("Limiter storage '%s' unavailable; falling back to memory://", storage_uri)
-    limiter = Limiter(get_remote_address, app=app, storage_uri="memory://")
-
-
-BCRYPT_PREFIX_RE = re.compile(r"^\$2[aby]?\$")
+# Routes live on this blueprint; create_app() registers it. Limits are declared
+# here and bound to the app's storage by limiter.init_app().
+bp = Blueprint("coach", __name__)
+limiter = Limiter(get_remote_address, on_breach=metrics.on_ratelimit_breach)
+
+
+def create_app() -> Flask:
+    """Build the Flask app. Opens no connections; services start on first use (see services.py, db.py)."""
+    # STATIC_DIR=build/web serves the fingerprinted/precompressed output of build_assets.py
+    app = Flask(__name__, static_folder=os.getenv("STATIC_DIR", "web"), static_url_path="")
+    app.secret_key = os.getenv("FLASK_SECRET", "dev-secret")
+    app.permanent_session_lifetime = timedelta(days=30)
+    app.config.update(
+        SESSION_COOKIE_NAME="nc_session",
+        SESSION_COOKIE_HTTPONLY=True,
+        SESSION_COOKIE_SAMESITE="Lax",
+    )
+    if ENV == "production":
+        app.config.update(SESSION_COOKIE_SECURE=True)
 
+    storage_uri = os.getenv("RATELIMIT_STORAGE_URI", "memory://")
+    # RATELIMIT_ENABLED=0 switches limits off (load benchmarks drive everything from one IP)
+    app.config["RATELIMIT_ENABLED"] = os.getenv("RATELIMIT_ENABLED", "1") != "0"
+    app.config["RATELIMIT_STORAGE_URI"] = storage_uri
+    try:
+        limiter.init_app(app)
+    except Exception:
+        app.logger.warning("Limiter storage '%s' unavailable; falling back to memory://", storage_uri)
+        app.config["RATELIMIT_STORAGE_URI"] = "memory://"
+        limiter.init_app(app)
 
-def is_bcrypt_hash(h: str) -> bool:
-    return bool(h) and bool(BCRYPT_PREFIX_RE.match(h or ""))
+    metrics.init_app(app)
+    static_assets.init_app(app)
+    app.register_blueprint(bp)
+    return app
 
 
 def hash_password(plain: str) -> str:
-    return bcrypt.hashpw(plain.encode(), bcrypt.gensalt()).decode()
+    return passwords.hash_password(plain)
 
 
 def verify_password(plain: str, hashed: str) -> bool:
     """True if hashed is valid bcrypt and matches; otherwise False (no exceptions)."""
-    if not is_bcrypt_hash(hashed):
-        return False
-    try:
-        return bcrypt.checkpw(plain.encode(), hashed.encode())
-    except Exception:
-        return False
+    return passwords.verify_password(plain, hashed)
 
 
 def require_login():
@@ -115,14 +120,22 @@ def hash_token(raw: str) -> str:
     return hashlib.sha256(raw.encode("utf-8")).hexdigest()
 
 # --- Serve homepage (same-origin) ---
-@app.get("/")
+@bp.get("/")
 def home():
-    return send_from_directory("web", "index.html")
+    return current_app.view_functions["static"](filename="index.html")
 
-@app.get("/health")
+@bp.get("/health")
 def health():
     ok = True
-    details = {"model": MODEL, "fallback_model": FALLBACK_MODEL}
+    quota = services.get_quota()
+    details = {
+        "model": MODEL,
+        "fallback_model": FALLBACK_MODEL,
+        "llm_backend": services.get_llm().name,
+        "llm_breaker": llm_fallback.breaker.snapshot(),
+        "reply_cache": services.get_reply_cache().stats(),
+        "llm_quota": quota.counters.name if quota.counters is not None else "off",
+    }
     try:
         spath = os.path.join(os.path.dirname(__file__), "system_prompt.md")
         details["system_prompt_exists"] = os.path.exists(spath)
@@ -134,7 +147,7 @@ def health():
 
 # --- Basic auth endpoints ---
 
-@app.post("/signup")
+@bp.post("/signup")
 def signup():
     data = request.get_json(force=True)
     email = (data.get("email") or "").strip().lower()
@@ -154,18 +167,14 @@ def signup():
 
         user.password_hash = hash_password(password)
         sess.add(user)
-        sess.commit()
 
+        # Token and its email commit together; outbox_worker delivers it
         raw = generate_token_raw()
         th = hash_token(raw)
         issue_token(sess, user, token_hash=th, purpose="verify", ttl_minutes=60)
+        enqueue_email(sess, email, **verification_email(raw))
         sess.commit()
 
-        try:
-            send_verification_email(email, raw)
-        except Exception as e:
-            print(f"Email send failed: {e}")
-
         return (
             jsonify({"ok": True, "message": "Account created. Please verify via email."}),
             201,
@@ -174,7 +183,7 @@ def signup():
         sess.close()
 
 
-@app.post("/login")
+@bp.post("/login")
 @limiter.limit("5 per minute")
 def login():
     try:
@@ -187,10 +196,10 @@ def login():
         sess = get_session()
         try:
             user = sess.query(User).filter(User.email == email).first()
-            # constant-time dummy to equalize timing a bit
-            _ = bcrypt.checkpw(b"dummy", bcrypt.hashpw(b"dummy", bcrypt.gensalt()))
-
-            if not user or not user.password_hash or not verify_password(password, user.password_hash):
+            stored = user.password_hash if user else None
+            # Exactly one bcrypt per attempt: unknown users and legacy hashes
+            # are checked against the precomputed dummy hash
+            if not verify_password(password, stored):
                 # If the stored hash is legacy (not bcrypt), force a reset rather than 500
                 if user and user.password_hash and not is_bcrypt_hash(user.password_hash):
                     return jsonify({"ok": False, "error": "password needs reset"}), 401
@@ -199,6 +208,13 @@ def login():
             if not user.is_verified:
                 return jsonify({"ok": False, "error": "user not verified"}), 403
 
+            if passwords.needs_rehash(stored):
+                # BCRYPT_ROUNDS changed since this hash was written; upgrade it now
+                user.password_hash = hash_password(password)
+                sess.add(user)
+                sess.commit()
+                services.get_profile_cache().invalidate(user.id)
+
             # success: session + CSRF cookie
             session.permanent = True
             session["user_id"] = user.id
@@ -209,12 +225,12 @@ def login():
         finally:
             sess.close()
     except Exception as e:
-        app.logger.error("LOGIN exception: %s", e)
-        app.logger.error("Trace:\n%s", traceback.format_exc())
+        current_app.logger.error("LOGIN exception: %s", e)
+        current_app.logger.error("Trace:\n%s", traceback.format_exc())
         return jsonify({"ok": False, "error": "internal error"}), 500
 
 
-@app.post("/logout")
+@bp.post("/logout")
 def logout():
     session.clear()
     resp = jsonify({"ok": True})
@@ -222,7 +238,7 @@ def logout():
     return resp
 
 
-@app.post("/admin/set_password")
+@bp.post("/admin/set_password")
 def admin_set_password():
     """
     Admin-only endpoint to reset a user's password.
@@ -250,26 +266,58 @@ def admin_set_password():
         user.password_hash = hash_password(new_password)
         sess.add(user)
         sess.commit()
+        services.get_profile_cache().invalidate(user.id)
         return jsonify({"ok": True, "message": f"Password reset for {email}"}), 200
     finally:
         sess.close()
 
+@bp.get("/admin/llm_usage")
+def admin_llm_usage():
+    """
+    Top LLM consumers from the llm_usage ledger.
+    Requires "Authorization: Bearer $ADMIN_SETUP_TOKEN"; ?hours=24&limit=20.
+    """
+    expected = os.getenv("ADMIN_SETUP_TOKEN")
+    header = request.headers.get("Authorization") or ""
+    if not expected or not secrets.compare_digest(header, f"Bearer {expected}"):
+        return jsonify({"ok": False, "error": "Unauthorized"}), 403
+    try:
+        hours = float(request.args.get("hours", "24"))
+        limit = max(1, min(int(request.args.get("limit", "20")), 500))
+    except ValueError:
+        return jsonify({"ok": False, "error": "Invalid input"}), 400
+    sess = get_session()
+    try:
+        return jsonify({"ok": True, "hours": hours, "consumers": top_llm_consumers(sess, hours, limit)})
+    finally:
+        sess.close()
+
 # --- User phase helpers ---
 
-@app.get("/me")
+@bp.get("/me")
 def me():
     uid = require_login()
     if not uid:
         return jsonify({"ok": False, "error": "not logged in"}), 401
-    sess = get_session()
-    try:
-        user = sess.get(User, uid)
-        if not user:
-            return jsonify({"ok": False, "error": "not found"}), 404
-        phase = user.phase if user.phase in ALLOWED_PHASES else "stabilize"
-        return jsonify({"ok": True, "user": {"id": user.id, "email": user.email, "phase": phase}})
-    finally:
-        sess.close()
+    profile = services.get_profile_cache().get(uid)
+    if profile is None:
+        sess = get_session()
+        try:
+            user = sess.get(User, uid)
+            if not user:
+                return jsonify({"ok": False, "error": "not found"}), 404
+            phase = user.phase if user.phase in ALLOWED_PHASES else "stabilize"
+            profile = {"id": user.id, "email": user.email, "phase": phase}
+        finally:
+            sess.close()
+        services.get_profile_cache().put(uid, profile)
+
+    resp = jsonify({"ok": True, "user": profile})
+    # Strong ETag over the exact body; the browser must revalidate and gets a 304 if unchanged
+    resp.set_etag(hashlib.sha256(resp.get_data()).hexdigest()[:32])
+    resp.headers["Cache-Control"] = "private, no-cache"
+    resp.vary.add("Cookie")
+    return resp.make_conditional(request)
 
 
 ALLOWED_PHASES = {
@@ -283,7 +331,7 @@ ALLOWED_PHASES = {
 }
 
 
-@app.post("/phase")
+@bp.post("/phase")
 @limiter.limit("10 per minute")
 def set_phase():
     uid = require_login()
@@ -302,20 +350,424 @@ def set_phase():
         user = sess.get(User, uid)
         if not user:
             return jsonify({"ok": False, "error": "not found"}), 404
+        journey_state.apply_patch(sess, uid, {"current_phase": phase}, initial=initial_journey_state(sess, uid))
         user.phase = phase
         sess.add(user)
         sess.commit()
+        services.get_profile_cache().invalidate(uid)
         return jsonify({"ok": True, "user": {"id": user.id, "email": user.email, "phase": user.phase}})
     finally:
         sess.close()
 
+# --- Journey state (see journey_state.py) ---
+
+def initial_journey_state(sess, uid):
+    """State at version 0: the phase from users.phase."""
+    user = sess.get(User, uid)
+    return {"current_phase": user.phase} if user and user.phase in ALLOWED_PHASES else {}
+
+def state_response(state, version, status=200):
+    resp = jsonify({"ok": True, "state": state, "version": version})
+    resp.status_code = status
+    resp.set_etag(str(version))
+    resp.headers["Cache-Control"] = "private, no-cache"
+    resp.vary.add("Cookie")
+    return resp
+
+@bp.get("/state")
+def get_state():
+    uid = require_login()
+    if not uid:
+        return jsonify({"ok": False, "error": "not logged in"}), 401
+    sess = get_session()
+    try:
+        state, version = journey_state.load(sess, uid)
+        if version == 0:
+            state = initial_journey_state(sess, uid)
+    finally:
+        sess.close()
+    return state_response(state, version).make_conditional(request)
+
+@bp.patch("/state")
+@limiter.limit("30 per minute")
+def patch_state():
+    """
+    JSON merge patch (application/merge-patch+json) onto the stored state.
+    If-Match: "<version>" makes it conditional; 412 with the current version if it moved on.
+    """
+    uid = require_login()
+    if not uid:
+        return jsonify({"ok": False, "error": "not logged in"}), 401
+    if not check_csrf(request):
+        return jsonify({"ok": False, "error": "invalid csrf"}), 403
+    patch = request.get_json(force=True, silent=True)
+    if patch is None:
+        return jsonify({"ok": False, "error": "invalid JSON"}), 400
+
+    expected = None
+    if request.if_match and not request.if_match.star_tag:
+        tags = request.if_match.as_set()
+        if len(tags) != 1 or not next(iter(tags)).isdigit():
+            return jsonify({"ok": False, "error": "If-Match must be a single state version"}), 412
+        expected = int(next(iter(tags)))
+
+    sess = get_session()
+    try:
+        try:
+            state, version = journey_state.apply_patch(
+                sess, uid, patch, expected, initial=initial_journey_state(sess, uid)
+            )
+        except journey_state.InvalidState as e:
+            return jsonify({"ok": False, "error": str(e)}), 400
+        except journey_state.VersionConflict as e:
+            resp = jsonify({"ok": False, "error": "version conflict", "version": e.version})
+            resp.set_etag(str(e.version))
+            return resp, 412
+        # users.phase mirrors current_phase for /me and the phase chip
+        phase = str(state.get("current_phase") or "").strip().lower()
+        user = sess.get(User, uid)
+        phase_changed = bool(user and phase in ALLOWED_PHASES and user.phase != phase)
+        if phase_changed:
+            user.phase = phase
+        sess.commit()
+    finally:
+        sess.close()
+    if phase_changed:
+        services.get_profile_cache().invalidate(uid)
+    return state_response(state, version)
+
+# --- KPIs (see kpis.py) ---
+
+@bp.post("/kpis/events")
+@limiter.limit("60 per minute")
+def post_kpi_events():
+    """
+    Log KPI events: {"metric": "leads", "value": 1, "occurred_at": "..."} or {"events": [...]}.
+    value defaults to 1 for counts; occurred_at defaults to now.
+    """
+    uid = require_login()
+    if not uid:
+        return jsonify({"ok": False, "error": "not logged in"}), 401
+    if not check_csrf(request):
+        return jsonify({"ok": False, "error": "invalid csrf"}), 403
+    data = request.get_json(silent=True)
+    raw = data.get("events") if isinstance(data, dict) and "events" in data else [data]
+    if not isinstance(raw, list) or not raw:
+        return jsonify({"ok": False, "error": "no events"}), 400
+    if len(raw) > kpis.KPI_EVENTS_PER_REQUEST:
+        return jsonify({"ok": False, "error": f"at most {kpis.KPI_EVENTS_PER_REQUEST} events per request"}), 413
+    try:
+        events = [kpis.parse_event(e) for e in raw]
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+
+    sess = get_session()
+    try:
+        n = kpis.record_events(sess, uid, events)
+        sess.commit()
+    finally:
+        sess.close()
+    return jsonify({"ok": True, "recorded": n}), 201
+
+@bp.get("/kpis/trend")
+def kpi_trend():
+    """Weekly KPI series from the rollups: ?weeks=12&metric=leads&metric=mood (default: all metrics)."""
+    uid = require_login()
+    if not uid:
+        return jsonify({"ok": False, "error": "not logged in"}), 401
+    try:
+        weeks = kpis.parse_weeks(request.args.get("weeks", "12"))
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    sess = get_session()
+    try:
+        data = kpis.trend(sess, uid, weeks, request.args.getlist("metric") or None)
+    finally:
+        sess.close()
+    resp = jsonify({"ok": True, **data})
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+# --- Application tracker (see applications.py) ---
+
+DUPLICATE_APPLICATION = "an application for this company, role and url already exists"
+
+@bp.get("/applications")
+def list_applications():
+    """Keyset-paginated: ?sort=recent|follow_up&status=applied&limit=50&cursor=<next_cursor>."""
+    uid = require_login()
+    if not uid:
+        return jsonify({"ok": False, "error": "not logged in"}), 401
+    try:
+        limit = int(request.args.get("limit", "50"))
+    except ValueError:
+        return jsonify({"ok": False, "error": "limit must be a number"}), 400
+    sess = get_session()
+    try:
+        page = applications.list_page(
+            sess,
+            uid,
+            status=request.args.getlist("status") or None,
+            sort=request.args.get("sort", "recent"),
+            limit=limit,
+            cursor=request.args.get("cursor") or None,
+        )
+    except applications.ApplicationError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    finally:
+        sess.close()
+    resp = jsonify({"ok": True, **page})
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+@bp.post("/applications")
+@limiter.limit("60 per minute")
+def create_application():
+    uid = require_login()
+    if not uid:
+        return jsonify({"ok": False, "error": "not logged in"}), 401
+    if not check_csrf(request):
+        return jsonify({"ok": False, "error": "invalid csrf"}), 403
+    data = request.get_json(silent=True)
+    try:
+        fields = applications.clean_fields({"source": "manual", **data} if isinstance(data, dict) else data)
+    except applications.ApplicationError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    sess = get_session()
+    try:
+        try:
+            app_row = applications.create(sess, uid, fields)
+            sess.commit()
+        except IntegrityError:
+            sess.rollback()
+            return jsonify({"ok": False, "error": DUPLICATE_APPLICATION}), 409
+        return jsonify({"ok": True, "application": applications.to_dict(app_row)}), 201
+    finally:
+        sess.close()
+
+@bp.get("/applications/<int:app_id>")
+def get_application(app_id):
+    uid = require_login()
+    if not uid:
+        return jsonify({"ok": False, "error": "not logged in"}), 401
+    sess = get_session()
+    try:
+        app_row = applications.get(sess, uid, app_id)
+        if app_row is None:
+            return jsonify({"ok": False, "error": "not found"}), 404
+        return jsonify({"ok": True, "application": applications.to_dict(app_row)})
+    finally:
+        sess.close()
+
+def change_application(app_id, data, partial=True):
+    """Shared by PATCH /applications/<id> and POST /applications/<id>/status."""
+    uid = require_login()
+    if not uid:
+        return jsonify({"ok": False, "error": "not logged in"}), 401
+    if not check_csrf(request):
+        return jsonify({"ok": False, "error": "invalid csrf"}), 403
+    sess = get_session()
+    try:
+        app_row = applications.get(sess, uid, app_id)
+        if app_row is None:
+            return jsonify({"ok": False, "error": "not found"}), 404
+        try:
+            applications.update(sess, app_row, applications.clean_fields(data, partial=partial))
+            sess.commit()
+        except applications.ApplicationError as e:
+            sess.rollback()
+            return jsonify({"ok": False, "error": str(e), "allowed_transitions": list(applications.allowed_transitions(app_row.status))}), 400
+        except IntegrityError:
+            sess.rollback()
+            return jsonify({"ok": False, "error": DUPLICATE_APPLICATION}), 409
+        return jsonify({"ok": True, "application": applications.to_dict(app_row)})
+    finally:
+        sess.close()
+
+@bp.patch("/applications/<int:app_id>")
+@limiter.limit("60 per minute")
+def update_application(app_id):
+    """Partial update; only the keys present change. "next_follow_up": null clears the date."""
+    return change_application(app_id, request.get_json(silent=True))
+
+@bp.post("/applications/<int:app_id>/status")
+@limiter.limit("60 per minute")
+def transition_application(app_id):
+    """{"status": "applied", "next_follow_up": "2024-06-01"}; 400 if the move is not allowed."""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not data.get("status"):
+        return jsonify({"ok": False, "error": "status is required"}), 400
+    return change_application(app_id, {k: data[k] for k in ("status", "next_follow_up") if k in data})
+
+@bp.delete("/applications/<int:app_id>")
+@limiter.limit("60 per minute")
+def delete_application(app_id):
+    uid = require_login()
+    if not uid:
+        return jsonify({"ok": False, "error": "not logged in"}), 401
+    if not check_csrf(request):
+        return jsonify({"ok": False, "error": "invalid csrf"}), 403
+    sess = get_session()
+    try:
+        app_row = applications.get(sess, uid, app_id)
+        if app_row is None:
+            return jsonify({"ok": False, "error": "not found"}), 404
+        sess.delete(app_row)
+        sess.commit()
+        return jsonify({"ok": True})
+    finally:
+        sess.close()
+
+@bp.post("/applications/import")
+@limiter.limit("10 per hour")
+def import_applications():
+    """
+    Body is text/csv or application/x-ndjson, streamed and inserted in batches.
+    ?source=linkedin tags the rows (default: import).
+    """
+    uid = require_login()
+    if not uid:
+        return jsonify({"ok": False, "error": "not logged in"}), 401
+    if not check_csrf(request):
+        return jsonify({"ok": False, "error": "invalid csrf"}), 403
+    mimetype = request.mimetype
+    if mimetype in ("text/csv", "application/csv"):
+        rows = applications.csv_rows(request.stream)
+    elif mimetype in ("application/x-ndjson", "application/jsonl", "application/x-jsonlines"):
+        rows = applications.ndjson_rows(request.stream)
+    else:
+        return jsonify({"ok": False, "error": "send text/csv or application/x-ndjson"}), 415
+    source = (request.args.get("source") or "import").strip().lower()[:50]
+
+    sess = get_session()
+    try:
+        try:
+            result = applications.import_rows(sess, uid, rows, source=source)
+        except (UnicodeDecodeError, csv.Error) as e:
+            sess.rollback()
+            return jsonify({"ok": False, "error": f"unreadable file: {e}"}), 400
+    finally:
+        sess.close()
+    return jsonify({"ok": True, **result})
+
+# --- Reply history (see reply_history.py) ---
+
+@bp.get("/history")
+def list_history():
+    """Past coach replies, newest first, without their text: ?kind=plan&limit=20&cursor=<next_cursor>."""
+    uid = require_login()
+    if not uid:
+        return jsonify({"ok": False, "error": "not logged in"}), 401
+    kind = request.args.get("kind") or None
+    if kind and kind not in reply_history.KINDS:
+        return jsonify({"ok": False, "error": f"kind must be one of {', '.join(reply_history.KINDS)}"}), 400
+    try:
+        limit = int(request.args.get("limit", "20"))
+        before = int(request.args["cursor"]) if request.args.get("cursor") else None
+    except ValueError:
+        return jsonify({"ok": False, "error": "limit and cursor must be numbers"}), 400
+    sess = get_session()
+    try:
+        page = reply_history.list_page(sess, uid, kind, limit, before)
+    finally:
+        sess.close()
+    resp = jsonify({"ok": True, **page})
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+@bp.get("/history/<int:entry_id>")
+def get_history_entry(entry_id):
+    """One past reply with its markdown; the ETag is the content hash, so revalidation is a 304."""
+    uid = require_login()
+    if not uid:
+        return jsonify({"ok": False, "error": "not logged in"}), 401
+    sess = get_session()
+    try:
+        entry = reply_history.get(sess, uid, entry_id)
+    finally:
+        sess.close()
+    if entry is None:
+        return jsonify({"ok": False, "error": "not found"}), 404
+    resp = jsonify({"ok": True, "entry": entry})
+    resp.set_etag(entry["hash"])
+    resp.headers["Cache-Control"] = "private, no-cache"
+    resp.vary.add("Cookie")
+    return resp.make_conditional(request)
+
+# --- Search (see search.py) ---
+
+@bp.get("/search")
+@limiter.limit("60 per minute")
+def search_view():
+    """Ranked snippets from the user's past replies, notes and chat messages: ?q=ALV registration&source=reply&kind=plan."""
+    uid = require_login()
+    if not uid:
+        return jsonify({"ok": False, "error": "not logged in"}), 401
+    q = (request.args.get("q") or "").strip()
+    if not q:
+        return jsonify({"ok": False, "error": "q is required"}), 400
+    source = request.args.get("source") or None
+    if source and source not in search.SOURCES:
+        return jsonify({"ok": False, "error": f"source must be one of {', '.join(search.SOURCES)}"}), 400
+    try:
+        limit = int(request.args.get("limit", "10"))
+    except ValueError:
+        return jsonify({"ok": False, "error": "limit must be a number"}), 400
+    start = time.perf_counter()
+    sess = get_session()
+    try:
+        results = search.search(sess, uid, q, source, request.args.get("kind") or None, limit)
+    finally:
+        sess.close()
+    resp = jsonify({"ok": True, "results": results, "took_ms": round((time.perf_counter() - start) * 1000, 1)})
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+# --- Export (see export.py) ---
+
+@bp.get("/export")
+@limiter.limit("10 per hour")
+def export_data():
+    """
+    Everything stored for the user, streamed: ?format=ndjson|csv&section=messages.
+    Gzip is applied on the fly when the client accepts it; ?gzip=1 downloads a .gz file instead.
+    """
+    uid = require_login()
+    if not uid:
+        return jsonify({"ok": False, "error": "not logged in"}), 401
+    fmt = (request.args.get("format") or "ndjson").strip().lower()
+    if fmt not in export.FORMATS:
+        return jsonify({"ok": False, "error": f"format must be one of {', '.join(export.FORMATS)}"}), 400
+    section = request.args.get("section") or None
+    if section and section not in export.SECTIONS:
+        return jsonify({"ok": False, "error": f"section must be one of {', '.join(export.SECTIONS)}"}), 400
+
+    as_file = request.args.get("gzip") == "1"
+    encode = as_file or "gzip" in request.accept_encodings
+    filename = f"journey-export-{uid}-{datetime.utcnow():%Y%m%d}{'-' + section if section else ''}.{fmt}"
+    resp = Response(
+        export.stream(get_session, uid, fmt, section, gzip=encode),
+        mimetype="application/x-ndjson" if fmt == "ndjson" else "text/csv",
+    )
+    if as_file:
+        filename += ".gz"
+        resp.mimetype = "application/gzip"
+    elif encode:
+        resp.headers["Content-Encoding"] = "gzip"
+    resp.vary.add("Accept-Encoding")
+    resp.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    resp.headers["Cache-Control"] = "private, no-store"
+    # Tell nginx-style proxies not to buffer the stream
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
+
 # Forgot password
-@app.post("/forgot_password")
+@bp.post("/forgot_password")
 def forgot_password():
     """
     Accepts JSON: { "email": "user@example.com" }
     Always returns a generic success message without revealing whether the user exists.
-    If the user exists, creates a reset token (purpose='reset', default TTL 60m) and emails the link.
+    If the user exists, creates a reset token (purpose='reset', default TTL 60m) and queues the email.
     """
     data = request.get_json(silent=True) or {}
     email = (data.get("email") or "").strip().lower()
@@ -335,92 +787,366 @@ def forgot_password():
             th = hash_token(raw)
             # 60 minutes default TTL; adjust as desired
             issue_token(sess, user, token_hash=th, purpose="reset", ttl_minutes=30)
+            enqueue_email(sess, email, **password_reset_email(raw))
             sess.commit()
-            try:
-                send_password_reset_email(email, raw)
-            except Exception as e:
-                # Do not leak details to the client
-                print(f"[forgot_password] email send failed for {email}: {e}")
         # Always return generic success
         return generic_ok, 200
     finally:
         sess.close()
 
 
-# --- Load system prompt (fallback if missing/empty) ---
-SP_PATH = os.path.join(os.path.dirname(__file__), "system_prompt.md")
-DEFAULT_SYSTEM = (
-    "You are JTBD Journey Coach. You coach calmly and concretely through phases: "
-    "stabilize, reframe, position, explore, apply, secure, transition. "
-    "Be concise, practical, and encouraging. Prefer short lists, checklists, and micro-steps."
-)
-if os.path.exists(SP_PATH):
-    with open(SP_PATH, "r", encoding="utf-8") as f:
-        SYSTEM_PROMPT = (f.read() or "").strip() or DEFAULT_SYSTEM
-else:
-    SYSTEM_PROMPT = DEFAULT_SYSTEM
-
-def compose_prompt(kind, user_state, note):
-    header = (
-        "You are JTBD Journey Coach.\n"
-        "User state JSON:\n" + json.dumps(user_state or {}, ensure_ascii=False, indent=2) + "\n\n"
+# --- Prompts (see prompt_compiler.py) ---
+PROMPT_VERSION = prompt_compiler.PROMPT_VERSION
+
+def build_messages(kind, user_state, note):
+    return prompt_compiler.compile_coach(kind, user_state, note)
+
+def build_chat_messages(user_state, message, context_md="", context_kind="", summary="", turns=None):
+    return prompt_compiler.compile_chat(user_state, message, context_md, context_kind, summary, turns)
+
+def llm_events(messages, temperature):
+    """Hedged primary/fallback stream: ("delta", text) items, ("spent", model, usage) for a billed loser, then ("done", model, usage)."""
+    return llm_fallback.hedged_stream(
+        lambda model: services.get_llm().stream(model, messages, temperature),
+        MODEL,
+        FALLBACK_MODEL,
     )
-    task_map = {
-        "plan": "Please produce a **Weekly Plan** using your default output structure.",
-        "standup": "Please output a **Daily Stand-up** using the template.",
-        "gate": "Run a **Phase Gate Review** for the current phase.",
-        "triage": "Run **Setback Triage**. Keep it concise and directive."
-    }
-    task = task_map.get(kind, "Provide guidance using the default structure.")
-    if note:
-        task += f"\nContext note from user: {note}"
-    return header + task
-
-def respond(kind, user_state, note):
-    prompt = compose_prompt(kind, user_state, note)
-    comp = client.chat.completions.create(
-        model=MODEL,
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.3
+
+def record_usage(kind, model, usage, lease=None, spent=()):
+    """
+    Count a finished call's tokens in metrics and, for an admitted caller, in the quota and the llm_usage ledger.
+    spent is [(model, usage)] for hedge attempts that lost the race but were still billed.
+    """
+    billed = [(m, u) for m, u in [(model, usage), *spent] if u]
+    for m, u in billed:
+        metrics.record_llm_usage(kind, m, u)
+    if lease is None or not billed:
+        return
+    lease.charge(sum(u.get("total_tokens") or 0 for _, u in billed))
+    sess = get_session()
+    try:
+        for m, u in billed:
+            add_llm_usage(sess, lease.subject, lease.user_id, kind, m, u)
+        sess.commit()
+    except Exception:
+        # Never fail a reply the user already has over bookkeeping
+        traceback.print_exc()
+    finally:
+        sess.close()
+
+def completion(kind, messages, temperature, lease=None):
+    """(text, model) of one chat completion (streamed internally so the fallback can hedge), timed and token-counted per kind."""
+    start = time.perf_counter()
+    parts = []
+    model, usage, spent = MODEL, None, []
+    try:
+        for event in llm_events(messages, temperature):
+            if event[0] == "delta":
+                parts.append(event[1])
+            elif event[0] == "spent":
+                spent.append(event[1:])
+            else:
+                _, model, usage = event
+    except Exception:
+        metrics.LLM_ERRORS.labels(kind, MODEL).inc()
+        raise
+    metrics.LLM_LATENCY.labels(kind, model).observe(time.perf_counter() - start)
+    record_usage(kind, model, usage, lease, spent)
+    return "".join(parts), model
+
+def complete(kind, messages, temperature, lease=None):
+    return completion(kind, messages, temperature, lease)[0]
+
+def save_reply(uid, kind, user_state, model, text, note=""):
+    """Add a reply to the user's history and search index, with the note that asked for it; anonymous replies are not kept."""
+    if not uid or not text or not reply_history.REPLY_HISTORY_ENABLED:
+        return
+    sess = get_session()
+    try:
+        entry_id = reply_history.record(sess, uid, kind, user_state, model, text)
+        search.index(sess, uid, "reply", kind, entry_id, text)
+        if isinstance(note, str) and note.strip():
+            search.index(sess, uid, "note", kind, entry_id, note)
+        sess.commit()
+    except Exception:
+        # The reply itself already went out; a lost history entry is not worth a 500
+        traceback.print_exc()
+    finally:
+        sess.close()
+
+def cache_key(kind, user_state, note):
+    # States that compile to the same prompt share an entry
+    return reply_cache.make_key(kind, prompt_compiler.compact_state(user_state), note, MODEL, PROMPT_VERSION)
+
+def store_reply(key, text, model):
+    """Cache a generated reply. Keys carry MODEL, so a reply the fallback model wrote is not cached under them."""
+    if model == MODEL:
+        services.get_reply_cache().set(key, text)
+
+def respond_with_model(kind, user_state, note, regenerate=False, lease=None, uid=None):
+    """(text, model) coach reply for kind; served from the reply cache unless regenerate is set. Logged-in users keep it in history."""
+    key = cache_key(kind, user_state, note)
+    if not regenerate:
+        cached = services.get_reply_cache().get(key)
+        if cached is not None:
+            save_reply(uid, kind, user_state, MODEL, cached, note)
+            return cached, MODEL
+    text, model = completion(kind, build_messages(kind, user_state, note), temperature=0.3, lease=lease)
+    store_reply(key, text, model)
+    save_reply(uid, kind, user_state, model, text, note)
+    return text, model
+
+def respond(kind, user_state, note, regenerate=False, lease=None, uid=None):
+    return respond_with_model(kind, user_state, note, regenerate, lease, uid)[0]
+
+# --- Chat conversations (see conversations.py) ---
+
+def parse_conversation_id(data):
+    """conversation_id from a /chat body: None for a new conversation; raises ValueError if malformed."""
+    raw = data.get("conversation_id")
+    if raw in (None, ""):
+        return None
+    return int(raw)
+
+def begin_chat_turn(uid, conversation_id, message, context_md="", context_kind=""):
+    """
+    Store the user's message and return what the prompt needs:
+    {"conversation_id", "context_md", "context_kind", "summary", "turns"}.
+    None if conversation_id is not one of this user's conversations.
+    """
+    sess = get_session()
+    try:
+        conv = conversations.open_conversation(sess, uid, conversation_id, context_md, context_kind)
+        if conv is None:
+            return None
+        turn = {
+            "conversation_id": conv.id,
+            "context_md": conv.context_md,
+            "context_kind": conv.context_kind,
+            "summary": conv.summary,
+            "turns": conversations.recent_turns(sess, conv),
+        }
+        conversations.add_message(sess, conv.id, "user", message)
+        search.index(sess, uid, "message", "chat", conv.id, message)
+        sess.commit()
+        return turn
+    finally:
+        sess.close()
+
+def store_chat_reply(conversation_id, reply):
+    """Store the coach's reply; returns conversations.pending_summary() for the conversation."""
+    sess = get_session()
+    try:
+        conversations.add_message(sess, conversation_id, "assistant", reply)
+        pending = conversations.pending_summary(sess, conversation_id)
+        sess.commit()
+        return pending
+    finally:
+        sess.close()
+
+def save_chat_summary(conversation_id, pending, summary):
+    sess = get_session()
+    try:
+        conversations.save_summary(sess, conversation_id, pending["from"], pending["through"], summary)
+        sess.commit()
+    finally:
+        sess.close()
+
+def refresh_chat_summary(conversation_id, pending, lease=None):
+    """Fold the overflowing turns into the summary; runs after the reply was sent."""
+    if not pending:
+        return
+    try:
+        summary = complete(
+            "summary", prompt_compiler.compile_summary(pending["summary"], pending["turns"]), temperature=0, lease=lease
+        )
+        save_chat_summary(conversation_id, pending, summary.strip())
+    except Exception:
+        # The window just stays wider until the next turn retries
+        traceback.print_exc()
+
+def refresh_chat_summary_on_close(conversation_id, pending, lease):
+    """call_on_close hook: free the caller's in-flight slot first, then summarize (the reply is already out)."""
+    lease.release()
+    refresh_chat_summary(conversation_id, pending, lease)
+
+def chat_messages(user_state, message, context_md="", context_kind="", turn=None):
+    if turn is None:
+        return build_chat_messages(user_state, message, context_md, context_kind)
+    return build_chat_messages(
+        user_state, message, turn["context_md"], turn["context_kind"], turn["summary"], turn["turns"]
     )
-    return comp.choices[0].message.content
-
-def respond_chat(user_state, message, context_md="", context_kind=""):
-    system = (
-        SYSTEM_PROMPT +
-        "\nIf context_md is provided, treat it as the user's current panel. "
-        "When they say 'bullet 1' or 'the first item', identify the first actionable bullet "
-        "from context_md and help them complete it step-by-step with concrete instructions."
+
+def respond_chat(user_state, message, context_md="", context_kind="", turn=None, lease=None, uid=None):
+    """Chat reply; with a turn from begin_chat_turn the reply is stored and the pending summary returned too."""
+    text, model = completion(
+        "chat", chat_messages(user_state, message, context_md, context_kind, turn), temperature=0.2, lease=lease
     )
-    messages = [
-        {"role": "system", "content": system},
-        {"role": "user", "content": "State JSON:\n" + json.dumps(user_state or {}, ensure_ascii=False)}
-    ]
-    if context_md:
-        messages.append({
-            "role": "user",
-            "content": f"Context ({context_kind or 'panel'}; markdown the user is seeing):\n{context_md}"
-        })
-    messages.append({"role": "user", "content": message})
-
-    comp = client.chat.completions.create(
-        model=MODEL,
-        messages=messages,
-        temperature=0.2
+    save_reply(uid, "chat", user_state, model, text)
+    if turn is None:
+        return text, None
+    return text, store_chat_reply(turn["conversation_id"], text)
+
+# --- Streaming (Server-Sent Events) ---
+
+def wants_stream(req):
+    """True if the client asked for SSE via ?stream=1 or Accept: text/event-stream."""
+    if (req.args.get("stream") or "").strip().lower() in ("1", "true", "yes"):
+        return True
+    return "text/event-stream" in (req.headers.get("Accept") or "")
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def stream_completion(kind, messages, temperature, on_complete=None, done_extra=None, lease=None):
+    """
+    Yield SSE frames for a streamed chat completion:
+      event: chunk  data: {"delta": "..."}      (one per token batch from the model)
+      event: done   data: {"model": ..., "usage": {...}}
+      event: error  data: {"error": "..."}      (headers are already sent, so no 500)
+    on_complete(text, model) is called with the full reply once the stream finished cleanly;
+    done_extra is merged into the done event.
+    """
+    model, usage, spent = MODEL, None, []
+    parts = []
+    start = time.perf_counter()
+    try:
+        for event in llm_events(messages, temperature):
+            if event[0] == "delta":
+                parts.append(event[1])
+                yield sse_event("chunk", {"delta": event[1]})
+            elif event[0] == "spent":
+                spent.append(event[1:])
+            else:
+                _, model, usage = event
+    except Exception as e:
+        traceback.print_exc()
+        metrics.LLM_ERRORS.labels(kind, MODEL).inc()
+        yield sse_event("error", {"error": str(e)})
+        return
+    metrics.LLM_LATENCY.labels(kind, model).observe(time.perf_counter() - start)
+    record_usage(kind, model, usage, lease, spent)
+    if on_complete:
+        on_complete("".join(parts), model)
+    yield sse_event("done", {"model": model, "usage": usage, **(done_extra or {})})
+
+def respond_stream(kind, user_state, note, regenerate=False, lease=None, uid=None):
+    key = cache_key(kind, user_state, note)
+    if not regenerate:
+        cached = services.get_reply_cache().get(key)
+        if cached is not None:
+            save_reply(uid, kind, user_state, MODEL, cached, note)
+            return iter([
+                sse_event("chunk", {"delta": cached}),
+                sse_event("done", {"model": MODEL, "usage": None, "cached": True}),
+            ])
+    return stream_completion(
+        kind,
+        build_messages(kind, user_state, note),
+        temperature=0.3,
+        on_complete=lambda text, model: (store_reply(key, text, model), save_reply(uid, kind, user_state, model, text, note)),
+        lease=lease,
     )
-    return comp.choices[0].message.content
 
-def get_state_from_request(req):
+def respond_chat_stream(user_state, message, context_md="", context_kind="", turn=None, lease=None, uid=None, pending=None):
+    """SSE frames for /chat; with a turn, pending receives the summary work for the caller to run after the response."""
+    messages = chat_messages(user_state, message, context_md, context_kind, turn)
+    if turn is None:
+        return stream_completion(
+            "chat", messages, temperature=0.2, on_complete=lambda text, model: save_reply(uid, "chat", user_state, model, text), lease=lease
+        )
+
+    conversation_id = turn["conversation_id"]
+    pending = [] if pending is None else pending
+
+    def frames():
+        yield from stream_completion(
+            "chat",
+            messages,
+            temperature=0.2,
+            on_complete=lambda text, model: (
+                save_reply(uid, "chat", user_state, model, text),
+                pending.append(store_chat_reply(conversation_id, text)),
+            ),
+            done_extra={"conversation_id": conversation_id},
+            lease=lease,
+        )
+
+    return frames()
+
+def sse_response(events):
+    resp = Response(stream_with_context(events), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    # Disable proxy buffering (nginx / Render) so chunks reach the browser immediately
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
+
+def stored_user_state(uid):
+    """The user's journey state; before their first PATCH /state, just users.phase."""
+    sess = get_session()
+    try:
+        state, version = journey_state.load(sess, uid)
+        if version == 0:
+            state = initial_journey_state(sess, uid)
+        return state
+    finally:
+        sess.close()
+
+def request_user_state(data, uid=None):
+    """The posted user_state; a logged-in user who posts none gets their stored journey state."""
+    user_state = data.get("user_state")
+    if user_state is None and uid:
+        user_state = stored_user_state(uid)
+    return user_state if isinstance(user_state, dict) else {}
+
+def get_state_from_request(req, uid=None):
     data = req.get_json(silent=True) or {}
-    user_state = data.get("user_state") or {}
+    user_state = request_user_state(data, uid)
     note = data.get("note", "")
     return user_state, note
 
+def wants_regenerate(req):
+    """True if the client asked to bypass the reply cache (?regenerate=1 or {"regenerate": true})."""
+    if (req.args.get("regenerate") or "").strip().lower() in ("1", "true", "yes"):
+        return True
+    data = req.get_json(silent=True) or {}
+    return data.get("regenerate") is True
+
+# --- LLM quota (see llm_quota.py) ---
+
+def admit_llm_call():
+    """Lease for this caller's LLM request, released when the response closes; raises llm_quota.QuotaExceeded."""
+    lease = services.get_quota().admit(require_login(), get_remote_address())
+    g.llm_lease = lease
+    return lease
+
+def quota_error(e):
+    """429 body for a QuotaExceeded (also used by asgi.py)."""
+    metrics.LLM_QUOTA_REJECTIONS.labels(e.reason).inc()
+    return {"error": "Too many requests", "reason": e.reason, "retry_after": e.retry_after}
+
+@bp.app_errorhandler(llm_quota.QuotaExceeded)
+def llm_quota_exceeded(e):
+    resp = jsonify(quota_error(e))
+    resp.headers["Retry-After"] = str(e.retry_after)
+    return resp, 429
+
+@bp.after_app_request
+def release_llm_lease(resp):
+    # Streams keep the slot until the last frame is sent
+    lease = g.pop("llm_lease", None)
+    if lease is not None:
+        resp.call_on_close(lease.release)
+    return resp
+
+@bp.teardown_app_request
+def release_llm_lease_on_error(exc):
+    lease = g.pop("llm_lease", None)
+    if lease is not None:
+        lease.release()
+
 # --- Endpoints ---
-@app.post("/reset-password")
+@bp.post("/reset-password")
 @limiter.limit("3 per minute")
 def reset_password():
     """Legacy endpoint to initiate a password reset email."""
@@ -440,66 +1166,104 @@ def reset_password():
             raw = generate_token_raw()
             th = hash_token(raw)
             issue_token(sess, user, token_hash=th, purpose="reset", ttl_minutes=30)
+            enqueue_email(sess, email, **password_reset_email(raw))
             sess.commit()
-            send_password_reset_email(email, raw)
             return generic_resp, 200
         finally:
             sess.close()
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
-@app.post("/plan")
+@bp.post("/plan")
 def plan():
+    lease = admit_llm_call()
     try:
-        user_state, note = get_state_from_request(request)
-        text = respond("plan", user_state, note)
+        uid = require_login()
+        user_state, note = get_state_from_request(request, uid)
+        if wants_stream(request):
+            return sse_response(respond_stream("plan", user_state, note, wants_regenerate(request), lease, uid))
+        text = respond("plan", user_state, note, wants_regenerate(request), lease, uid)
         return jsonify({"reply": text})
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
-@app.post("/standup")
+@bp.post("/standup")
 def standup():
+    lease = admit_llm_call()
     try:
-        user_state, note = get_state_from_request(request)
-        text = respond("standup", user_state, note)
+        uid = require_login()
+        user_state, note = get_state_from_request(request, uid)
+        if wants_stream(request):
+            return sse_response(respond_stream("standup", user_state, note, wants_regenerate(request), lease, uid))
+        text = respond("standup", user_state, note, wants_regenerate(request), lease, uid)
         return jsonify({"reply": text})
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
-@app.post("/gate")
+@bp.post("/gate")
 def gate():
+    lease = admit_llm_call()
     try:
-        user_state, note = get_state_from_request(request)
-        text = respond("gate", user_state, note)
+        uid = require_login()
+        user_state, note = get_state_from_request(request, uid)
+        if wants_stream(request):
+            return sse_response(respond_stream("gate", user_state, note, wants_regenerate(request), lease, uid))
+        text = respond("gate", user_state, note, wants_regenerate(request), lease, uid)
         return jsonify({"reply": text})
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
-@app.post("/triage")
+@bp.post("/triage")
 def triage():
+    lease = admit_llm_call()
     try:
-        user_state, note = get_state_from_request(request)
-        text = respond("triage", user_state, note)
+        uid = require_login()
+        user_state, note = get_state_from_request(request, uid)
+        if wants_stream(request):
+            return sse_response(respond_stream("triage", user_state, note, wants_regenerate(request), lease, uid))
+        text = respond("triage", user_state, note, wants_regenerate(request), lease, uid)
         return jsonify({"reply": text})
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
-@app.post("/chat")
+@bp.post("/chat")
 def chat():
+    lease = admit_llm_call()
     try:
         data = request.get_json(silent=True) or {}
-        user_state = data.get("user_state") or {}
+        user_state = request_user_state(data, require_login())
         message = (data.get("message") or "").strip()
         context_md = (data.get("context_md") or "").strip()
         context_kind = (data.get("context_kind") or "").strip()
         if not message:
             return jsonify({"reply": "Please type a message."})
-        text = respond_chat(user_state, message, context_md, context_kind)
-        return jsonify({"reply": text})
+        # Logged-in users get a stored conversation; anonymous chat stays stateless
+        turn = None
+        uid = require_login()
+        if uid:
+            try:
+                conversation_id = parse_conversation_id(data)
+            except (TypeError, ValueError):
+                return jsonify({"error": "invalid conversation_id"}), 400
+            turn = begin_chat_turn(uid, conversation_id, message, context_md, context_kind)
+            if turn is None:
+                return jsonify({"error": "conversation not found"}), 404
+        if wants_stream(request):
+            pending = []
+            resp = sse_response(respond_chat_stream(user_state, message, context_md, context_kind, turn, lease, uid, pending))
+            if turn is not None:
+                resp.call_on_close(lambda: refresh_chat_summary_on_close(turn["conversation_id"], pending[0] if pending else None, lease))
+            return resp
+        text, pending = respond_chat(user_state, message, context_md, context_kind, turn, lease, uid)
+        if turn is None:
+            return jsonify({"reply": text})
+        resp = jsonify({"reply": text, "conversation_id": turn["conversation_id"]})
+        resp.call_on_close(lambda: refresh_chat_summary_on_close(turn["conversation_id"], pending, lease))
+        return resp
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
@@ -541,31 +1305,35 @@ RESET_SUCCESS_HTML = """
 </html>
 """
 
-@app.get("/reset")
+@bp.get("/reset")
 def reset_view():
     token = request.args.get("token", "")
     user = validate_reset_token(token)
     return render_template_string(RESET_FORM_HTML, token=token, user=user, error=None)
 
 
-@app.post("/reset")
+@bp.post("/reset")
+@limiter.limit("5 per minute")
 def reset_submit():
     token = request.form.get("token", "")
     password = request.form.get("password", "")
     confirm = request.form.get("confirm", "")
-    user = validate_reset_token(token)
 
     if (
-        not user
+        not token
         or not password
         or len(password) < 8
         or password != confirm
     ):
         return render_template_string(RESET_SUCCESS_HTML), 200
 
+    # A made-up or spent token costs one indexed lookup, not a bcrypt
+    if validate_reset_token(token) is None:
+        return render_template_string(RESET_SUCCESS_HTML), 200
+
+    # Token consumption and password update still happen in one transaction
     phash = hash_password(password)
-    set_user_password(user["user_id"], phash)
-    consume_token(token, "reset")
+    reset_password_with_token(token, phash)
     return render_template_string(RESET_SUCCESS_HTML), 200
 
 
@@ -590,25 +1358,23 @@ VERIFY_SUCCESS_HTML = """
 """
 
 
-@app.get("/verify")
+@bp.get("/verify")
 @limiter.limit("3 per minute")
 def verify_view():
     token = request.args.get("token", "").strip()
-    user = validate_verification_token(token)
-    if not user:
-        return render_template_string(VERIFY_ERROR_HTML, message="Invalid or expired verification link."), 400
     try:
-        mark_user_verified(user["user_id"])
-        consume_token(token, "verify")
+        user_id = verify_email_with_token(token)
     except Exception as e:
         # Log and show a generic error
         import logging
-        logging.exception("mark_user_verified failed")
+        logging.exception("verify_email_with_token failed")
         return render_template_string(VERIFY_ERROR_HTML, message="Could not complete verification. Please try again."), 500
+    if not user_id:
+        return render_template_string(VERIFY_ERROR_HTML, message="Invalid or expired verification link."), 400
     return render_template_string(VERIFY_SUCCESS_HTML), 200
 
 
-@app.get("/_dev_issue_token")
+@bp.get("/_dev_issue_token")
 def _dev_issue_token():
     """
     DEV-ONLY: Creates a token row in the database for a user and (optionally) emails it.
@@ -674,7 +1440,7 @@ def _dev_issue_token():
         sess.close()
 
 
-@app.get("/_mail_test")
+@bp.get("/_mail_test")
 def _mail_test():
     """Send a test email to verify SMTP is working."""
     to = request.args.get("to", os.environ.get("EMAIL_FROM"))
@@ -685,7 +1451,7 @@ def _mail_test():
         return str(e), 500
 
 
-@app.get("/_mail_reset_test")
+@bp.get("/_mail_reset_test")
 def _mail_reset_test():
     """
     Dev-only helper: sends a password reset email to ?to=<email>
@@ -717,7 +1483,7 @@ def _mail_reset_test():
         sess.close()
 
 
-@app.get("/_mail_verify_test")
+@bp.get("/_mail_verify_test")
 def _mail_verify_test():
     """
     Dev-only helper: sends a verification email to ?to=<email>
@@ -737,7 +1503,7 @@ def _mail_verify_test():
         return str(e), 500
 
 
-@app.after_request
+@bp.after_app_request
 def security_headers(resp):
     resp.headers["X-Frame-Options"] = "DENY"
     resp.headers["X-Content-Type-Options"] = "nosniff"
@@ -755,6 +1521,8 @@ def security_headers(resp):
     )
     return resp
 
+app = create_app()
+
 if __name__ == "__main__":
     print(f"Starting JTBD Coach on http://localhost:{PORT} (model={MODEL}, fallback={FALLBACK_MODEL})")
     app.run(host="0.0.0.0", port=PORT, debug=True)
@@ -0,0 +1,340 @@
+"""
+Application tracker: leads and applications for the Apply phase.
+
+Each row is one opportunity with a status that moves along STATUS_FLOW
+(lead -> contacted -> applied -> screening -> interviewing -> offer ->
+accepted, or rejected / withdrawn from any open status) and an optional
+next_follow_up date. Rows are deduplicated per user on company + role + url,
+so re-importing the same export adds nothing twice.
+
+Listing uses keyset pagination: the cursor encodes the sort key of the last
+row, so page 100 costs the same as page 1.
+  sort=recent      newest first                (idx_applications_user_id)
+  sort=follow_up   next_follow_up, soonest first; rows without a date are left out
+                   (idx_applications_user_status_follow_up)
+
+Imports stream CSV or NDJSON from the request body and insert in batches
+with ON CONFLICT DO NOTHING; the body is never held in memory as a whole.
+CSV headers are matched case-insensitively against FIELD_ALIASES, so a
+LinkedIn export (Company, Position, URL, First Name, Last Name, ...) works
+as is.
+
+Settings (environment):
+  APPLICATIONS_IMPORT_BATCH=500       rows per INSERT
+  APPLICATIONS_IMPORT_MAX_ROWS=10000  rows per import request
+"""
+
+import os, io, csv, json, base64, hashlib, itertools
+from datetime import datetime, date
+from typing import Optional
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import Session
+
+from models import Application
+
+IMPORT_BATCH = int(os.getenv("APPLICATIONS_IMPORT_BATCH", "500"))
+IMPORT_MAX_ROWS = int(os.getenv("APPLICATIONS_IMPORT_MAX_ROWS", "10000"))
+MAX_ERRORS_REPORTED = 20
+PAGE_LIMIT_MAX = 200
+
+STATUSES = ("lead", "contacted", "applied", "screening", "interviewing", "offer", "accepted", "rejected", "withdrawn")
+CLOSED = ("accepted", "rejected", "withdrawn")
+STATUS_FLOW = {
+    "lead": ("contacted", "applied"),
+    "contacted": ("applied", "screening"),
+    "applied": ("screening", "interviewing"),
+    "screening": ("interviewing", "offer"),
+    "interviewing": ("offer",),
+    "offer": ("accepted",),
+}
+TEXT_FIELDS = {"company": 200, "role": 200, "url": 1000, "source": 50, "contact": 200, "location": 200, "notes": 4000}
+FIELD_ALIASES = {
+    "company": ("company", "company name", "organization", "employer"),
+    "role": ("role", "position", "title", "job title"),
+    "url": ("url", "link", "job url", "job link", "profile url"),
+    "source": ("source",),
+    "contact": ("contact", "contact name", "name", "recruiter"),
+    "location": ("location", "city"),
+    "notes": ("notes", "note", "comments"),
+    "status": ("status", "stage"),
+    "next_follow_up": ("next_follow_up", "next follow up", "follow up", "follow-up"),
+}
+
+
+class ApplicationError(ValueError):
+    pass
+
+
+def allowed_transitions(status: str) -> tuple:
+    if status in CLOSED:
+        return ()
+    return STATUS_FLOW.get(status, ()) + ("rejected", "withdrawn")
+
+
+def dedupe_key(company: str, role: str, url: str) -> str:
+    parts = [(company or "").strip().lower(), (role or "").strip().lower(), (url or "").strip().lower().rstrip("/")]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()[:32]
+
+
+def _parse_date(value) -> Optional[date]:
+    if value in (None, ""):
+        return None
+    try:
+        return date.fromisoformat(str(value).strip()[:10])
+    except ValueError:
+        raise ApplicationError("next_follow_up must be a YYYY-MM-DD date") from None
+
+
+def clean_fields(raw, partial: bool = False) -> dict:
+    """Validated column values from a request body; partial=True for PATCH (only the keys given)."""
+    if not isinstance(raw, dict):
+        raise ApplicationError("body must be a JSON object")
+    out = {}
+    for field, max_len in TEXT_FIELDS.items():
+        if field in raw or not partial:
+            value = raw.get(field)
+            value = "" if value is None else str(value).strip()
+            if len(value) > max_len:
+                raise ApplicationError(f"{field} is longer than {max_len} characters")
+            out[field] = value
+    if "company" in out and not out["company"]:
+        raise ApplicationError("company is required")
+    if "next_follow_up" in raw or not partial:
+        out["next_follow_up"] = _parse_date(raw.get("next_follow_up"))
+    if "status" in raw or not partial:
+        status = str(raw.get("status") or "lead").strip().lower()
+        if status not in STATUSES:
+            raise ApplicationError(f"status must be one of {', '.join(STATUSES)}")
+        out["status"] = status
+    return out
+
+
+def to_dict(app: Application) -> dict:
+    return {
+        "id": app.id,
+        "company": app.company,
+        "role": app.role,
+        "url": app.url,
+        "source": app.source,
+        "contact": app.contact,
+        "location": app.location,
+        "notes": app.notes,
+        "status": app.status,
+        "next_follow_up": app.next_follow_up.isoformat() if app.next_follow_up else None,
+        "status_changed_at": app.status_changed_at.isoformat() if app.status_changed_at else None,
+        "created_at": app.created_at.isoformat() if app.created_at else None,
+        "updated_at": app.updated_at.isoformat() if app.updated_at else None,
+        "allowed_transitions": list(allowed_transitions(app.status)),
+    }
+
+
+def get(sess: Session, user_id: int, app_id: int) -> Optional[Application]:
+    return sess.execute(
+        select(Application).where(Application.id == app_id, Application.user_id == user_id)
+    ).scalar_one_or_none()
+
+
+def create(sess: Session, user_id: int, fields: dict) -> Application:
+    """Insert a cleaned row; the caller commits (IntegrityError on a duplicate company/role/url)."""
+    now = datetime.utcnow()
+    app = Application(
+        user_id=user_id,
+        dedupe_key=dedupe_key(fields["company"], fields["role"], fields["url"]),
+        status_changed_at=now,
+        created_at=now,
+        updated_at=now,
+        **fields,
+    )
+    sess.add(app)
+    sess.flush()
+    return app
+
+
+def update(sess: Session, app: Application, fields: dict) -> Application:
+    """Apply cleaned partial fields; a status change must follow allowed_transitions()."""
+    now = datetime.utcnow()
+    status = fields.pop("status", app.status)
+    if status != app.status:
+        if status not in allowed_transitions(app.status):
+            raise ApplicationError(f"cannot move from {app.status} to {status}")
+        app.status = status
+        app.status_changed_at = now
+        if status in CLOSED and "next_follow_up" not in fields:
+            app.next_follow_up = None
+    for key, value in fields.items():
+        setattr(app, key, value)
+    app.dedupe_key = dedupe_key(app.company, app.role, app.url)
+    app.updated_at = now
+    sess.flush()
+    return app
+
+
+# --- keyset pagination ---
+
+def encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise ApplicationError("invalid cursor") from None
+    if not isinstance(values, list):
+        raise ApplicationError("invalid cursor")
+    return values
+
+
+def list_page(
+    sess: Session,
+    user_id: int,
+    status: Optional[list] = None,
+    sort: str = "recent",
+    limit: int = 50,
+    cursor: Optional[str] = None,
+) -> dict:
+    """{"items": [...], "next_cursor": str|None}; pass next_cursor back to get the following page."""
+    limit = max(1, min(int(limit), PAGE_LIMIT_MAX))
+    q = select(Application).where(Application.user_id == user_id)
+    if status:
+        bad = [s for s in status if s not in STATUSES]
+        if bad:
+            raise ApplicationError(f"unknown status '{bad[0]}'")
+        q = q.where(Application.status.in_(status))
+    after = decode_cursor(cursor) if cursor else None
+
+    if sort == "follow_up":
+        q = q.where(Application.next_follow_up.isnot(None))
+        if after:
+            try:
+                after_date, after_id = date.fromisoformat(after[0]), int(after[1])
+            except (ValueError, TypeError, IndexError):
+                raise ApplicationError("invalid cursor") from None
+            q = q.where(tuple_(Application.next_follow_up, Application.id) > tuple_(after_date, after_id))
+        q = q.order_by(Application.next_follow_up, Application.id)
+        key = lambda a: [a.next_follow_up.isoformat(), a.id]
+    elif sort == "recent":
+        if after:
+            try:
+                q = q.where(Application.id < int(after[0]))
+            except (ValueError, TypeError, IndexError):
+                raise ApplicationError("invalid cursor") from None
+        q = q.order_by(Application.id.desc())
+        key = lambda a: [a.id]
+    else:
+        raise ApplicationError("sort must be recent or follow_up")
+
+    rows = sess.execute(q.limit(limit + 1)).scalars().all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "items": [to_dict(a) for a in rows],
+        "next_cursor": encode_cursor(key(rows[-1])) if more else None,
+    }
+
+
+# --- streaming import ---
+
+def _header_map(headers) -> dict:
+    """CSV column name -> field, via FIELD_ALIASES; First/Last Name become contact."""
+    mapping = {}
+    for h in headers or []:
+        name = (h or "").strip().lower()
+        for field, aliases in FIELD_ALIASES.items():
+            if name in aliases and field not in mapping.values():
+                mapping[h] = field
+    return mapping
+
+
+def csv_rows(stream):
+    """Dicts of tracker fields from a CSV byte stream, read line by line."""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    # LinkedIn's Connections.csv starts with a few "Notes:" lines before the header
+    lines = iter(text)
+    for line in lines:
+        if "company" in _header_map(next(csv.reader([line]), [])).values():
+            lines = itertools.chain([line], lines)
+            break
+    else:
+        return
+    reader = csv.DictReader(lines)
+    mapping = _header_map(reader.fieldnames)
+    lower = {(h or "").strip().lower(): h for h in reader.fieldnames or []}
+    first, last = lower.get("first name"), lower.get("last name")
+    for row in reader:
+        item = {field: row.get(col) for col, field in mapping.items()}
+        if not item.get("contact") and (first or last):
+            item["contact"] = " ".join(p for p in (row.get(first) or "", row.get(last) or "") if p).strip()
+        yield item
+
+
+def ndjson_rows(stream):
+    """One JSON object per line from a byte stream; a bad line yields an ApplicationError in its place."""
+    for line in io.TextIOWrapper(stream, encoding="utf-8-sig"):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield ApplicationError("invalid JSON")
+
+
+def _insert_batch(sess: Session, rows: list) -> int:
+    if sess.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    stmt = insert(Application).values(rows).on_conflict_do_nothing(index_elements=["user_id", "dedupe_key"])
+    return sess.execute(stmt).rowcount or 0
+
+
+def import_rows(sess: Session, user_id: int, rows, source: str = "import", batch_size: int = IMPORT_BATCH) -> dict:
+    """
+    Validate and insert rows (an iterator of dicts) in batches, committing
+    each batch. Duplicates, within the file or with existing rows, are skipped.
+    Returns {"imported", "duplicates", "rejected", "errors": [{"row", "error"}], "truncated"}.
+    """
+    result = {"imported": 0, "duplicates": 0, "rejected": 0, "errors": [], "truncated": False}
+    batch, seen = [], set()
+    now = datetime.utcnow()
+
+    def flush():
+        inserted = _insert_batch(sess, batch)
+        sess.commit()
+        result["imported"] += inserted
+        result["duplicates"] += len(batch) - inserted
+        batch.clear()
+
+    for n, raw in enumerate(rows, start=1):
+        if n > IMPORT_MAX_ROWS:
+            result["truncated"] = True
+            break
+        try:
+            if isinstance(raw, Exception):
+                raise raw
+            fields = clean_fields({"source": source, **raw} if isinstance(raw, dict) else raw)
+        except ApplicationError as e:
+            result["rejected"] += 1
+            if len(result["errors"]) < MAX_ERRORS_REPORTED:
+                result["errors"].append({"row": n, "error": str(e)})
+            continue
+        key = dedupe_key(fields["company"], fields["role"], fields["url"])
+        if key in seen:
+            result["duplicates"] += 1
+            continue
+        seen.add(key)
+        batch.append({
+            "user_id": user_id,
+            "dedupe_key": key,
+            "status_changed_at": now,
+            "created_at": now,
+            "updated_at": now,
+            **fields,
+        })
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return result
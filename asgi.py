@@ -0,0 +1,422 @@
+"""
+ASGI entry point: async coach routes + the existing Flask app.
+
+POST /plan, /standup, /gate, /triage and /chat are served here with the
+async side of the LLM backend (AsyncOpenAI for LLM_BACKEND=openai), so an
+in-flight LLM call only holds a coroutine, not a worker.
+Every other path (auth, /me, /phase, static files, ...) is passed unchanged to
+the Flask app in app.py, which runs on a thread pool (ASGI_WSGI_THREADS,
+default 16) via a2wsgi.
+
+  uvicorn asgi:application --workers 2 --port 5055
+  gunicorn asgi:application -k uvicorn.workers.UvicornWorker -w 2
+
+The JSON / SSE contracts are the same as the sync views in app.py; see
+bench/concurrency.py for a sync vs async comparison.
+"""
+
+import os, json, time, asyncio, traceback
+from urllib.parse import parse_qsl
+
+from a2wsgi import WSGIMiddleware
+from itsdangerous import BadSignature
+from werkzeug.datastructures import Headers, MultiDict
+from werkzeug.http import parse_cookie
+
+import app as flask_app_module
+import metrics
+import llm_fallback
+import llm_quota
+import prompt_compiler
+import services
+from app import (
+    app as flask_app,
+    MODEL,
+    FALLBACK_MODEL,
+    build_messages,
+    chat_messages,
+    parse_conversation_id,
+    begin_chat_turn,
+    store_chat_reply,
+    save_chat_summary,
+    cache_key,
+    store_reply,
+    quota_error,
+    record_usage,
+    save_reply,
+    sse_event,
+    wants_stream,
+    wants_regenerate,
+    request_user_state,
+)
+
+COACH_ROUTES = {
+    "/plan": "plan",
+    "/standup": "standup",
+    "/gate": "gate",
+    "/triage": "triage",
+    "/chat": "chat",
+}
+
+wsgi_app = WSGIMiddleware(flask_app, workers=int(os.getenv("ASGI_WSGI_THREADS", "16")))
+
+# Same headers Flask's after_request hook adds to every response
+SECURITY_HEADERS = [
+    (k.lower().encode("latin-1"), v.encode("latin-1"))
+    for k, v in flask_app_module.security_headers(flask_app.response_class()).headers.items()
+    if k.lower() not in ("content-type", "content-length")
+]
+
+
+class CoachRequest:
+    """The subset of flask.Request the shared request helpers in app.py use."""
+
+    def __init__(self, scope, body: bytes):
+        self.path = scope["path"]
+        self.args = MultiDict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+        self.headers = Headers([(k.decode("latin-1"), v.decode("latin-1")) for k, v in scope.get("headers", [])])
+        self._body = body
+
+    def get_json(self, silent=False):
+        try:
+            return json.loads(self._body) if self._body else None
+        except ValueError:
+            if silent:
+                return None
+            raise
+
+
+def session_user_id(req):
+    """user_id from the Flask session cookie (same signing key and lifetime as app.py), or None."""
+    cookie = parse_cookie(req.headers.get("Cookie", "")).get(flask_app.config["SESSION_COOKIE_NAME"])
+    if not cookie:
+        return None
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    try:
+        data = serializer.loads(cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return None
+    return data.get("user_id")
+
+
+async def request_user_state_async(data, uid):
+    """request_user_state, with the stored-state lookup off the event loop."""
+    if data.get("user_state") is None and uid:
+        return await asyncio.to_thread(request_user_state, data, uid)
+    return request_user_state(data)
+
+
+# Reply cache and quota calls are Redis round trips with the Redis backends (and the
+# first one builds the client); like the DB helpers they run off the event loop
+
+def cache_get(key):
+    return services.get_reply_cache().get(key)
+
+
+def quota_admit(uid, ip):
+    return services.get_quota().admit(uid, ip)
+
+
+async def save_reply_async(uid, kind, user_state, model, text, note=""):
+    if uid:
+        await asyncio.to_thread(save_reply, uid, kind, user_state, model, text, note)
+
+
+# --- Async LLM calls (mirror llm_events / complete / stream_completion in app.py) ---
+
+def llm_events_async(messages, temperature):
+    async def open_stream(model):
+        return services.get_llm().stream_async(model, messages, temperature)
+    return llm_fallback.hedged_stream_async(open_stream, MODEL, FALLBACK_MODEL)
+
+
+async def completion_async(kind, messages, temperature, lease=None):
+    start = time.perf_counter()
+    parts = []
+    model, usage, spent = MODEL, None, []
+    try:
+        async for event in llm_events_async(messages, temperature):
+            if event[0] == "delta":
+                parts.append(event[1])
+            elif event[0] == "spent":
+                spent.append(event[1:])
+            else:
+                _, model, usage = event
+    except Exception:
+        metrics.LLM_ERRORS.labels(kind, MODEL).inc()
+        raise
+    metrics.LLM_LATENCY.labels(kind, model).observe(time.perf_counter() - start)
+    await asyncio.to_thread(record_usage, kind, model, usage, lease, spent)
+    return "".join(parts), model
+
+
+async def complete_async(kind, messages, temperature, lease=None):
+    return (await completion_async(kind, messages, temperature, lease))[0]
+
+
+async def respond_async(kind, user_state, note, regenerate=False, lease=None, uid=None):
+    key = cache_key(kind, user_state, note)
+    if not regenerate:
+        cached = await asyncio.to_thread(cache_get, key)
+        if cached is not None:
+            await save_reply_async(uid, kind, user_state, MODEL, cached, note)
+            return cached
+    text, model = await completion_async(kind, build_messages(kind, user_state, note), temperature=0.3, lease=lease)
+    await asyncio.to_thread(store_reply, key, text, model)
+    await save_reply_async(uid, kind, user_state, model, text, note)
+    return text
+
+
+async def respond_chat_async(user_state, message, context_md="", context_kind="", turn=None, lease=None, uid=None):
+    text, model = await completion_async(
+        "chat", chat_messages(user_state, message, context_md, context_kind, turn), temperature=0.2, lease=lease
+    )
+    await save_reply_async(uid, "chat", user_state, model, text)
+    if turn is None:
+        return text, None
+    return text, await asyncio.to_thread(store_chat_reply, turn["conversation_id"], text)
+
+
+async def refresh_chat_summary_async(conversation_id, pending, lease=None):
+    if not pending:
+        return
+    try:
+        summary = await complete_async(
+            "summary", prompt_compiler.compile_summary(pending["summary"], pending["turns"]), temperature=0, lease=lease
+        )
+        await asyncio.to_thread(save_chat_summary, conversation_id, pending, summary.strip())
+    except Exception:
+        traceback.print_exc()
+
+
+async def stream_completion_async(kind, messages, temperature, on_complete=None, done_extra=None, lease=None):
+    model, usage, spent = MODEL, None, []
+    parts = []
+    start = time.perf_counter()
+    try:
+        async for event in llm_events_async(messages, temperature):
+            if event[0] == "delta":
+                parts.append(event[1])
+                yield sse_event("chunk", {"delta": event[1]})
+            elif event[0] == "spent":
+                spent.append(event[1:])
+            else:
+                _, model, usage = event
+    except Exception as e:
+        traceback.print_exc()
+        metrics.LLM_ERRORS.labels(kind, MODEL).inc()
+        yield sse_event("error", {"error": str(e)})
+        return
+    metrics.LLM_LATENCY.labels(kind, model).observe(time.perf_counter() - start)
+    await asyncio.to_thread(record_usage, kind, model, usage, lease, spent)
+    if on_complete:
+        await on_complete("".join(parts), model)
+    yield sse_event("done", {"model": model, "usage": usage, **(done_extra or {})})
+
+
+async def respond_stream_async(kind, user_state, note, regenerate=False, lease=None, uid=None):
+    key = cache_key(kind, user_state, note)
+    if not regenerate:
+        cached = await asyncio.to_thread(cache_get, key)
+        if cached is not None:
+            await save_reply_async(uid, kind, user_state, MODEL, cached, note)
+            yield sse_event("chunk", {"delta": cached})
+            yield sse_event("done", {"model": MODEL, "usage": None, "cached": True})
+            return
+    async def cache_reply(text, model):
+        await asyncio.to_thread(store_reply, key, text, model)
+        await save_reply_async(uid, kind, user_state, model, text, note)
+
+    async for frame in stream_completion_async(
+        kind,
+        build_messages(kind, user_state, note),
+        temperature=0.3,
+        on_complete=cache_reply,
+        lease=lease,
+    ):
+        yield frame
+
+
+async def respond_chat_stream_async(user_state, message, context_md="", context_kind="", turn=None, lease=None, uid=None, pending=None):
+    """SSE frames for /chat; with a turn, pending receives the summary work for the caller to run after the response."""
+    messages = chat_messages(user_state, message, context_md, context_kind, turn)
+
+    async def save(text, model):
+        await save_reply_async(uid, "chat", user_state, model, text)
+
+    if turn is None:
+        async for frame in stream_completion_async("chat", messages, temperature=0.2, on_complete=save, lease=lease):
+            yield frame
+        return
+
+    conversation_id = turn["conversation_id"]
+    pending = [] if pending is None else pending
+
+    async def store(text, model):
+        await save(text, model)
+        pending.append(await asyncio.to_thread(store_chat_reply, conversation_id, text))
+
+    async for frame in stream_completion_async(
+        "chat", messages, temperature=0.2, on_complete=store, done_extra={"conversation_id": conversation_id}, lease=lease
+    ):
+        yield frame
+
+
+# --- ASGI plumbing ---
+
+async def read_body(receive) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def send_json(send, status, payload, headers=()) -> int:
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+        ] + list(headers) + SECURITY_HEADERS,
+    })
+    await send({"type": "http.response.body", "body": body})
+    return status
+
+
+async def send_sse(send, frames) -> int:
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream; charset=utf-8"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"),
+        ] + SECURITY_HEADERS,
+    })
+    async for frame in frames:
+        await send({"type": "http.response.body", "body": frame.encode("utf-8"), "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+    return 200
+
+
+class TrackedSend:
+    """send(), remembering whether the response has started and ended so an error can't start a second one."""
+
+    def __init__(self, send):
+        self._send = send
+        self.status = None
+        self.finished = False
+
+    @property
+    def started(self) -> bool:
+        return self.status is not None
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            self.status = message["status"]
+        elif message["type"] == "http.response.body" and not message.get("more_body"):
+            self.finished = True
+        await self._send(message)
+
+
+async def coach_endpoint(scope, receive, send):
+    start = time.perf_counter()
+    status = 500
+    send = TrackedSend(send)
+    req = CoachRequest(scope, await read_body(receive))
+    kind = COACH_ROUTES[req.path]
+    uid = session_user_id(req)
+    summarize = None
+    try:
+        lease = await asyncio.to_thread(quota_admit, uid, (scope.get("client") or ("",))[0])
+    except llm_quota.QuotaExceeded as e:
+        status = await send_json(send, 429, quota_error(e), [(b"retry-after", str(e.retry_after).encode())])
+        metrics.HTTP_LATENCY.labels("POST", req.path, str(status)).observe(time.perf_counter() - start)
+        return
+    try:
+        if kind == "chat":
+            data = req.get_json(silent=True) or {}
+            user_state = await request_user_state_async(data, uid)
+            message = (data.get("message") or "").strip()
+            context_md = (data.get("context_md") or "").strip()
+            context_kind = (data.get("context_kind") or "").strip()
+            if not message:
+                status = await send_json(send, 200, {"reply": "Please type a message."})
+                return
+            turn = None
+            if uid:
+                try:
+                    conversation_id = parse_conversation_id(data)
+                except (TypeError, ValueError):
+                    status = await send_json(send, 400, {"error": "invalid conversation_id"})
+                    return
+                turn = await asyncio.to_thread(begin_chat_turn, uid, conversation_id, message, context_md, context_kind)
+                if turn is None:
+                    status = await send_json(send, 404, {"error": "conversation not found"})
+                    return
+            if wants_stream(req):
+                pending = []
+                status = await send_sse(
+                    send, respond_chat_stream_async(user_state, message, context_md, context_kind, turn, lease, uid, pending)
+                )
+                if pending:
+                    summarize = (turn["conversation_id"], pending[0])
+            elif turn is None:
+                text, _ = await respond_chat_async(user_state, message, context_md, context_kind, lease=lease, uid=uid)
+                status = await send_json(send, 200, {"reply": text})
+            else:
+                text, pending = await respond_chat_async(user_state, message, context_md, context_kind, turn, lease, uid)
+                status = await send_json(send, 200, {"reply": text, "conversation_id": turn["conversation_id"]})
+                summarize = (turn["conversation_id"], pending)
+        else:
+            data = req.get_json(silent=True) or {}
+            user_state = await request_user_state_async(data, uid)
+            note = data.get("note", "")
+            if wants_stream(req):
+                status = await send_sse(send, respond_stream_async(kind, user_state, note, wants_regenerate(req), lease, uid))
+            else:
+                text = await respond_async(kind, user_state, note, wants_regenerate(req), lease, uid)
+                status = await send_json(send, 200, {"reply": text})
+    except Exception as e:
+        traceback.print_exc()
+        if not send.started:
+            status = await send_json(send, 500, {"error": str(e)})
+        else:
+            status = send.status
+            if not send.finished:
+                # Mid-stream: the headers are out, so end the body with an error frame
+                try:
+                    await send({"type": "http.response.body", "body": sse_event("error", {"error": str(e)}).encode("utf-8")})
+                except Exception:
+                    traceback.print_exc()
+    finally:
+        await asyncio.to_thread(lease.release)
+        metrics.HTTP_LATENCY.labels("POST", req.path, str(status)).observe(time.perf_counter() - start)
+    if summarize:
+        # The reply is complete and the in-flight slot is free again; the summary's tokens are still charged
+        await refresh_chat_summary_async(*summarize, lease)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if services.loaded("llm"):
+                await services.get_llm().aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+    elif scope["type"] == "http" and scope["method"] == "POST" and scope["path"] in COACH_ROUTES:
+        await coach_endpoint(scope, receive, send)
+    else:
+        await wsgi_app(scope, receive, send)
@@ -1,8 +1,9 @@
 import os
 from typing import Optional, Literal
-from app import get_session
-from db import validate_token, mark_token_used
+from sqlalchemy import update
+from db import get_session, validate_token, claim_token
 from models import User
+import services
 
 def validate_reset_token(token: str) -> Optional[dict]:
     """
@@ -44,6 +45,7 @@ def set_user_password(user_id: int, password_hash: str) -> None:
         u.password_hash = password_hash
         sess.add(u)
         sess.commit()
+        services.get_profile_cache().invalidate(user_id)
     finally:
         sess.close()
 
@@ -86,6 +88,7 @@ def mark_user_verified(user_id: int) -> None:
         u.is_verified = True
         sess.add(u)
         sess.commit()
+        services.get_profile_cache().invalidate(user_id)
     finally:
         sess.close()
 
@@ -100,9 +103,64 @@ def consume_token(token: str, purpose: Literal["reset","verify"]) -> None:
 
     sess = get_session()
     try:
-        t = validate_token(sess, token, purpose)
-        if t:
-            mark_token_used(sess, t)
-            sess.commit()
+        claim_token(sess, token, purpose)
+        sess.commit()
+    finally:
+        sess.close()
+
+
+def verify_email_with_token(token: str) -> Optional[int]:
+    """
+    Consume a verification token and mark its user verified in one
+    transaction. Returns the user_id, or None if the token is invalid,
+    expired or already used (e.g. a second click on the same link).
+    In DEV (or no DB), accepts any non-empty token for user 1.
+    """
+    token = (token or "").strip()
+    if not token:
+        return None
+
+    if os.getenv("ENV", "development").lower() == "development" and not os.getenv("DATABASE_URL"):
+        print(f"[DEV] verify_email_with_token: {token[:8]}...")
+        return 1
+
+    sess = get_session()
+    try:
+        user_id = claim_token(sess, token, "verify")
+        if user_id is None:
+            sess.rollback()
+            return None
+        sess.execute(update(User).where(User.id == user_id).values(is_verified=True))
+        sess.commit()
+    finally:
+        sess.close()
+    services.get_profile_cache().invalidate(user_id)
+    return user_id
+
+
+def reset_password_with_token(token: str, password_hash: str) -> Optional[int]:
+    """
+    Consume a reset token and store the new password hash in one transaction.
+    Returns the user_id, or None if the token is invalid, expired or used.
+    In DEV (or no DB), log only.
+    """
+    token = (token or "").strip()
+    if not token:
+        return None
+
+    if os.getenv("ENV", "development").lower() == "development" and not os.getenv("DATABASE_URL"):
+        print(f"[DEV] reset_password_with_token: {token[:8]}..., hash={password_hash[:12]}...")
+        return 1
+
+    sess = get_session()
+    try:
+        user_id = claim_token(sess, token, "reset")
+        if user_id is None:
+            sess.rollback()
+            return None
+        sess.execute(update(User).where(User.id == user_id).values(password_hash=password_hash))
+        sess.commit()
     finally:
         sess.close()
+    services.get_profile_cache().invalidate(user_id)
+    return user_id
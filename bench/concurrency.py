@@ -0,0 +1,148 @@
+"""
+Coach-endpoint concurrency: sync gunicorn workers vs the async ASGI entry point.
+
+Starts bench/fake_llm.py (fixed LLM latency), then runs the app twice with the
+same number of processes -- `gunicorn app:app` (sync workers) and
+`uvicorn asgi:application` -- and fires POST /plan at increasing concurrency.
+With sync workers throughput is capped at workers / latency; the async path
+keeps scaling until the fake LLM or CPU saturates.
+
+  python bench/concurrency.py --workers 2 --latency 1.0 --levels 1,10,50,100,200
+
+Needs no Postgres or API key: it uses a throwaway SQLite file and the fake LLM.
+"""
+
+import os, sys, json, time, socket, argparse, subprocess, tempfile, statistics
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_http(url: str, timeout: float = 30) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1).read()
+            return
+        except Exception:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def post_plan(base: str, i: int) -> float:
+    # Unique note per request so the reply cache can't short-circuit the LLM call
+    body = json.dumps({"user_state": {"current_phase": "apply"}, "note": f"bench {i} {time.time()}"}).encode()
+    req = urllib.request.Request(base + "/plan", data=body, headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    with urllib.request.urlopen(req, timeout=300) as r:
+        r.read()
+    return time.perf_counter() - start
+
+
+def run_level(base: str, concurrency: int, total: int) -> dict:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda i: _safe(post_plan, base, i), range(total)))
+    elapsed = time.perf_counter() - start
+    ok = sorted(r for r in results if r is not None)
+    q = statistics.quantiles(ok, n=100) if len(ok) >= 2 else ok * 99
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": total - len(ok),
+        "rps": round(len(ok) / elapsed, 2),
+        "p50": round(q[49], 3) if ok else None,
+        "p95": round(q[94], 3) if ok else None,
+    }
+
+
+def _safe(fn, *args):
+    try:
+        return fn(*args)
+    except Exception:
+        return None
+
+
+def start_server(mode: str, port: int, workers: int, env: dict):
+    if mode == "sync":
+        cmd = [sys.executable, "-m", "gunicorn", "app:app", "-w", str(workers), "-b", f"127.0.0.1:{port}",
+               "--timeout", "300"]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "asgi:application", "--workers", str(workers),
+               "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    return subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2, help="processes per server")
+    parser.add_argument("--latency", type=float, default=1.0, help="fake LLM latency (seconds)")
+    parser.add_argument("--levels", default="1,10,50,100,200", help="comma-separated concurrency levels")
+    parser.add_argument("--rounds", type=int, default=2, help="requests per client at each level")
+    parser.add_argument("--modes", default="sync,async")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="nc-bench-")
+    llm_port = free_port()
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": f"sqlite:///{tmp}/bench.sqlite",
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{llm_port}/v1",
+        "FAKE_LLM_LATENCY": str(args.latency),
+        "REPLY_CACHE_BACKEND": "off",
+        "PROFILE_CACHE_BACKEND": "memory",
+        "RATELIMIT_STORAGE_URI": "memory://",
+        "PASSWORD_HASH_WORKERS": "0",
+        "SMTP_HOST": "127.0.0.1", "SMTP_USER": "bench", "SMTP_PASS": "bench", "EMAIL_FROM": "bench@localhost",
+    })
+    env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+
+    # Create the SQLite schema once, before several workers race to do it
+    sys.path.insert(0, ROOT)
+    from sqlalchemy import create_engine
+    from migrations import migrate
+    migrate(create_engine(env["DATABASE_URL"]))
+
+    llm = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "fake_llm:app", "--app-dir", os.path.join(ROOT, "bench"),
+         "--host", "127.0.0.1", "--port", str(llm_port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    levels = [int(x) for x in args.levels.split(",") if x.strip()]
+    results = []
+    try:
+        time.sleep(1)
+        for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+            port = free_port()
+            server = start_server(mode, port, args.workers, env)
+            base = f"http://127.0.0.1:{port}"
+            try:
+                wait_http(base + "/health")
+                for c in levels:
+                    r = run_level(base, c, c * args.rounds)
+                    r["mode"] = mode
+                    results.append(r)
+                    print(f"{mode:5} c={c:<4} rps={r['rps']:<8} p50={r['p50']}s p95={r['p95']}s errors={r['errors']}")
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+    finally:
+        llm.terminate()
+        llm.wait(timeout=10)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"workers": args.workers, "latency": args.latency, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
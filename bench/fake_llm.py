@@ -0,0 +1,66 @@
+"""
+Minimal OpenAI-compatible chat completions server for benchmarks.
+
+Answers POST /v1/chat/completions after FAKE_LLM_LATENCY seconds (default 1.0),
+streaming or not, so app throughput can be measured without a real API key:
+
+  uvicorn fake_llm:app --app-dir bench --port 5099
+  OPENAI_BASE_URL=http://127.0.0.1:5099/v1 OPENAI_API_KEY=bench python app.py
+"""
+
+import os, json, time, asyncio
+
+LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "1.0"))
+REPLY = "## Weekly Plan\n- **Deep:** draft CV v1\n- **Quick:** list 5 target companies\n- **Tiny:** 10-min walk"
+
+
+def _completion(model):
+    return {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": REPLY}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 600, "completion_tokens": 40, "total_tokens": 640},
+    }
+
+
+def _chunk(model, delta=None, usage=None):
+    return {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [] if delta is None else [{"index": 0, "delta": {"content": delta}, "finish_reason": None}],
+        "usage": usage,
+    }
+
+
+async def app(scope, receive, send):
+    if scope["type"] != "http":
+        return
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    req = json.loads(body or b"{}")
+    model = req.get("model", "bench")
+
+    if not req.get("stream"):
+        await asyncio.sleep(LATENCY)
+        payload = json.dumps(_completion(model)).encode()
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": payload})
+        return
+
+    words = REPLY.split(" ")
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/event-stream")]})
+    for w in words:
+        await asyncio.sleep(LATENCY / len(words))
+        frame = "data: " + json.dumps(_chunk(model, w + " ")) + "\n\n"
+        await send({"type": "http.response.body", "body": frame.encode(), "more_body": True})
+    usage = {"prompt_tokens": 600, "completion_tokens": len(words), "total_tokens": 600 + len(words)}
+    frame = "data: " + json.dumps(_chunk(model, usage=usage)) + "\n\ndata: [DONE]\n\n"
+    await send({"type": "http.response.body", "body": frame.encode()})
@@ -0,0 +1,76 @@
+"""
+Import-time cost of the web app: what a worker pays to boot.
+
+Runs `python -X importtime -c "import app"` in fresh interpreters (no
+.env, a throwaway SQLite URL, no mail settings) and reports the median wall
+time plus the modules with the largest cumulative import time.
+
+  python bench/import_time.py                    # median of 5 runs, top 15 modules
+  python bench/import_time.py --module asgi      # the ASGI entry point instead
+  python bench/import_time.py --budget-ms 1500   # exit 1 if the median is over budget
+
+Importing must not connect to anything: a run that needs Postgres, Redis,
+SMTP or an API key fails here rather than only in production.
+"""
+
+import os, re, sys, argparse, subprocess, tempfile, statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LINE_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$")
+
+
+def clean_env(tmp: str) -> dict:
+    env = {k: v for k, v in os.environ.items() if not k.startswith(("SMTP_", "EMAIL_", "REDIS", "RATELIMIT_"))}
+    env.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'import.sqlite')}",
+        "LLM_BACKEND": env.get("LLM_BACKEND", "openai"),
+        "PYTHONDONTWRITEBYTECODE": "1",
+    })
+    env.pop("OPENAI_API_KEY", None)
+    return env
+
+
+def measure(module: str, env: dict) -> tuple:
+    """(wall ms, [(cumulative us, self us, module)]) for one cold import."""
+    code = f"import time; t = time.perf_counter(); import {module}; print((time.perf_counter() - t) * 1000)"
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    modules = []
+    for line in proc.stderr.splitlines():
+        m = LINE_RE.match(line)
+        if m:
+            modules.append((int(m.group(2)), int(m.group(1)), m.group(4)))
+    return float(proc.stdout.strip().splitlines()[-1]), modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the web app's import time.")
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--budget-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = clean_env(tmp)
+        runs = [measure(args.module, env) for _ in range(args.runs)]
+        if os.path.exists(os.path.join(tmp, "import.sqlite")):
+            print("[import_time] warning: importing created the database; something connects at import")
+    walls = sorted(r[0] for r in runs)
+    median = statistics.median(walls)
+    print(f"[import_time] import {args.module}: median {median:.0f} ms (min {walls[0]:.0f}, max {walls[-1]:.0f}, {args.runs} runs)")
+    top = sorted(runs[-1][1], reverse=True)[: args.top]
+    print(f"{'cumulative ms':>14} {'self ms':>8}  module")
+    for cumulative, own, name in top:
+        print(f"{cumulative / 1000:>14.1f} {own / 1000:>8.1f}  {name}")
+    if args.budget_ms is not None and median > args.budget_ms:
+        print(f"[import_time] over budget: {median:.0f} ms > {args.budget_ms:.0f} ms")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+"""
+Load and latency benchmark for the full request mix.
+
+Boots the app (gunicorn or uvicorn) against SQLite or a local Postgres, the
+stub LLM backend and bench/smtp_sink.py, with outbox_worker.py delivering
+mail. Each virtual user signs up, verifies through the emailed link and logs
+in, then issues a weighted mix of /me, /phase, /plan, /chat, /login and
+/signup until the run ends. Reports p50/p95/p99 latency and requests per
+second per route.
+
+  python bench/load.py --users 20 --duration 30 --out bench/results/run.json
+  python bench/load.py --database-url postgresql://localhost/nc_bench --server uvicorn
+  python bench/load.py --baseline bench/results/base.json --threshold 0.2   # regression mode
+
+Regression mode compares each route's --metric (default p95) with the baseline
+run and exits 1 if any route is slower by more than --threshold (a fraction).
+The baseline is simply the --out file of an earlier run.
+"""
+
+import os, sys, json, time, random, argparse, platform, threading, subprocess, tempfile, statistics
+import http.cookiejar
+import urllib.error
+import urllib.request
+
+from concurrency import ROOT, free_port, wait_http
+from smtp_sink import SMTPSink, token_from
+
+DEFAULT_MIX = "me=35,plan=20,chat=20,phase=10,login=10,signup=5"
+PHASES = ["stabilize", "reframe", "position", "explore", "apply", "secure", "transition"]
+NOTES = ["", "", "short on energy this week", "interview on Thursday", "need to focus on CV"]
+CHAT_MESSAGES = ["help me with bullet 1", "what should I do first today?", "I feel stuck", "make it smaller"]
+PASSWORD = "bench-password-1"
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        if part.strip():
+            name, _, weight = part.partition("=")
+            mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def add(self, route: str, seconds: float, ok: bool) -> None:
+        with self.lock:
+            if ok:
+                self.samples.setdefault(route, []).append(seconds)
+            else:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+    def summary(self, elapsed: float) -> dict:
+        routes = {}
+        for route in sorted(set(self.samples) | set(self.errors)):
+            ok = sorted(self.samples.get(route, []))
+            q = statistics.quantiles(ok, n=100, method="inclusive") if len(ok) >= 2 else ok * 99
+            routes[route] = {
+                "requests": len(ok),
+                "errors": self.errors.get(route, 0),
+                "rps": round(len(ok) / elapsed, 2),
+                "p50_ms": round(q[49] * 1000, 1) if ok else None,
+                "p95_ms": round(q[94] * 1000, 1) if ok else None,
+                "p99_ms": round(q[98] * 1000, 1) if ok else None,
+            }
+        return routes
+
+
+class Mailbox:
+    """Verification tokens delivered to the SMTP sink, by recipient."""
+
+    def __init__(self):
+        self.tokens = {}
+        self.cond = threading.Condition()
+
+    def on_message(self, rcpt, msg, text) -> None:
+        token = token_from(text)
+        if token:
+            with self.cond:
+                for addr in rcpt:
+                    self.tokens[addr.lower()] = token
+                self.cond.notify_all()
+
+    def wait_token(self, email: str, timeout: float = 30):
+        with self.cond:
+            self.cond.wait_for(lambda: email in self.tokens, timeout=timeout)
+            return self.tokens.pop(email, None)
+
+
+class VirtualUser:
+    def __init__(self, n: int, base: str, rec: Recorder, mailbox: Mailbox, run_id: str):
+        self.base = base
+        self.rec = rec
+        self.mailbox = mailbox
+        self.email = f"bench-{run_id}-{n}@example.test"
+        self.rng = random.Random(n)
+        self.jar = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.jar))
+        self.phase = self.rng.choice(PHASES)
+        self.conversation_id = None
+        self.signups = 0
+
+    def call(self, route: str, method: str, path: str, body=None, headers=None, opener=None):
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.base + path, data=data, method=method)
+        req.add_header("Content-Type", "application/json")
+        for k, v in (headers or {}).items():
+            req.add_header(k, v)
+        start = time.perf_counter()
+        try:
+            with (opener or self.opener).open(req, timeout=120) as r:
+                payload = r.read()
+                status = r.status
+        except urllib.error.HTTPError as e:
+            payload, status = e.read(), e.code
+        except Exception:
+            self.rec.add(route, time.perf_counter() - start, False)
+            return None, None
+        self.rec.add(route, time.perf_counter() - start, status < 400)
+        try:
+            return status, json.loads(payload or b"null")
+        except ValueError:
+            return status, None
+
+    def csrf(self) -> str:
+        for c in self.jar:
+            if c.name == "csrf_token":
+                return c.value
+        return ""
+
+    def setup(self) -> bool:
+        self.call("/signup", "POST", "/signup", {"email": self.email, "password": PASSWORD})
+        token = self.mailbox.wait_token(self.email)
+        if not token:
+            return False
+        self.call("/verify", "GET", f"/verify?token={urllib.request.quote(token)}")
+        status, _ = self.call("/login", "POST", "/login", {"email": self.email, "password": PASSWORD})
+        return status == 200
+
+    def user_state(self) -> dict:
+        return {"current_phase": self.phase, "week_in_phase": 1 + self.rng.randrange(4)}
+
+    def do(self, action: str) -> None:
+        if action == "me":
+            self.call("/me", "GET", "/me")
+        elif action == "phase":
+            self.phase = self.rng.choice(PHASES)
+            self.call("/phase", "POST", "/phase", {"phase": self.phase}, {"X-CSRF-Token": self.csrf()})
+        elif action == "plan":
+            self.call("/plan", "POST", "/plan", {"user_state": self.user_state(), "note": self.rng.choice(NOTES)})
+        elif action == "chat":
+            body = {"user_state": self.user_state(), "message": self.rng.choice(CHAT_MESSAGES)}
+            if self.conversation_id:
+                body["conversation_id"] = self.conversation_id
+            _, data = self.call("/chat", "POST", "/chat", body)
+            if isinstance(data, dict) and data.get("conversation_id"):
+                self.conversation_id = data["conversation_id"]
+        elif action == "login":
+            self.call("/login", "POST", "/login", {"email": self.email, "password": PASSWORD})
+        elif action == "signup":
+            # A fresh address that never verifies; separate cookie jar
+            self.signups += 1
+            email = self.email.replace("@", f"+{self.signups}@")
+            self.call("/signup", "POST", "/signup", {"email": email, "password": PASSWORD},
+                      opener=urllib.request.build_opener())
+
+    def run(self, mix: dict, deadline: float, think: float) -> None:
+        actions, weights = zip(*mix.items())
+        while time.perf_counter() < deadline:
+            self.do(self.rng.choices(actions, weights)[0])
+            if think:
+                time.sleep(self.rng.uniform(0, 2 * think))
+
+
+def start_app(args, port: int, env: dict):
+    if args.server == "uvicorn":
+        cmd = [sys.executable, "-m", "uvicorn", "asgi:application", "--workers", str(args.workers),
+               "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    else:
+        cmd = [sys.executable, "-m", "gunicorn", "app:app", "-w", str(args.workers), "-b", f"127.0.0.1:{port}",
+               "--timeout", "300"]
+        if args.threads > 1:
+            cmd += ["-k", "gthread", "--threads", str(args.threads)]
+    return subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def compare(result: dict, baseline: dict, metric: str, threshold: float) -> list:
+    """Routes slower than baseline by more than threshold: [(route, base, now, ratio), ...]."""
+    slower = []
+    key = f"{metric}_ms"
+    for route, now in result["routes"].items():
+        base = (baseline.get("routes") or {}).get(route)
+        if not base or not base.get(key) or now.get(key) is None:
+            continue
+        ratio = now[key] / base[key]
+        if ratio > 1 + threshold:
+            slower.append((route, base[key], now[key], ratio))
+    return slower
+
+
+def git_rev() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip()
+    except Exception:
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of mixed traffic after setup")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="route weights, e.g. me=35,plan=20,...")
+    parser.add_argument("--think", type=float, default=0.0, help="mean pause between a user's requests (s)")
+    parser.add_argument("--server", choices=["gunicorn", "uvicorn"], default="gunicorn")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8, help="gunicorn gthread threads per worker")
+    parser.add_argument("--database-url", help="default: a throwaway SQLite file")
+    parser.add_argument("--llm-ttft", type=float, default=0.4, help="stub LLM mean time to first token (s)")
+    parser.add_argument("--llm-rate", type=float, default=60, help="stub LLM mean tokens per second")
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    parser.add_argument("--out", help="write results JSON here")
+    parser.add_argument("--baseline", help="results JSON to compare against (regression mode)")
+    parser.add_argument("--metric", choices=["p50", "p95", "p99"], default="p95")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown, 0.2 = 20%%")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    tmp = tempfile.mkdtemp(prefix="nc-load-")
+    database_url = args.database_url or f"sqlite:///{tmp}/load.sqlite"
+    mailbox = Mailbox()
+    sink = SMTPSink(port=0, on_message=mailbox.on_message).start()
+
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": database_url,
+        "LLM_BACKEND": "stub",
+        "LLM_STUB_TTFT": str(args.llm_ttft),
+        "LLM_STUB_TOKENS_PER_SEC": str(args.llm_rate),
+        "SMTP_HOST": "127.0.0.1", "SMTP_PORT": str(sink.port), "SMTP_STARTTLS": "0",
+        "SMTP_USER": "bench", "SMTP_PASS": "bench", "EMAIL_FROM": "bench@localhost",
+        "APP_BASE_URL": "http://bench.local",
+        "OUTBOX_POLL_INTERVAL": "0.2",
+        "BCRYPT_ROUNDS": str(args.bcrypt_rounds),
+        "RATELIMIT_ENABLED": "0",
+        "PROMPT_LOG_TOKENS": "0",
+    })
+    env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+
+    # Apply the schema once, before several workers race to do it
+    sys.path.insert(0, ROOT)
+    from sqlalchemy import create_engine
+    from migrations import migrate
+    migrate(create_engine(database_url))
+
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    server = start_app(args, port, env)
+    worker = subprocess.Popen([sys.executable, "outbox_worker.py"], cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    setup_rec, rec = Recorder(), Recorder()
+    run_id = f"{int(time.time())}{random.randrange(1000):03d}"
+    try:
+        wait_http(base + "/health")
+        users = [VirtualUser(i, base, setup_rec, mailbox, run_id) for i in range(args.users)]
+        ready = []
+        setup_start = time.perf_counter()
+        threads = [threading.Thread(target=lambda u=u: ready.append(u.setup())) for u in users]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        setup_elapsed = time.perf_counter() - setup_start
+        print(f"[load] {sum(ready)}/{len(users)} users signed up, verified and logged in")
+        for u in users:
+            u.rec = rec
+
+        start = time.perf_counter()
+        deadline = start + args.duration
+        threads = [threading.Thread(target=u.run, args=(mix, deadline, args.think)) for u in users]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        worker.terminate()
+        server.wait(timeout=30)
+        worker.wait(timeout=30)
+        sink.stop()
+
+    result = {
+        "meta": {
+            "git": git_rev(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "database": database_url.split(":", 1)[0],
+            "server": args.server,
+            "workers": args.workers,
+            "threads": args.threads if args.server == "gunicorn" else None,
+            "users": args.users,
+            "duration": args.duration,
+            "mix": mix,
+            "llm": {"ttft": args.llm_ttft, "tokens_per_sec": args.llm_rate},
+            "bcrypt_rounds": args.bcrypt_rounds,
+            "emails_delivered": sink.count,
+        },
+        "routes": rec.summary(elapsed),
+        # signup -> emailed link -> verify -> login for every virtual user, before the timed mix
+        "setup": setup_rec.summary(setup_elapsed),
+    }
+    print(f"{'route':10} {'req':>6} {'err':>4} {'rps':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for route, r in result["routes"].items():
+        print(f"{route:10} {r['requests']:>6} {r['errors']:>4} {r['rps']:>7} "
+              f"{r['p50_ms']!s:>9} {r['p95_ms']!s:>9} {r['p99_ms']!s:>9}")
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"[load] wrote {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        slower = compare(result, baseline, args.metric, args.threshold)
+        for route, was, now, ratio in slower:
+            print(f"[load] REGRESSION {route}: {args.metric} {was}ms -> {now}ms ({(ratio - 1) * 100:+.0f}%)")
+        if slower:
+            sys.exit(1)
+        print(f"[load] no route slower than baseline by more than {args.threshold:.0%} ({args.metric})")
+
+
+if __name__ == "__main__":
+    main()
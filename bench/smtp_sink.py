@@ -0,0 +1,123 @@
+"""
+Local SMTP sink for benchmarks and offline runs.
+
+Accepts any AUTH and any message over plain SMTP (no STARTTLS) and keeps the
+parsed messages in memory. Point the app at it with SMTP_HOST=127.0.0.1,
+SMTP_PORT=<port>, SMTP_STARTTLS=0.
+
+  python bench/smtp_sink.py --port 2525      # print a line per message
+"""
+
+import re, asyncio, argparse, threading
+from email import message_from_bytes, policy
+
+TOKEN_RE = re.compile(r"[?&]token=([A-Za-z0-9_\-%]+)")
+
+
+class SMTPSink:
+    def __init__(self, host: str = "127.0.0.1", port: int = 2525, on_message=None):
+        self.host = host
+        self.port = port
+        self.on_message = on_message
+        self.count = 0
+        self._loop = None
+        self._server = None
+        self._ready = threading.Event()
+
+    async def _session(self, reader, writer):
+        async def reply(line: str):
+            writer.write((line + "\r\n").encode())
+            await writer.drain()
+
+        await reply("220 smtp-sink ready")
+        rcpt = []
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                verb = line.decode("latin-1").strip().split(" ", 1)[0].upper()
+                if verb == "EHLO":
+                    writer.write(b"250-smtp-sink\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n")
+                    await writer.drain()
+                elif verb == "AUTH":
+                    await reply("235 2.7.0 Authentication successful")
+                elif verb == "MAIL":
+                    rcpt = []
+                    await reply("250 OK")
+                elif verb == "RCPT":
+                    rcpt.append(line.decode("latin-1").split(":", 1)[-1].strip().strip("<>"))
+                    await reply("250 OK")
+                elif verb == "DATA":
+                    await reply("354 End data with <CR><LF>.<CR><LF>")
+                    data = []
+                    while True:
+                        chunk = await reader.readline()
+                        if chunk in (b".\r\n", b".\n", b""):
+                            break
+                        data.append(chunk[1:] if chunk.startswith(b"..") else chunk)
+                    self._deliver(rcpt, b"".join(data))
+                    await reply("250 OK queued")
+                elif verb == "QUIT":
+                    await reply("221 Bye")
+                    return
+                elif verb in ("HELO", "RSET", "NOOP"):
+                    await reply("250 OK")
+                else:
+                    await reply("502 Command not implemented")
+        finally:
+            writer.close()
+
+    def _deliver(self, rcpt, raw: bytes) -> None:
+        self.count += 1
+        if self.on_message is None:
+            return
+        msg = message_from_bytes(raw, policy=policy.default)
+        body = msg.get_body(preferencelist=("plain", "html"))
+        text = body.get_content() if body is not None else ""
+        self.on_message(rcpt, msg, text)
+
+    async def _serve(self):
+        self._server = await asyncio.start_server(self._session, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def start(self) -> "SMTPSink":
+        """Serve on a daemon thread; port=0 picks a free port (read .port afterwards)."""
+        def run():
+            self._loop = asyncio.new_event_loop()
+            try:
+                self._loop.run_until_complete(self._serve())
+            except asyncio.CancelledError:
+                pass
+        threading.Thread(target=run, daemon=True).start()
+        self._ready.wait(10)
+        return self
+
+    def stop(self) -> None:
+        if self._loop and self._server:
+            self._loop.call_soon_threadsafe(self._server.close)
+
+
+def token_from(text: str):
+    """The token query parameter of the first link in a verify/reset email, or None."""
+    from urllib.parse import unquote
+    m = TOKEN_RE.search(text or "")
+    return unquote(m.group(1)) if m else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local SMTP sink.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2525)
+    args = parser.parse_args()
+    sink = SMTPSink(args.host, args.port, on_message=lambda rcpt, msg, text: print(f"[sink] {rcpt} {msg['Subject']}"))
+    sink.start()
+    print(f"[sink] listening on {args.host}:{sink.port}")
+    threading.Event().wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Static asset build: web/ -> build/web.
+
+  python build_assets.py                      # then run the app with STATIC_DIR=build/web
+  python build_assets.py --src web --out build/web
+
+- CSS, JS and images get content-hashed copies (style.css -> style.3f9c0a1b2d.css)
+  and every reference in the HTML pages (and url() in CSS) is rewritten to
+  them; the unhashed files are kept for old cached pages.
+- Images in img/ get resized WebP and AVIF variants (IMAGE_WIDTHS, never
+  upscaled). Inline "--bg:url(...)" tile backgrounds also get a "--bg-set"
+  image-set() so browsers pick AVIF/WebP at 1x/2x (style.css falls back to
+  --bg where image-set() is unsupported).
+- Text assets get .gz and .br (when the brotli module is installed) siblings.
+- manifest.json maps each source path to its hashed path.
+
+static_assets.py serves the result: Accept-Encoding negotiation and
+"Cache-Control: immutable" for hashed names.
+"""
+
+import os, re, json, gzip, shutil, hashlib, argparse
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+HASH_LEN = 10
+FINGERPRINT_EXT = {".css", ".js", ".jpg", ".jpeg", ".png", ".gif", ".svg", ".webp", ".avif", ".ico"}
+COMPRESS_EXT = {".html", ".css", ".js", ".svg", ".json", ".txt", ".ico", ".map"}
+RASTER_EXT = {".jpg", ".jpeg", ".png"}
+IMAGE_WIDTHS = (480, 960)
+WEBP_QUALITY = 78
+AVIF_QUALITY = 55
+
+REF_RE = re.compile(r"""(?P<attr>\b(?:src|href)=)(?P<q>["'])(?P<path>/?[^"'?#:]+)(?:\?[^"'#]*)?(?P=q)""")
+URL_RE = re.compile(r"""url\((?P<q>["']?)(?P<path>/?[^"')?#:]+)(?:\?[^"')#]*)?(?P=q)\)""")
+BG_RE = re.compile(r"""--bg:url\((?P<q>["']?)(?P<path>/?[^"')?#:]+)(?:\?[^"')#]*)?(?P=q)\);?""")
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:HASH_LEN]
+
+
+def hashed_name(rel: str, data: bytes) -> str:
+    stem, ext = os.path.splitext(rel)
+    return f"{stem}.{content_hash(data)}{ext}"
+
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _write(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def _files(root: str):
+    for dirpath, _, names in os.walk(root):
+        for name in sorted(names):
+            yield os.path.relpath(os.path.join(dirpath, name), root).replace(os.sep, "/")
+
+
+class Build:
+    def __init__(self, src: str, out: str):
+        self.src = src
+        self.out = out
+        self.manifest = {}   # "img/home3.jpg" -> "img/home3.1a2b3c4d5e.jpg"
+        self.variants = {}   # "img/home3.jpg" -> {"avif": {480: path, 960: path}, "webp": {...}}
+
+    def fingerprint(self, rel: str, data: bytes) -> str:
+        hashed = hashed_name(rel, data)
+        _write(os.path.join(self.out, hashed), data)
+        self.manifest[rel] = hashed
+        return hashed
+
+    def lookup(self, ref: str, base_rel: str = ""):
+        """Hashed URL for a reference found in base_rel, or None if it is not a built asset."""
+        if ref.startswith("/"):
+            rel = ref.lstrip("/")
+        else:
+            rel = os.path.normpath(os.path.join(os.path.dirname(base_rel), ref)).replace(os.sep, "/")
+        hashed = self.manifest.get(rel)
+        return "/" + hashed if hashed else None
+
+    # --- images ---
+
+    def image_variants(self, rel: str, data: bytes) -> None:
+        from io import BytesIO
+        from PIL import Image, features
+
+        formats = [("webp", "WEBP", {"quality": WEBP_QUALITY, "method": 6})]
+        if features.check("avif"):
+            formats.append(("avif", "AVIF", {"quality": AVIF_QUALITY}))
+        else:
+            print(f"[assets] AVIF not supported by this Pillow; {rel} gets WebP only")
+
+        with Image.open(BytesIO(data)) as im:
+            im = im.convert("RGBA" if im.mode in ("RGBA", "LA", "P") else "RGB")
+            widths = sorted({min(w, im.width) for w in IMAGE_WIDTHS})
+            stem = os.path.splitext(rel)[0]
+            for fmt, pil_format, options in formats:
+                for w in widths:
+                    h = round(im.height * w / im.width)
+                    buf = BytesIO()
+                    im.resize((w, h), Image.LANCZOS).save(buf, pil_format, **options)
+                    hashed = self.fingerprint(f"{stem}.{w}.{fmt}", buf.getvalue())
+                    self.variants.setdefault(rel, {}).setdefault(fmt, {})[w] = "/" + hashed
+
+    def image_set(self, rel: str) -> str:
+        """image-set() over the variants of rel: AVIF, then WebP, then the original, at 1x/2x."""
+        variants = self.variants.get(rel) or {}
+        entries = []
+        for fmt in ("avif", "webp"):
+            widths = sorted(variants.get(fmt, {}))
+            if not widths:
+                continue
+            entries.append(f"url('{variants[fmt][widths[0]]}') type('image/{fmt}') 1x")
+            entries.append(f"url('{variants[fmt][widths[-1]]}') type('image/{fmt}') 2x")
+        return f"image-set({', '.join(entries)})" if entries else ""
+
+    # --- text ---
+
+    def rewrite_css(self, rel: str, text: str) -> str:
+        def sub(m):
+            hashed = self.lookup(m.group("path"), rel)
+            return f"url({m.group('q')}{hashed}{m.group('q')})" if hashed else m.group(0)
+        return URL_RE.sub(sub, text)
+
+    def rewrite_html(self, rel: str, text: str) -> str:
+        def bg(m):
+            path = m.group("path")
+            asset = path.lstrip("/") if path.startswith("/") else path
+            hashed = self.lookup(path, rel)
+            if not hashed:
+                return m.group(0)
+            out = f"--bg:url('{hashed}');"
+            image_set = self.image_set(asset)
+            if image_set:
+                out += f" --bg-set:{image_set};"
+            return out
+
+        def ref(m):
+            hashed = self.lookup(m.group("path"), rel)
+            return f"{m.group('attr')}{m.group('q')}{hashed}{m.group('q')}" if hashed else m.group(0)
+
+        text = BG_RE.sub(bg, text)
+        text = self.rewrite_css(rel, text)
+        return REF_RE.sub(ref, text)
+
+    # --- compression ---
+
+    def compress(self) -> int:
+        try:
+            import brotli
+        except ImportError:
+            brotli = None
+            print("[assets] brotli module not installed; writing .gz only")
+        count = 0
+        for rel in list(_files(self.out)):
+            if os.path.splitext(rel)[1] not in COMPRESS_EXT:
+                continue
+            path = os.path.join(self.out, rel)
+            data = _read(path)
+            gz = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(gz) < len(data):
+                _write(path + ".gz", gz)
+                count += 1
+            if brotli is not None:
+                br = brotli.compress(data, quality=11)
+                if len(br) < len(data):
+                    _write(path + ".br", br)
+                    count += 1
+        return count
+
+    def run(self) -> dict:
+        if os.path.isdir(self.out):
+            shutil.rmtree(self.out)
+        shutil.copytree(self.src, self.out)
+        files = list(_files(self.src))
+
+        # Images first: CSS and HTML refer to them
+        for rel in files:
+            ext = os.path.splitext(rel)[1].lower()
+            if ext in FINGERPRINT_EXT and ext not in (".css", ".js"):
+                data = _read(os.path.join(self.src, rel))
+                self.fingerprint(rel, data)
+                if ext in RASTER_EXT and rel.startswith("img/"):
+                    self.image_variants(rel, data)
+        for rel in files:
+            if rel.endswith(".css"):
+                text = self.rewrite_css(rel, _read(os.path.join(self.src, rel)).decode("utf-8"))
+                _write(os.path.join(self.out, rel), text.encode("utf-8"))
+                self.fingerprint(rel, text.encode("utf-8"))
+            elif rel.endswith(".js"):
+                self.fingerprint(rel, _read(os.path.join(self.src, rel)))
+        for rel in files:
+            if rel.endswith(".html"):
+                text = self.rewrite_html(rel, _read(os.path.join(self.src, rel)).decode("utf-8"))
+                _write(os.path.join(self.out, rel), text.encode("utf-8"))
+
+        _write(os.path.join(self.out, "manifest.json"), json.dumps(self.manifest, indent=2, sort_keys=True).encode())
+        compressed = self.compress()
+        return {"assets": len(self.manifest), "compressed": compressed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fingerprint, compress and resize static assets.")
+    parser.add_argument("--src", default=os.path.join(ROOT, "web"))
+    parser.add_argument("--out", default=os.path.join(ROOT, "build", "web"))
+    args = parser.parse_args()
+    stats = Build(args.src, args.out).run()
+    print(f"[assets] {stats['assets']} hashed assets, {stats['compressed']} precompressed files -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Server-side /chat conversations.
+
+Each logged-in user's chat lives in a conversations row (keyed by users.id)
+plus one conversation_messages row per turn. A chat prompt carries the
+conversation's summary, its stored panel context and at most
+CHAT_WINDOW_MESSAGES recent turns, so prompt size stays flat however long
+the chat runs.
+
+When more than CHAT_WINDOW_MESSAGES turns sit outside the summary, the
+oldest ones (all but CHAT_KEEP_MESSAGES) are folded into the summary by one
+extra LLM call after the reply has been sent.
+
+Settings (environment):
+  CHAT_WINDOW_MESSAGES=8        recent turns sent verbatim (user + assistant)
+  CHAT_KEEP_MESSAGES=4          turns left verbatim after a summary refresh
+  CHAT_CONTEXT_MAX_CHARS=6000   stored panel markdown is cut to this length
+"""
+
+import os
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import select, update, func
+from sqlalchemy.orm import Session
+
+from models import Conversation, ConversationMessage
+
+CHAT_WINDOW_MESSAGES = int(os.getenv("CHAT_WINDOW_MESSAGES", "8"))
+CHAT_KEEP_MESSAGES = min(int(os.getenv("CHAT_KEEP_MESSAGES", "4")), CHAT_WINDOW_MESSAGES)
+CHAT_CONTEXT_MAX_CHARS = int(os.getenv("CHAT_CONTEXT_MAX_CHARS", "6000"))
+
+
+def open_conversation(
+    sess: Session,
+    user_id: int,
+    conversation_id: Optional[int] = None,
+    context_md: str = "",
+    context_kind: str = "",
+) -> Optional[Conversation]:
+    """
+    The user's conversation conversation_id, or a new one when it is None.
+    Returns None if conversation_id does not belong to user_id.
+    A non-empty context_md replaces the stored panel context.
+    """
+    now = datetime.utcnow()
+    if conversation_id is None:
+        conv = Conversation(user_id=user_id, summary="", summarized_through=0, created_at=now)
+        sess.add(conv)
+    else:
+        conv = sess.execute(
+            select(Conversation).where(Conversation.id == conversation_id, Conversation.user_id == user_id)
+        ).scalar_one_or_none()
+        if conv is None:
+            return None
+    if context_md:
+        conv.context_md = context_md[:CHAT_CONTEXT_MAX_CHARS]
+        conv.context_kind = context_kind or ""
+    elif conversation_id is None:
+        conv.context_md, conv.context_kind = "", ""
+    conv.updated_at = now
+    sess.flush()
+    return conv
+
+
+def recent_turns(sess: Session, conv: Conversation, limit: int = CHAT_WINDOW_MESSAGES) -> list:
+    """Up to limit turns not yet in the summary, oldest first, as chat messages."""
+    rows = sess.execute(
+        select(ConversationMessage.role, ConversationMessage.content)
+        .where(
+            ConversationMessage.conversation_id == conv.id,
+            ConversationMessage.id > conv.summarized_through,
+        )
+        .order_by(ConversationMessage.id.desc())
+        .limit(limit)
+    ).all()
+    return [{"role": role, "content": content} for role, content in reversed(rows)]
+
+
+def add_message(sess: Session, conversation_id: int, role: str, content: str) -> ConversationMessage:
+    m = ConversationMessage(conversation_id=conversation_id, role=role, content=content, created_at=datetime.utcnow())
+    sess.add(m)
+    sess.flush()
+    return m
+
+
+def pending_summary(sess: Session, conversation_id: int) -> Optional[dict]:
+    """
+    None while the unsummarized turns fit in the window; otherwise what to fold:
+    {"summary": previous summary, "from": summarized_through, "through": last id to fold,
+     "turns": [{"role", "content"}, ...]}
+    """
+    conv = sess.get(Conversation, conversation_id)
+    if conv is None:
+        return None
+    unsummarized = sess.execute(
+        select(func.count())
+        .select_from(ConversationMessage)
+        .where(
+            ConversationMessage.conversation_id == conversation_id,
+            ConversationMessage.id > conv.summarized_through,
+        )
+    ).scalar_one()
+    if unsummarized <= CHAT_WINDOW_MESSAGES:
+        return None
+    rows = sess.execute(
+        select(ConversationMessage.id, ConversationMessage.role, ConversationMessage.content)
+        .where(
+            ConversationMessage.conversation_id == conversation_id,
+            ConversationMessage.id > conv.summarized_through,
+        )
+        .order_by(ConversationMessage.id)
+        .limit(unsummarized - CHAT_KEEP_MESSAGES)
+    ).all()
+    return {
+        "summary": conv.summary,
+        "from": conv.summarized_through,
+        "through": rows[-1].id,
+        "turns": [{"role": r.role, "content": r.content} for r in rows],
+    }
+
+
+def save_summary(sess: Session, conversation_id: int, expected_from: int, through: int, summary: str) -> bool:
+    """
+    Store a refreshed summary covering messages up to through. Conditional on
+    summarized_through still being expected_from, so when two refreshes race
+    only the first one lands. The caller commits.
+    """
+    result = sess.execute(
+        update(Conversation)
+        .where(Conversation.id == conversation_id, Conversation.summarized_through == expected_from)
+        .values(summary=summary, summarized_through=through)
+    )
+    return (result.rowcount or 0) == 1
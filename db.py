@@ -1,10 +1,53 @@
-import hashlib
+import os, hashlib, threading
 from datetime import datetime, timedelta
 from typing import Optional, Literal
 
-from sqlalchemy.orm import Session
+from sqlalchemy import create_engine, update, delete, select, func
+from sqlalchemy.orm import Session, sessionmaker
 
-from models import User, EmailToken
+from models import User, EmailToken, EmailOutbox, LLMUsage
+import metrics
+import migrations
+
+# --- Engine ---
+# Built on first use, not at import, and once per process: a pool inherited
+# across fork() shares its sockets with the parent (see gunicorn.conf.py).
+
+_engine = None
+_engine_pid = None
+_sessionmaker = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """The process's engine; the first call creates it from DATABASE_URL and migrates the schema."""
+    global _engine, _engine_pid, _sessionmaker
+    if _engine is not None and _engine_pid == os.getpid():
+        return _engine
+    with _engine_lock:
+        if _engine is None:
+            engine = create_engine(os.getenv("DATABASE_URL"), poolclass=metrics.TimedQueuePool)
+            metrics.instrument_engine(engine)
+            # Fast no-op when schema_version is current; run `python migrations.py` to migrate ahead of deploys
+            migrations.migrate(engine)
+            _engine, _sessionmaker = engine, sessionmaker(bind=engine)
+            _engine_pid = os.getpid()
+        elif _engine_pid != os.getpid():
+            dispose_engine()
+        return _engine
+
+
+def dispose_engine() -> None:
+    """In a forked child: drop the parent's pooled connections (without closing its sockets) and start a fresh pool."""
+    global _engine_pid
+    if _engine is not None:
+        _engine.dispose(close=False)
+        _engine_pid = os.getpid()
+
+
+def get_session() -> Session:
+    get_engine()
+    return _sessionmaker()
 
 
 def create_user(sess: Session, email: str, password_hash: Optional[str] = None) -> User:
@@ -40,6 +83,30 @@ def issue_token(
     return t
 
 
+def enqueue_email(
+    sess: Session,
+    to_addr: str,
+    subject: str,
+    text: str,
+    html: Optional[str] = None,
+) -> EmailOutbox:
+    """Queue a message for outbox_worker; commit it in the same transaction as the token it carries."""
+    now = datetime.utcnow()
+    m = EmailOutbox(
+        to_addr=to_addr,
+        subject=subject,
+        body_text=text,
+        body_html=html,
+        status="pending",
+        attempts=0,
+        created_at=now,
+        next_attempt_at=now,
+    )
+    sess.add(m)
+    sess.flush()
+    return m
+
+
 def validate_token(sess: Session, token: str, purpose: Literal["reset", "verify"]) -> Optional[EmailToken]:
     now = datetime.utcnow()
     token_hash = hashlib.sha256(token.encode()).hexdigest()
@@ -48,6 +115,7 @@ def validate_token(sess: Session, token: str, purpose: Literal["reset", "verify"
         .filter(
             EmailToken.token_hash == token_hash,
             EmailToken.type == purpose,
+            EmailToken.used.is_(False),  # matches the partial index idx_email_tokens_live_hash
         )
         .one_or_none()
     )
@@ -56,14 +124,116 @@ def validate_token(sess: Session, token: str, purpose: Literal["reset", "verify"
     return t
 
 
+def claim_token(sess: Session, token: str, purpose: Literal["reset", "verify"]) -> Optional[int]:
+    """
+    Atomically mark a live token used and return its user_id, or None if the
+    token is unknown, already used or expired. A single conditional
+    UPDATE ... RETURNING, so two concurrent clicks can't both succeed.
+    The caller commits (together with whatever the token authorizes).
+    """
+    token_hash = hashlib.sha256(token.encode()).hexdigest()
+    stmt = (
+        update(EmailToken)
+        .where(
+            EmailToken.token_hash == token_hash,
+            EmailToken.type == purpose,
+            EmailToken.used.is_(False),
+            EmailToken.expires_at > func.now(),
+        )
+        .values(used=True, used_at=func.now())
+        .returning(EmailToken.user_id)
+    )
+    return sess.execute(stmt).scalar_one_or_none()
+
+
 def mark_token_used(sess: Session, t: EmailToken) -> None:
     t.used = True
     t.used_at = datetime.utcnow()
     sess.add(t)
 
 
-def cleanup_tokens(sess: Session) -> int:
-    now = datetime.utcnow()
-    deleted = sess.query(EmailToken).filter(EmailToken.expires_at <= now).delete()
+def _delete_batch(sess: Session, condition, batch_size: int) -> int:
+    ids = select(EmailToken.id).where(condition).limit(batch_size)
+    if sess.bind.dialect.name == "postgresql":
+        ids = ids.with_for_update(skip_locked=True)
+    result = sess.execute(
+        delete(EmailToken).where(EmailToken.id.in_(ids.scalar_subquery())),
+        execution_options={"synchronize_session": False},
+    )
     sess.commit()
-    return deleted
+    return result.rowcount or 0
+
+
+def cleanup_tokens(sess: Session, retention_hours: float = 0, batch_size: int = 1000) -> dict:
+    """
+    Delete tokens that expired, or were used, more than retention_hours ago.
+    Works in batches of batch_size rows, each in its own short transaction,
+    so no long locks are held. Returns {"expired": n, "used": n}.
+    """
+    cutoff = datetime.utcnow() - timedelta(hours=retention_hours)
+    counts = {"expired": 0, "used": 0}
+    conditions = {
+        "expired": EmailToken.expires_at < cutoff,
+        "used": EmailToken.used.is_(True) & (EmailToken.used_at < cutoff),
+    }
+    for name, condition in conditions.items():
+        while True:
+            n = _delete_batch(sess, condition, batch_size)
+            counts[name] += n
+            if n < batch_size:
+                break
+    return counts
+
+
+def add_llm_usage(sess: Session, subject: str, user_id: Optional[int], kind: str, model: str, usage: dict) -> LLMUsage:
+    """One ledger row for an LLM call; usage is the {prompt_tokens, completion_tokens, total_tokens} the model reported."""
+    prompt = int(usage.get("prompt_tokens") or 0)
+    completion = int(usage.get("completion_tokens") or 0)
+    row = LLMUsage(
+        subject=subject,
+        user_id=user_id,
+        kind=kind,
+        model=model,
+        prompt_tokens=prompt,
+        completion_tokens=completion,
+        total_tokens=int(usage.get("total_tokens") or prompt + completion),
+        created_at=datetime.utcnow(),
+    )
+    sess.add(row)
+    return row
+
+
+def top_llm_consumers(sess: Session, hours: float = 24, limit: int = 20) -> list:
+    """Callers with the most tokens in the last `hours`, heaviest first (served by idx_llm_usage_created)."""
+    since = datetime.utcnow() - timedelta(hours=hours)
+    total = func.sum(LLMUsage.total_tokens)
+    rows = sess.execute(
+        select(
+            LLMUsage.subject,
+            LLMUsage.user_id,
+            User.email,
+            func.count().label("calls"),
+            func.sum(LLMUsage.prompt_tokens).label("prompt_tokens"),
+            func.sum(LLMUsage.completion_tokens).label("completion_tokens"),
+            total.label("total_tokens"),
+            func.max(LLMUsage.created_at).label("last_call_at"),
+        )
+        .outerjoin(User, User.id == LLMUsage.user_id)
+        .where(LLMUsage.created_at >= since)
+        .group_by(LLMUsage.subject, LLMUsage.user_id, User.email)
+        .order_by(total.desc())
+        .limit(limit)
+    ).all()
+    return [
+        {
+            "subject": r.subject,
+            "user_id": r.user_id,
+            "email": r.email,
+            "calls": r.calls,
+            "prompt_tokens": int(r.prompt_tokens or 0),
+            "completion_tokens": int(r.completion_tokens or 0),
+            "total_tokens": int(r.total_tokens or 0),
+            "last_call_at": r.last_call_at.isoformat() if r.last_call_at else None,
+        }
+        for r in rows
+    ]
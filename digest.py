@@ -0,0 +1,224 @@
+"""
+Weekly plan digest: a /plan reply for every verified user, sent by email.
+
+  python digest.py                       # run this week's digest, or resume it
+  python digest.py --week 2026-10-12     # a given week (any day; its Monday is used)
+  python digest.py --status              # progress of the week's run
+
+Each page of DIGEST_PAGE_SIZE users (keyset on users.id, after the run's
+checkpoint, skipping users already sent this week) goes through:
+  1. one query for the page's journey states (users.phase when none is stored)
+  2. users grouped by reply cache key, so identical states share one reply;
+     one respond_with_model("plan") per distinct state, DIGEST_CONCURRENCY at a time.
+     The next page is fetched and submitted before this one is mailed, so
+     the LLM stays busy while SMTP sends
+  3. mail over one reused SMTP connection as each plan is ready; every
+     outcome is written to digest_deliveries and committed
+  4. digest_runs.last_user_id moves to the end of the page (the checkpoint)
+
+If the process dies, running it again continues from the checkpoint. A user
+is mailed twice only if the crash falls between the relay accepting their
+message and the delivery row being committed. Users whose plan or mail
+failed are retried by the next run of the same week.
+
+Try it locally against the stub model and the SMTP sink:
+  python bench/smtp_sink.py --port 2525 &
+  LLM_BACKEND=stub SMTP_HOST=127.0.0.1 SMTP_PORT=2525 SMTP_STARTTLS=0 python digest.py
+
+Settings (environment):
+  DIGEST_PAGE_SIZE=200            users per page (and per checkpoint)
+  DIGEST_CONCURRENCY=8            LLM calls in flight
+  DIGEST_SMTP_MAX_MESSAGES=500    messages per SMTP session before it is reopened
+"""
+
+import os, time, argparse, traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date
+
+from sqlalchemy import select, exists, func
+from sqlalchemy.orm import Session
+
+from models import User, JourneyState, DigestRun, DigestDelivery
+from mailer import SMTPConnection, build_message, weekly_digest_email
+from kpis import week_start
+import prompt_compiler
+import app as web
+
+PAGE_SIZE = int(os.getenv("DIGEST_PAGE_SIZE", "200"))
+CONCURRENCY = int(os.getenv("DIGEST_CONCURRENCY", "8"))
+SMTP_MAX_MESSAGES = int(os.getenv("DIGEST_SMTP_MAX_MESSAGES", "500"))
+
+
+def get_run(sess: Session, week: date) -> DigestRun:
+    run = sess.get(DigestRun, week)
+    if run is None:
+        run = DigestRun(week_start=week, started_at=datetime.utcnow(), last_user_id=0, generated=0)
+        sess.add(run)
+        sess.commit()
+    return run
+
+
+def next_page(sess: Session, week: date, after_id: int, size: int = PAGE_SIZE) -> list:
+    """[(user_id, email, user_state)] for the next verified users not yet sent this week."""
+    already_sent = exists().where(
+        DigestDelivery.week_start == week,
+        DigestDelivery.user_id == User.id,
+        DigestDelivery.status == "sent",
+    )
+    users = sess.execute(
+        select(User.id, User.email, User.phase)
+        .where(User.is_verified.is_(True), User.id > after_id, ~already_sent)
+        .order_by(User.id)
+        .limit(size)
+    ).all()
+    if not users:
+        return []
+    states = dict(sess.execute(
+        select(JourneyState.user_id, JourneyState.state).where(JourneyState.user_id.in_([u.id for u in users]))
+    ).all())
+    page = []
+    for uid, email, phase in users:
+        state = states.get(uid) or ({"current_phase": phase} if phase in web.ALLOWED_PHASES else {})
+        page.append((uid, email, state))
+    return page
+
+
+def submit(pool: ThreadPoolExecutor, page: list) -> dict:
+    """Start one plan per distinct state on the page; returns {cache key: future}."""
+    futures = {}
+    for _, _, state in page:
+        key = web.cache_key("plan", state, "")
+        if key not in futures:
+            futures[key] = pool.submit(web.respond_with_model, "plan", state, "")
+    return futures
+
+
+def record(sess: Session, week: date, user_id: int, status: str, state_key: str, error: str = None) -> None:
+    if sess.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    values = {"status": status, "state_key": state_key, "error": error, "updated_at": datetime.utcnow()}
+    sess.execute(
+        insert(DigestDelivery)
+        .values(week_start=week, user_id=user_id, **values)
+        .on_conflict_do_update(index_elements=["week_start", "user_id"], set_=values)
+    )
+    sess.commit()
+
+
+def deliver(sess: Session, conn: SMTPConnection, week: date, page: list, futures: dict) -> tuple:
+    """Mail each user their plan as it becomes ready; returns (sent, failed)."""
+    label = f"the week of {week:%d %b %Y}"
+    sent = failed = 0
+    for uid, email, state in page:
+        key = web.cache_key("plan", state, "")
+        try:
+            plan, model = futures[key].result()
+        except Exception as e:
+            record(sess, week, uid, "failed", key, f"plan: {e}"[:1000])
+            failed += 1
+            continue
+        try:
+            conn.send(build_message(email, **weekly_digest_email(prompt_compiler.current_phase(state), label, plan)))
+        except Exception as e:
+            # Start the next message from a clean handshake
+            conn.close()
+            record(sess, week, uid, "failed", key, f"smtp: {e}"[:1000])
+            failed += 1
+            continue
+        record(sess, week, uid, "sent", key)
+        web.save_reply(uid, "plan", state, model, plan)
+        sent += 1
+    return sent, failed
+
+
+def run(week: date, page_size: int = PAGE_SIZE, concurrency: int = CONCURRENCY) -> dict:
+    sess = web.get_session()
+    started = time.perf_counter()
+    done = 0
+    try:
+        digest = get_run(sess, week)
+        if digest.finished_at is not None:
+            # Running a finished week again retries its failures and picks up newly verified users
+            digest.last_user_id, digest.finished_at = 0, None
+            sess.commit()
+        print(f"[digest] week {week} from user id > {digest.last_user_id}")
+        with ThreadPoolExecutor(max_workers=concurrency) as pool, SMTPConnection(max_messages=SMTP_MAX_MESSAGES) as conn:
+            page = next_page(sess, week, digest.last_user_id, page_size)
+            futures = submit(pool, page)
+            while page:
+                upcoming = next_page(sess, week, page[-1][0], page_size)
+                upcoming_futures = submit(pool, upcoming)
+                sent, failed = deliver(sess, conn, week, page, futures)
+                digest.last_user_id = page[-1][0]
+                digest.generated += len(futures)
+                sess.commit()
+                done += sent + failed
+                elapsed = time.perf_counter() - started
+                print(
+                    f"[digest] users<={digest.last_user_id} sent={sent} failed={failed} plans={len(futures)} "
+                    f"rate={done / elapsed * 60:.0f} users/min"
+                )
+                page, futures = upcoming, upcoming_futures
+        digest.finished_at = datetime.utcnow()
+        sess.commit()
+        elapsed = time.perf_counter() - started
+        summary = {
+            **delivery_counts(sess, week),
+            "plans": digest.generated,
+            "users_this_run": done,
+            "seconds": round(elapsed, 1),
+            "users_per_min": round(done / elapsed * 60, 1) if elapsed > 0 else 0,
+        }
+        print(f"[digest] done: {summary}")
+        return summary
+    finally:
+        sess.close()
+
+
+def delivery_counts(sess: Session, week: date) -> dict:
+    counts = dict(sess.execute(
+        select(DigestDelivery.status, func.count()).where(DigestDelivery.week_start == week).group_by(DigestDelivery.status)
+    ).all())
+    return {"week": week.isoformat(), "sent": counts.get("sent", 0), "failed": counts.get("failed", 0)}
+
+
+def status(week: date) -> dict:
+    sess = web.get_session()
+    try:
+        digest = sess.get(DigestRun, week)
+        if digest is None:
+            return {"week": week.isoformat(), "started": False}
+        return {
+            **delivery_counts(sess, week),
+            "started_at": digest.started_at.isoformat(),
+            "finished_at": digest.finished_at.isoformat() if digest.finished_at else None,
+            "last_user_id": digest.last_user_id,
+            "plans": digest.generated,
+        }
+    finally:
+        sess.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Email every verified user their weekly plan.")
+    parser.add_argument("--week", type=date.fromisoformat, default=None, help="any day of the week (default: this week)")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--status", action="store_true", help="show the run's progress and exit")
+    args = parser.parse_args()
+    week = week_start(args.week or datetime.utcnow().date())
+    if args.status:
+        print(f"[digest] {status(week)}")
+        return
+    try:
+        run(week, args.page_size, args.concurrency)
+    except Exception:
+        traceback.print_exc()
+        print("[digest] stopped; run again to resume from the last checkpoint")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
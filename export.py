@@ -0,0 +1,239 @@
+"""
+Streaming export of everything stored for one user (GET /export).
+
+Sections, in order:
+  profile          the users row (email, phase, created_at)
+  journey_state    the stored user_state document and its version
+  conversations    /chat threads (summary, context)
+  messages         every /chat turn, user and coach
+  replies          coach reply history, with the reply text
+  notes            notes sent with coach requests (kept only in the search index)
+  kpi_events       the KPI event log
+  kpi_weekly       the weekly KPI rollups
+  applications     the application tracker
+
+Each section is read with yield_per, so rows come off a server-side cursor
+in batches (Postgres) and are written out as they arrive; the export is
+never materialized. Output is buffered into chunks of about
+EXPORT_CHUNK_BYTES, and with gzip each chunk is compressed and sync-flushed
+on its own, so the client sees bytes as soon as the first chunk is ready.
+
+Formats:
+  ndjson           one JSON object per line: {"section": "...", ...fields}
+  csv              all sections: section,id,at,data (data is the record as JSON)
+  csv + section=X  that section only, one column per field
+
+Settings (environment):
+  EXPORT_BATCH_ROWS=1000      rows fetched per round trip
+  EXPORT_CHUNK_BYTES=65536    bytes per chunk written to the client
+"""
+
+import os, io, csv, json, zlib
+from datetime import datetime, date
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from models import (
+    User, JourneyState, Conversation, ConversationMessage, KpiEvent, KpiWeekly, Application, ReplyHistory, ReplyBlob,
+    SearchDoc,
+)
+import reply_history
+
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "1000"))
+EXPORT_CHUNK_BYTES = int(os.getenv("EXPORT_CHUNK_BYTES", "65536"))
+FORMAT_VERSION = 1
+FORMATS = ("ndjson", "csv")
+
+
+# section -> (field names, query for one user); each query selects exactly those columns
+SECTIONS = {
+    "profile": (
+        ["id", "email", "is_verified", "phase", "created_at"],
+        lambda uid: select(User.id, User.email, User.is_verified, User.phase, User.created_at).where(User.id == uid),
+    ),
+    "journey_state": (
+        ["version", "updated_at", "state"],
+        lambda uid: select(JourneyState.version, JourneyState.updated_at, JourneyState.state).where(JourneyState.user_id == uid),
+    ),
+    "conversations": (
+        ["id", "context_kind", "summary", "created_at", "updated_at"],
+        lambda uid: select(
+            Conversation.id, Conversation.context_kind, Conversation.summary, Conversation.created_at, Conversation.updated_at
+        ).where(Conversation.user_id == uid).order_by(Conversation.id),
+    ),
+    "messages": (
+        ["id", "conversation_id", "role", "content", "created_at"],
+        lambda uid: select(
+            ConversationMessage.id,
+            ConversationMessage.conversation_id,
+            ConversationMessage.role,
+            ConversationMessage.content,
+            ConversationMessage.created_at,
+        )
+        .join(Conversation, Conversation.id == ConversationMessage.conversation_id)
+        .where(Conversation.user_id == uid)
+        .order_by(ConversationMessage.conversation_id, ConversationMessage.id),
+    ),
+    "replies": (
+        ["id", "kind", "phase", "week", "model", "title", "created_at", "codec", "reply"],
+        lambda uid: select(
+            ReplyHistory.id, ReplyHistory.kind, ReplyHistory.phase, ReplyHistory.week, ReplyHistory.model,
+            ReplyHistory.title, ReplyHistory.created_at, ReplyBlob.codec, ReplyBlob.data,
+        )
+        .join(ReplyBlob, ReplyBlob.hash == ReplyHistory.blob_hash)
+        .where(ReplyHistory.user_id == uid)
+        .order_by(ReplyHistory.id),
+    ),
+    "notes": (
+        ["id", "kind", "ref_id", "body", "created_at"],
+        lambda uid: select(SearchDoc.id, SearchDoc.kind, SearchDoc.ref_id, SearchDoc.body, SearchDoc.created_at)
+        .where(SearchDoc.user_id == uid, SearchDoc.source == "note")
+        .order_by(SearchDoc.id),
+    ),
+    "kpi_events": (
+        ["id", "metric", "value", "occurred_at", "created_at"],
+        lambda uid: select(KpiEvent.id, KpiEvent.metric, KpiEvent.value, KpiEvent.occurred_at, KpiEvent.created_at)
+        .where(KpiEvent.user_id == uid)
+        .order_by(KpiEvent.occurred_at, KpiEvent.id),
+    ),
+    "kpi_weekly": (
+        ["week_start", "metric", "events", "total", "min_value", "max_value", "last_value"],
+        lambda uid: select(
+            KpiWeekly.week_start, KpiWeekly.metric, KpiWeekly.events, KpiWeekly.total,
+            KpiWeekly.min_value, KpiWeekly.max_value, KpiWeekly.last_value,
+        ).where(KpiWeekly.user_id == uid).order_by(KpiWeekly.week_start, KpiWeekly.metric),
+    ),
+    "applications": (
+        ["id", "company", "role", "url", "source", "contact", "location", "notes", "status",
+         "next_follow_up", "status_changed_at", "created_at", "updated_at"],
+        lambda uid: select(
+            Application.id, Application.company, Application.role, Application.url, Application.source,
+            Application.contact, Application.location, Application.notes, Application.status,
+            Application.next_follow_up, Application.status_changed_at, Application.created_at, Application.updated_at,
+        ).where(Application.user_id == uid).order_by(Application.id),
+    ),
+}
+
+
+def _decode_reply(rec: dict) -> dict:
+    rec["reply"] = reply_history.decode(rec.pop("codec"), rec["reply"])
+    return rec
+
+
+# Per-section fix-ups between the selected columns and the exported record
+ROW_DECODERS = {"replies": _decode_reply}
+OUTPUT_FIELDS = {name: fields for name, (fields, _) in SECTIONS.items()}
+OUTPUT_FIELDS["replies"] = [f for f in SECTIONS["replies"][0] if f != "codec"]
+# Timestamp shown in the "at" column of the combined CSV
+AT_FIELD = {"profile": "created_at", "journey_state": "updated_at", "kpi_events": "occurred_at", "kpi_weekly": "week_start"}
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _cell(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=_json_default)
+    return "" if value is None else value
+
+
+def records(sess: Session, user_id: int, sections=None, batch_rows: int = EXPORT_BATCH_ROWS):
+    """(section, record dict) for every stored row of the user, one section after another."""
+    for name in sections or SECTIONS:
+        fields, query = SECTIONS[name]
+        result = sess.execute(query(user_id).execution_options(yield_per=batch_rows))
+        try:
+            decode = ROW_DECODERS.get(name)
+            for row in result:
+                rec = dict(zip(fields, row))
+                yield name, decode(rec) if decode else rec
+        finally:
+            result.close()
+
+
+def ndjson_lines(sess: Session, user_id: int, sections=None):
+    header = {
+        "section": "export",
+        "format_version": FORMAT_VERSION,
+        "user_id": user_id,
+        "generated_at": datetime.utcnow().isoformat() + "Z",
+        "sections": list(sections or SECTIONS),
+    }
+    yield json.dumps(header, separators=(",", ":")) + "\n"
+    for name, rec in records(sess, user_id, sections):
+        yield json.dumps({"section": name, **rec}, separators=(",", ":"), ensure_ascii=False, default=_json_default) + "\n"
+
+
+def csv_lines(sess: Session, user_id: int, section: str = None):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+
+    def line(values):
+        writer.writerow(values)
+        out = buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+        return out
+
+    if section:
+        fields = OUTPUT_FIELDS[section]
+        yield line(fields)
+        for _, rec in records(sess, user_id, [section]):
+            yield line([_cell(rec[f]) for f in fields])
+        return
+    yield line(["section", "id", "at", "data"])
+    for name, rec in records(sess, user_id):
+        at = rec.get(AT_FIELD.get(name, "created_at"))
+        yield line([name, _cell(rec.get("id")), _cell(at), _cell(rec)])
+
+
+def chunked(lines, chunk_bytes: int = EXPORT_CHUNK_BYTES):
+    """Join lines into ~chunk_bytes blocks; the first line goes out alone so the download starts at once."""
+    pending, size, first = [], 0, True
+    for text in lines:
+        data = text.encode("utf-8")
+        if first:
+            first = False
+            yield data
+            continue
+        pending.append(data)
+        size += len(data)
+        if size >= chunk_bytes:
+            yield b"".join(pending)
+            pending, size = [], 0
+    if pending:
+        yield b"".join(pending)
+
+
+def gzipped(chunks, level: int = 6):
+    """Gzip a byte stream on the fly; every chunk is sync-flushed so it can be decoded as it arrives."""
+    comp = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        out = comp.compress(chunk) + comp.flush(zlib.Z_SYNC_FLUSH)
+        if out:
+            yield out
+    yield comp.flush()
+
+
+def stream(session_factory, user_id: int, fmt: str = "ndjson", section: str = None, gzip: bool = False):
+    """
+    Byte chunks of the export. Opens and closes its own session, so it can
+    outlive the request handler; closing the generator early (client went
+    away) closes the cursor and the session.
+    """
+    sess = session_factory()
+    try:
+        if fmt == "csv":
+            lines = csv_lines(sess, user_id, section)
+        else:
+            lines = ndjson_lines(sess, user_id, [section] if section else None)
+        chunks = chunked(lines)
+        yield from gzipped(chunks) if gzip else chunks
+    finally:
+        sess.close()
@@ -0,0 +1,51 @@
+"""
+Gunicorn settings; gunicorn loads ./gunicorn.conf.py automatically.
+
+  gunicorn app:app
+
+The app is imported once in the master (preload_app) and workers are forked
+from it, so a new or recycled worker starts without re-importing anything.
+That is safe because importing app opens no connections: the DB engine,
+LLM client and Redis-backed services are built per process on first use,
+and post_fork drops anything the master built before forking.
+
+Settings (environment):
+  GUNICORN_PRELOAD=1            set to 0 to import the app in each worker instead
+  GUNICORN_MAX_REQUESTS=0       recycle a worker after this many requests (0: never)
+"""
+
+import os, glob
+
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") != "0"
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+
+
+def on_starting(server):
+    # Stale per-worker metric files from a previous run would be summed into /metrics
+    d = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if d:
+        os.makedirs(d, exist_ok=True)
+        for path in glob.glob(os.path.join(d, "*.db")):
+            os.remove(path)
+
+
+def when_ready(server):
+    # One-off work done in the master is inherited by every worker through fork():
+    # the login dummy hash (one bcrypt) and the OpenAI SDK import (most of a cold import)
+    import passwords
+    passwords.dummy_hash()
+    if os.getenv("LLM_BACKEND", "openai").strip().lower() == "openai":
+        import openai  # noqa: F401
+
+
+def post_fork(server, worker):
+    # A pool or client the master built (e.g. in a preload-time check) must not be shared
+    import services
+    services.after_fork()
+
+
+def child_exit(server, worker):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
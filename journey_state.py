@@ -0,0 +1,117 @@
+"""
+Server-side journey state (the user_state JSON from sample_state.json).
+
+One journey_states row per user holds the state document and a version that
+goes up by one on every change. GET /state returns both, with the version as
+the ETag. PATCH /state takes a JSON merge patch (RFC 7386: objects merge,
+null deletes a key, anything else replaces). An If-Match header makes the
+update conditional on the version the client last saw; a mismatch raises
+VersionConflict (412).
+
+Coach endpoints use the stored state when a request carries no user_state.
+
+Settings (environment):
+  JOURNEY_STATE_MAX_BYTES=16384   largest state document accepted (compact JSON)
+"""
+
+import os, json
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import JourneyState
+from prompt_compiler import PHASES
+
+JOURNEY_STATE_MAX_BYTES = int(os.getenv("JOURNEY_STATE_MAX_BYTES", "16384"))
+UNCONDITIONAL_RETRIES = 3
+
+
+class InvalidState(ValueError):
+    pass
+
+
+class VersionConflict(Exception):
+    def __init__(self, version: int):
+        super().__init__(f"journey state is at version {version}")
+        self.version = version
+
+
+def merge_patch(target, patch):
+    """RFC 7386 JSON merge patch; returns a new document."""
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = merge_patch(result.get(key), value)
+    return result
+
+
+def validate(state: dict) -> None:
+    size = len(json.dumps(state, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+    if size > JOURNEY_STATE_MAX_BYTES:
+        raise InvalidState(f"state is {size} bytes; the limit is {JOURNEY_STATE_MAX_BYTES}")
+    phase = state.get("current_phase")
+    if phase is not None and (not isinstance(phase, str) or phase.strip().lower() not in PHASES):
+        raise InvalidState("invalid current_phase")
+
+
+def load(sess: Session, user_id: int) -> tuple:
+    """(state, version) for the user; ({}, 0) before the first update."""
+    row = sess.get(JourneyState, user_id, populate_existing=True)
+    if row is None:
+        return {}, 0
+    return row.state or {}, row.version
+
+
+def apply_patch(
+    sess: Session,
+    user_id: int,
+    patch,
+    expected_version: Optional[int] = None,
+    initial: Optional[dict] = None,
+) -> tuple:
+    """
+    Merge patch into the user's state and return (state, version).
+    With expected_version the update only applies at that version
+    (VersionConflict otherwise); without it, lost races are retried.
+    initial is the state at version 0. A patch that changes nothing keeps
+    the version. The caller commits.
+    """
+    if not isinstance(patch, dict):
+        raise InvalidState("merge patch must be a JSON object")
+    for _ in range(UNCONDITIONAL_RETRIES):
+        row = sess.get(JourneyState, user_id, populate_existing=True)
+        current, version = (row.state or {}, row.version) if row is not None else (initial or {}, 0)
+        if expected_version is not None and expected_version != version:
+            raise VersionConflict(version)
+        state = merge_patch(current, patch)
+        validate(state)
+        if state == current:
+            return current, version
+
+        now = datetime.utcnow()
+        if row is None:
+            try:
+                with sess.begin_nested():
+                    sess.add(JourneyState(user_id=user_id, state=state, version=1, updated_at=now))
+                return state, 1
+            except IntegrityError:
+                pass  # another request created the row first
+        else:
+            result = sess.execute(
+                update(JourneyState)
+                .where(JourneyState.user_id == user_id, JourneyState.version == version)
+                .values(state=state, version=version + 1, updated_at=now)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 1:
+                return state, version + 1
+        if expected_version is not None:
+            raise VersionConflict(load(sess, user_id)[1])
+    raise VersionConflict(load(sess, user_id)[1])
@@ -0,0 +1,260 @@
+"""
+KPI event log and weekly rollups.
+
+kpi_events is append-only: one row per increment ("+1 lead") or measurement
+("sleep_score 72"). record_events() inserts the events and, in the same
+transaction, upserts the matching kpi_weekly rows (user, ISO week, metric):
+event count, sum, min, max and latest value. GET /kpis/trend reads only
+kpi_weekly, so its cost depends on the number of weeks asked for, not on how
+many events a user has logged.
+
+Metrics:
+  learning_conversations, leads, interviews   counts; value is the increment (default 1)
+  sleep_score, mood                           measurements (0-100); trend shows weekly average and last value
+
+Weeks start on Monday, UTC.
+
+  python kpis.py --rebuild              # recompute kpi_weekly from kpi_events (repair / backfill)
+  python kpis.py --rebuild --user 42
+
+Settings (environment):
+  KPI_EVENTS_PER_REQUEST=100    most events one POST /kpis/events may carry
+  KPI_TREND_MAX_WEEKS=156       longest trend window
+"""
+
+import os, math, argparse
+from datetime import datetime, date, timedelta, timezone
+
+from sqlalchemy import select, delete, func, case, or_
+from sqlalchemy.orm import Session
+
+from models import KpiEvent, KpiWeekly
+
+COUNT_METRICS = ("learning_conversations", "leads", "interviews")
+MEASURE_METRICS = ("sleep_score", "mood")
+METRICS = COUNT_METRICS + MEASURE_METRICS
+MEASURE_RANGE = (0, 100)
+MAX_INCREMENT = 1000
+FUTURE_SLACK = timedelta(minutes=5)
+
+KPI_EVENTS_PER_REQUEST = int(os.getenv("KPI_EVENTS_PER_REQUEST", "100"))
+KPI_TREND_MAX_WEEKS = int(os.getenv("KPI_TREND_MAX_WEEKS", "156"))
+
+
+def week_start(when) -> date:
+    day = when.date() if isinstance(when, datetime) else when
+    return day - timedelta(days=day.weekday())
+
+
+def _utc_naive(value: datetime) -> datetime:
+    # Timestamps are stored as naive UTC like everywhere else (datetime.utcnow())
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def parse_event(raw, now: datetime = None) -> dict:
+    """{"metric", "value", "occurred_at"} from a request item; raises ValueError with a client-facing message."""
+    now = now or datetime.utcnow()
+    if not isinstance(raw, dict):
+        raise ValueError("each event must be an object")
+    metric = str(raw.get("metric") or "").strip().lower()
+    if metric not in METRICS:
+        raise ValueError(f"unknown metric '{metric}' (expected one of {', '.join(METRICS)})")
+
+    value = raw.get("value", 1 if metric in COUNT_METRICS else None)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(f"{metric}: value must be a number")
+    if metric in COUNT_METRICS:
+        if value != int(value) or value == 0 or abs(value) > MAX_INCREMENT:
+            raise ValueError(f"{metric}: value must be a non-zero whole number up to {MAX_INCREMENT}")
+    elif not MEASURE_RANGE[0] <= value <= MEASURE_RANGE[1]:
+        raise ValueError(f"{metric}: value must be between {MEASURE_RANGE[0]} and {MEASURE_RANGE[1]}")
+
+    occurred_at = now
+    if raw.get("occurred_at"):
+        try:
+            occurred_at = _utc_naive(datetime.fromisoformat(str(raw["occurred_at"])))
+        except ValueError:
+            raise ValueError("occurred_at must be an ISO 8601 timestamp") from None
+        if occurred_at > now + FUTURE_SLACK:
+            raise ValueError("occurred_at is in the future")
+    return {"metric": metric, "value": float(value), "occurred_at": occurred_at}
+
+
+def parse_weeks(raw) -> int:
+    """Trend window from ?weeks=; raises ValueError with a client-facing message."""
+    try:
+        weeks = int(raw)
+    except (TypeError, ValueError):
+        raise ValueError("weeks must be a number") from None
+    if not 1 <= weeks <= KPI_TREND_MAX_WEEKS:
+        raise ValueError(f"weeks must be between 1 and {KPI_TREND_MAX_WEEKS}")
+    return weeks
+
+
+def _aggregate(user_id: int, events) -> list:
+    """kpi_weekly deltas for events, one per (week, metric)."""
+    groups = {}
+    for e in events:
+        key = (week_start(e["occurred_at"]), e["metric"])
+        g = groups.get(key)
+        if g is None:
+            groups[key] = {
+                "user_id": user_id,
+                "week_start": key[0],
+                "metric": key[1],
+                "events": 1,
+                "total": e["value"],
+                "min_value": e["value"],
+                "max_value": e["value"],
+                "last_value": e["value"],
+                "last_at": e["occurred_at"],
+            }
+            continue
+        g["events"] += 1
+        g["total"] += e["value"]
+        g["min_value"] = min(g["min_value"], e["value"])
+        g["max_value"] = max(g["max_value"], e["value"])
+        if e["occurred_at"] >= g["last_at"]:
+            g["last_value"], g["last_at"] = e["value"], e["occurred_at"]
+    return list(groups.values())
+
+
+def _upsert_rollup(sess: Session, delta: dict) -> None:
+    """Fold one delta into kpi_weekly with a single INSERT ... ON CONFLICT DO UPDATE."""
+    if sess.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+        greatest, least = func.greatest, func.least
+    else:
+        # SQLite stand-in: multi-argument min()/max() are its LEAST/GREATEST
+        from sqlalchemy.dialects.sqlite import insert
+        greatest, least = func.max, func.min
+
+    t = KpiWeekly.__table__.c
+    stmt = insert(KpiWeekly).values(**delta)
+    new = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[t.user_id, t.week_start, t.metric],
+        set_={
+            "events": t.events + new.events,
+            "total": t.total + new.total,
+            "min_value": least(func.coalesce(t.min_value, new.min_value), new.min_value),
+            "max_value": greatest(func.coalesce(t.max_value, new.max_value), new.max_value),
+            "last_value": case((or_(t.last_at.is_(None), new.last_at >= t.last_at), new.last_value), else_=t.last_value),
+            "last_at": greatest(func.coalesce(t.last_at, new.last_at), new.last_at),
+        },
+    )
+    sess.execute(stmt)
+
+
+def record_events(sess: Session, user_id: int, events: list) -> int:
+    """Append parsed events and update their weekly rollups. The caller commits (both or neither land)."""
+    if not events:
+        return 0
+    now = datetime.utcnow()
+    sess.add_all([
+        KpiEvent(user_id=user_id, metric=e["metric"], value=e["value"], occurred_at=e["occurred_at"], created_at=now)
+        for e in events
+    ])
+    sess.flush()
+    # Sorted so concurrent requests for the same user lock rollup rows in the same order
+    for delta in sorted(_aggregate(user_id, events), key=lambda d: (d["week_start"], d["metric"])):
+        _upsert_rollup(sess, delta)
+    return len(events)
+
+
+def trend(sess: Session, user_id: int, weeks: int = 12, metrics=None, today: date = None) -> dict:
+    """
+    The last `weeks` ISO weeks (oldest first) from kpi_weekly only:
+      counts:       weekly sums, plus their total over the window
+      measurements: weekly average and last value (None for weeks without data)
+    Raises ValueError for a window outside 1..KPI_TREND_MAX_WEEKS (see parse_weeks).
+    """
+    weeks = parse_weeks(weeks)
+    metrics = [m for m in (metrics or METRICS) if m in METRICS]
+    current = week_start(today or datetime.utcnow().date())
+    starts = [current - timedelta(weeks=weeks - 1 - i) for i in range(weeks)]
+    index = {w: i for i, w in enumerate(starts)}
+
+    rows = sess.execute(
+        select(KpiWeekly.week_start, KpiWeekly.metric, KpiWeekly.events, KpiWeekly.total, KpiWeekly.last_value)
+        .where(KpiWeekly.user_id == user_id, KpiWeekly.week_start >= starts[0], KpiWeekly.metric.in_(metrics))
+    ).all()
+
+    series = {}
+    for m in metrics:
+        if m in COUNT_METRICS:
+            series[m] = {"kind": "count", "values": [0] * weeks, "window_total": 0}
+        else:
+            series[m] = {"kind": "measurement", "average": [None] * weeks, "last": [None] * weeks}
+    for week, metric, events, total, last_value in rows:
+        i = index.get(week)
+        if i is None:
+            continue
+        s = series[metric]
+        if s["kind"] == "count":
+            s["values"][i] = int(total)
+            s["window_total"] += int(total)
+        elif events:
+            s["average"][i] = round(total / events, 2)
+            s["last"][i] = last_value
+    return {"weeks": [w.isoformat() for w in starts], "metrics": series}
+
+
+def rebuild(sess: Session, user_id: int = None, batch_size: int = 5000) -> int:
+    """Recompute kpi_weekly from kpi_events (all users, or one). Returns the rollup rows written."""
+    cond = [KpiEvent.user_id == user_id] if user_id else []
+    sess.execute(delete(KpiWeekly).where(*([KpiWeekly.user_id == user_id] if user_id else [])))
+    written = 0
+    current_user, pending = None, []
+
+    def flush():
+        nonlocal written
+        for delta in _aggregate(current_user, pending):
+            _upsert_rollup(sess, delta)
+            written += 1
+
+    stream = sess.execute(
+        select(KpiEvent.user_id, KpiEvent.metric, KpiEvent.value, KpiEvent.occurred_at)
+        .where(*cond)
+        .order_by(KpiEvent.user_id, KpiEvent.occurred_at)
+        .execution_options(yield_per=batch_size)
+    )
+    for uid, metric, value, occurred_at in stream:
+        if uid != current_user and pending:
+            flush()
+            pending = []
+        current_user = uid
+        pending.append({"metric": metric, "value": value, "occurred_at": _utc_naive(occurred_at)})
+    if pending:
+        flush()
+    return written
+
+
+def main():
+    from dotenv import load_dotenv
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="KPI rollup maintenance.")
+    parser.add_argument("--rebuild", action="store_true", help="recompute kpi_weekly from kpi_events")
+    parser.add_argument("--user", type=int, default=None, help="only this user id")
+    args = parser.parse_args()
+    if not args.rebuild:
+        parser.print_help()
+        return
+
+    engine = create_engine(os.getenv("DATABASE_URL"))
+    sess = sessionmaker(bind=engine)()
+    try:
+        n = rebuild(sess, args.user)
+        sess.commit()
+    finally:
+        sess.close()
+    print(f"[kpis] rebuilt {n} weekly rollup rows")
+
+
+if __name__ == "__main__":
+    main()
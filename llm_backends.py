@@ -0,0 +1,337 @@
+"""
+LLM backends: where coach and chat completions come from.
+
+LLM_BACKEND selects one per process:
+  openai   (default) the OpenAI API; needs OPENAI_API_KEY (OPENAI_BASE_URL is honoured)
+  stub     deterministic local markdown with configurable latency; no network or key
+  record   calls OpenAI and saves each exchange, redacted, to LLM_CASSETTE_DIR
+  replay   answers from LLM_CASSETTE_DIR with the recorded timing; no network or key
+
+Every backend streams. stream(model, messages, temperature) returns an
+iterator and stream_async(...) an async iterator of OpenAI-shaped chunks
+(chunk.choices[0].delta.content, with usage on the final chunk), which is
+what llm_fallback consumes.
+
+Stub settings (environment):
+  LLM_STUB_TTFT=0.4             mean seconds to the first token
+  LLM_STUB_TOKENS_PER_SEC=60    mean streaming rate
+  LLM_STUB_JITTER=0.25          relative spread of both
+  LLM_STUB_DIST=lognormal       fixed | uniform | lognormal
+  LLM_STUB_TOKENS=180           approximate reply length
+  LLM_STUB_SEED=0               timing and text are a function of (seed, request)
+
+Cassette settings:
+  LLM_CASSETTE_DIR=cassettes    one JSON file per (model, messages, temperature)
+  LLM_REPLAY_SPEED=1            2 replays twice as fast; 0 drops the delays
+"""
+
+import os, re, json, math, time, random, asyncio, hashlib
+from types import SimpleNamespace
+
+from prompt_compiler import estimate_tokens, current_phase
+
+
+# --- OpenAI-shaped chunks ---
+
+def delta_chunk(text: str):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(index=0, delta=SimpleNamespace(content=text), finish_reason=None)],
+        usage=None,
+    )
+
+
+def usage_chunk(prompt_tokens: int, completion_tokens: int):
+    return SimpleNamespace(
+        choices=[],
+        usage=SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+        ),
+    )
+
+
+def request_key(model: str, messages: list, temperature) -> str:
+    raw = json.dumps({"model": model, "messages": messages, "temperature": temperature}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:24]
+
+
+def _play(steps):
+    """steps: [(seconds after start, chunk), ...] -> chunks released on that schedule."""
+    start = time.perf_counter()
+    for at, chunk in steps:
+        wait = start + at - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        yield chunk
+
+
+async def _play_async(steps):
+    start = time.perf_counter()
+    for at, chunk in steps:
+        wait = start + at - time.perf_counter()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        yield chunk
+
+
+# --- openai ---
+
+class OpenAIBackend:
+    name = "openai"
+
+    def __init__(self, api_key: str = None):
+        from openai import OpenAI, AsyncOpenAI
+        api_key = api_key or os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise RuntimeError("OPENAI_API_KEY is not set. Put it in .env, export it, or use LLM_BACKEND=stub.")
+        self.client = OpenAI(api_key=api_key)
+        self.async_client = AsyncOpenAI(api_key=api_key)
+
+    def _kwargs(self, model, messages, temperature):
+        return dict(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+
+    def stream(self, model, messages, temperature):
+        return self.client.chat.completions.create(**self._kwargs(model, messages, temperature))
+
+    async def stream_async(self, model, messages, temperature):
+        stream = await self.async_client.chat.completions.create(**self._kwargs(model, messages, temperature))
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            # A cancelled or closed hedge attempt must release its HTTP response too
+            await stream.close()
+
+    async def aclose(self):
+        await self.async_client.close()
+
+
+# --- stub ---
+
+STUB_OBJECTIVES = [
+    "Block two 90-minute deep-work sessions for the main deliverable",
+    "Book one learning conversation with someone two steps ahead",
+    "Draft the exit-criteria checklist for this phase",
+    "Schedule two recovery blocks and protect them",
+    "Turn last week's notes into three concrete next actions",
+    "Review the budget and runway numbers once",
+    "Ask one reviewer for feedback on the newest artifact",
+]
+STUB_CHECKLIST = [
+    "Calendar blocks set for the week",
+    "Daily 15-minute admin sprint done",
+    "One outreach message sent",
+    "Notes captured in the learning log",
+    "Evening shutdown ritual",
+    "Sleep and mood logged",
+    "Next single action written down",
+    "Friday review booked",
+]
+
+
+class StubBackend:
+    """Deterministic markdown with sampled time-to-first-token and token rate."""
+
+    name = "stub"
+
+    def __init__(self):
+        self.ttft = float(os.getenv("LLM_STUB_TTFT", "0.4"))
+        self.rate = float(os.getenv("LLM_STUB_TOKENS_PER_SEC", "60"))
+        self.jitter = float(os.getenv("LLM_STUB_JITTER", "0.25"))
+        self.dist = os.getenv("LLM_STUB_DIST", "lognormal").lower()
+        self.tokens = int(os.getenv("LLM_STUB_TOKENS", "180"))
+        self.seed = os.getenv("LLM_STUB_SEED", "0")
+
+    def _sample(self, rng: random.Random, mean: float) -> float:
+        if mean <= 0 or self.dist == "fixed" or self.jitter <= 0:
+            return max(0.0, mean)
+        if self.dist == "uniform":
+            return max(0.0, rng.uniform(mean * (1 - self.jitter), mean * (1 + self.jitter)))
+        # lognormal with the given mean and coefficient of variation
+        s2 = math.log(1 + self.jitter ** 2)
+        return rng.lognormvariate(math.log(mean) - s2 / 2, math.sqrt(s2))
+
+    def reply_text(self, rng: random.Random, messages: list) -> str:
+        state = {}
+        for m in messages:
+            found = re.search(r"^State: (\{.*\})$", m.get("content") or "", re.MULTILINE)
+            if found:
+                try:
+                    state = json.loads(found.group(1))
+                except ValueError:
+                    pass
+        phase = current_phase(state) or "stabilize"
+        week = state.get("week_in_phase") or 1
+        lines = [
+            f"**Where you are:** {phase.title()} · week {week}",
+            "",
+            "**This week's objectives**",
+            *[f"- {o}" for o in rng.sample(STUB_OBJECTIVES, 3)],
+            "",
+            "**Do today (90/30/15)**",
+            "- 90 min: the main deliverable, phone off",
+            "- 30 min: one outreach or admin task",
+            "- 15 min: tidy notes and pick tomorrow's first action",
+            "",
+            "**Checklist**",
+        ]
+        pool = STUB_CHECKLIST[:]
+        rng.shuffle(pool)
+        lines += [f"- ☐ {c}" for c in pool]
+        lines += ["", "**Exit criteria to progress**", f"- The {phase} deliverables are drafted and reviewed once"]
+        words = "\n".join(lines).split(" ")
+        while len(words) < self.tokens:
+            words += f"\n- Note: {rng.choice(STUB_OBJECTIVES).lower()}.".split(" ")
+        return " ".join(words[: max(self.tokens, 40)])
+
+    def _steps(self, model, messages, temperature):
+        rng = random.Random(f"{self.seed}:{request_key(model, messages, temperature)}")
+        text = self.reply_text(rng, messages)
+        ttft = self._sample(rng, self.ttft)
+        per_token = 1.0 / max(self._sample(rng, self.rate), 1e-3)
+        words = text.split(" ")
+        steps = []
+        at = ttft
+        for i, w in enumerate(words):
+            steps.append((at, delta_chunk(w if i == 0 else " " + w)))
+            at += per_token
+        prompt_tokens = sum(estimate_tokens(m.get("content") or "") for m in messages)
+        steps.append((at, usage_chunk(prompt_tokens, len(words))))
+        return steps
+
+    def stream(self, model, messages, temperature):
+        return _play(self._steps(model, messages, temperature))
+
+    def stream_async(self, model, messages, temperature):
+        return _play_async(self._steps(model, messages, temperature))
+
+    async def aclose(self):
+        pass
+
+
+# --- record / replay ---
+
+REDACTIONS = [
+    (re.compile(r"[\w.+-]+@[\w-]+(\.[\w-]+)+"), "[email]"),
+    (re.compile(r"\bsk-[A-Za-z0-9_-]{8,}"), "[secret]"),
+    (re.compile(r"\b[A-Z]{2}\d{2}(?: ?[A-Z0-9]{4}){3,7}(?: ?[A-Z0-9]{1,3})?\b"), "[iban]"),
+    (re.compile(r"(?<!\w)\+?\d[\d ()/.-]{7,}\d"), "[number]"),
+]
+
+
+def redact(text: str) -> str:
+    for pattern, repl in REDACTIONS:
+        text = pattern.sub(repl, text)
+    return text
+
+
+class CassetteBackend:
+    """
+    record: pass through to OpenAI and write cassettes; replay: serve cassettes.
+    Cassettes hold the redacted request, each delta with its offset from the
+    start of the call, and the usage. Files are keyed by a hash of the
+    unredacted request, so replaying the same traffic finds them.
+    """
+
+    def __init__(self, mode: str, directory: str = None):
+        self.mode = mode
+        self.name = mode
+        self.directory = directory or os.getenv("LLM_CASSETTE_DIR", "cassettes")
+        self.speed = float(os.getenv("LLM_REPLAY_SPEED", "1"))
+        self.inner = OpenAIBackend() if mode == "record" else None
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    # record
+    def _recorder(self, model, messages, temperature):
+        start = time.perf_counter()
+        tape = {
+            "request": {
+                "model": model,
+                "temperature": temperature,
+                "messages": [{**m, "content": redact(m.get("content") or "")} for m in messages],
+            },
+            "chunks": [],
+            "usage": None,
+        }
+
+        def observe(chunk):
+            for choice in getattr(chunk, "choices", None) or []:
+                delta = getattr(choice.delta, "content", None)
+                if delta:
+                    tape["chunks"].append([round(time.perf_counter() - start, 4), redact(delta)])
+            u = getattr(chunk, "usage", None)
+            if u:
+                tape["usage"] = {"prompt_tokens": u.prompt_tokens, "completion_tokens": u.completion_tokens}
+
+        def save():
+            path = self.path(request_key(model, messages, temperature))
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(tape, f, ensure_ascii=False, indent=1)
+            os.replace(tmp, path)
+
+        return observe, save
+
+    def _record(self, model, messages, temperature):
+        observe, save = self._recorder(model, messages, temperature)
+        for chunk in self.inner.stream(model, messages, temperature):
+            observe(chunk)
+            yield chunk
+        save()
+
+    async def _record_async(self, model, messages, temperature):
+        observe, save = self._recorder(model, messages, temperature)
+        async for chunk in self.inner.stream_async(model, messages, temperature):
+            observe(chunk)
+            yield chunk
+        save()
+
+    # replay
+    def _steps(self, model, messages, temperature):
+        key = request_key(model, messages, temperature)
+        try:
+            with open(self.path(key), "r", encoding="utf-8") as f:
+                tape = json.load(f)
+        except FileNotFoundError:
+            raise LookupError(f"no cassette for this request ({key}) in {self.directory}") from None
+        scale = (1.0 / self.speed) if self.speed > 0 else 0.0
+        steps = [(at * scale, delta_chunk(text)) for at, text in tape["chunks"]]
+        usage = tape.get("usage") or {}
+        last = steps[-1][0] if steps else 0.0
+        steps.append((last, usage_chunk(usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0)))
+        return steps
+
+    def stream(self, model, messages, temperature):
+        if self.mode == "record":
+            return self._record(model, messages, temperature)
+        return _play(self._steps(model, messages, temperature))
+
+    def stream_async(self, model, messages, temperature):
+        if self.mode == "record":
+            return self._record_async(model, messages, temperature)
+        return _play_async(self._steps(model, messages, temperature))
+
+    async def aclose(self):
+        if self.inner:
+            await self.inner.aclose()
+
+
+def make_backend(kind: str = None):
+    kind = (kind or os.getenv("LLM_BACKEND", "openai")).strip().lower()
+    if kind == "openai":
+        return OpenAIBackend()
+    if kind == "stub":
+        return StubBackend()
+    if kind in ("record", "replay"):
+        return CassetteBackend(kind)
+    raise ValueError(f"Unknown LLM_BACKEND '{kind}' (expected openai, stub, record or replay)")
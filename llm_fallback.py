@@ -0,0 +1,420 @@
+"""
+Latency-budgeted model fallback: hedged requests + a circuit breaker.
+
+Every coach call streams from the primary model (MODEL). If no first token
+arrives within LLM_HEDGE_AFTER seconds, or the primary errors before its first
+token, the same request is sent to FALLBACK_MODEL. The first attempt to
+produce a token wins and the other is cancelled; committing on the first
+token is what lets the winner's tokens be streamed straight to the client.
+
+The breaker watches the primary's recent calls. When its error rate or p95
+time-to-first-token crosses the limits it opens and calls go straight to the
+fallback; after LLM_BREAKER_COOLDOWN seconds one probe call is allowed
+through (half-open) and closes the breaker again if it succeeds.
+
+When FALLBACK_MODEL is the same as MODEL there is nothing to fall back to:
+no hedge is sent and the breaker is bypassed, so a slow call is never paid
+for twice.
+
+The losing attempt's stream is closed by the consumer as soon as the winner
+is known. Its tokens are still billed, so the loser is reported as a
+("spent", model, usage) event before "done": the provider's usage when it got
+that far, otherwise the winner's prompt tokens plus an estimate of what the
+loser had streamed.
+
+Settings (environment):
+  LLM_HEDGE_AFTER=4           seconds to wait for the primary's first token
+  LLM_LATENCY_BUDGET=60       overall seconds before the call fails
+  LLM_BREAKER_WINDOW=20       recent primary calls considered
+  LLM_BREAKER_MIN_CALLS=5     calls needed before the breaker may open
+  LLM_BREAKER_ERROR_RATE=0.5
+  LLM_BREAKER_P95_TTFT=10     seconds
+  LLM_BREAKER_COOLDOWN=30     seconds
+"""
+
+import os, time, queue, asyncio, inspect, threading
+from collections import deque
+
+import metrics
+
+HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "4"))
+LATENCY_BUDGET = float(os.getenv("LLM_LATENCY_BUDGET", "60"))
+
+PRIMARY, FALLBACK = 0, 1
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        window: int = int(os.getenv("LLM_BREAKER_WINDOW", "20")),
+        min_calls: int = int(os.getenv("LLM_BREAKER_MIN_CALLS", "5")),
+        error_rate: float = float(os.getenv("LLM_BREAKER_ERROR_RATE", "0.5")),
+        p95_ttft: float = float(os.getenv("LLM_BREAKER_P95_TTFT", "10")),
+        cooldown: float = float(os.getenv("LLM_BREAKER_COOLDOWN", "30")),
+    ):
+        self.min_calls = min_calls
+        self.error_rate_limit = error_rate
+        self.p95_limit = p95_ttft
+        self.cooldown = cooldown
+        self._samples = deque(maxlen=window)  # (ok, ttft_seconds or None)
+        self._state = "closed"
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_primary(self) -> bool:
+        """False while open; lets a single probe through once the cooldown has passed."""
+        with self._lock:
+            if self._state == "closed":
+                return True
+            if self._state == "open" and time.monotonic() - self._opened_at >= self.cooldown:
+                self._state = "half_open"
+            if self._state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record(self, ok: bool, ttft: float = None) -> None:
+        with self._lock:
+            self._samples.append((ok, ttft))
+            if self._state == "half_open":
+                self._probe_in_flight = False
+                if ok:
+                    self._state = "closed"
+                    self._samples.clear()
+                else:
+                    self._open()
+                return
+            if self._state == "closed" and self._should_open():
+                self._open()
+
+    def release_probe(self) -> None:
+        """Free the half-open probe slot when a probe call ended without an outcome."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def _open(self) -> None:
+        self._state = "open"
+        self._opened_at = time.monotonic()
+
+    def _error_rate(self):
+        if not self._samples:
+            return None
+        return sum(1 for ok, _ in self._samples if not ok) / len(self._samples)
+
+    def _p95(self):
+        ttfts = sorted(t for _, t in self._samples if t is not None)
+        if not ttfts:
+            return None
+        return ttfts[min(len(ttfts) - 1, int(round(0.95 * (len(ttfts) - 1))))]
+
+    def _should_open(self) -> bool:
+        if len(self._samples) < self.min_calls:
+            return False
+        p95 = self._p95()
+        return self._error_rate() >= self.error_rate_limit or (p95 is not None and p95 >= self.p95_limit)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            p95 = self._p95()
+            rate = self._error_rate()
+            return {
+                "state": self._state,
+                "calls": len(self._samples),
+                "error_rate": round(rate, 3) if rate is not None else None,
+                "p95_ttft": round(p95, 3) if p95 is not None else None,
+                "limits": {"error_rate": self.error_rate_limit, "p95_ttft": self.p95_limit},
+            }
+
+
+breaker = CircuitBreaker()
+
+
+def _chunk_usage(chunk):
+    u = getattr(chunk, "usage", None)
+    if not u:
+        return None
+    return {
+        "prompt_tokens": u.prompt_tokens,
+        "completion_tokens": u.completion_tokens,
+        "total_tokens": u.total_tokens,
+    }
+
+
+def _chunk_deltas(chunk):
+    for choice in getattr(chunk, "choices", None) or []:
+        delta = getattr(choice.delta, "content", None)
+        if delta:
+            yield delta
+
+
+class _Race:
+    """Bookkeeping shared by the sync and async hedging loops."""
+
+    def __init__(self, primary: str, fallback: str):
+        self.models = {PRIMARY: primary, FALLBACK: fallback}
+        self.start = time.perf_counter()
+        self.started = set()
+        self.failed = {}
+        self.winner = None
+        self.usage = {}   # attempt -> usage reported by the provider
+        self.chars = {PRIMARY: 0, FALLBACK: 0}  # streamed text per attempt, for estimating a loser's cost
+        self.primary_recorded = False
+        # Hedging to the same model would only double the bill
+        self.can_hedge = bool(fallback) and fallback != primary
+        # Breaker open: skip the primary entirely
+        self.first = PRIMARY if not self.can_hedge or breaker.allow_primary() else FALLBACK
+        if self.first == FALLBACK:
+            metrics.LLM_HEDGES.labels("breaker").inc()
+
+    @property
+    def hedged(self) -> bool:
+        return FALLBACK in self.started
+
+    def wait_timeout(self) -> float:
+        now = time.perf_counter()
+        if self.winner is None and not self.hedged and self.can_hedge:
+            return max(0.0, self.start + HEDGE_AFTER - now)
+        return max(0.0, self.start + LATENCY_BUDGET - now)
+
+    def record_primary(self, ok: bool, ttft: float = None) -> None:
+        if PRIMARY in self.started and not self.primary_recorded and self.can_hedge:
+            self.primary_recorded = True
+            breaker.record(ok, ttft)
+
+    def on_first(self, attempt: int, ttft: float) -> None:
+        self.winner = attempt
+        if attempt == PRIMARY:
+            self.record_primary(True, ttft)
+        else:
+            # Primary lost the race: count it as a slow sample
+            self.record_primary(True, time.perf_counter() - self.start)
+
+    def on_error(self, attempt: int, exc: Exception) -> bool:
+        """Record a failed attempt; True if the fallback should be launched now."""
+        self.failed[attempt] = exc
+        if attempt == PRIMARY:
+            self.record_primary(False)
+        if attempt == PRIMARY and not self.hedged and self.can_hedge:
+            metrics.LLM_HEDGES.labels("error").inc()
+            return True
+        return False
+
+    def all_failed(self) -> bool:
+        return self.started and set(self.failed) >= self.started
+
+    def spent(self) -> list:
+        """[(model, usage)] for attempts that lost the race but were billed (errors are not)."""
+        winner_usage = self.usage.get(self.winner) or {}
+        out = []
+        for attempt in sorted(self.started):
+            if attempt == self.winner or attempt in self.failed:
+                continue
+            usage = self.usage.get(attempt)
+            if usage is None:
+                prompt = winner_usage.get("prompt_tokens") or 0
+                # ~4 characters per token, as in prompt_compiler.estimate_tokens
+                completion = (self.chars[attempt] + 3) // 4
+                usage = {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+            if usage.get("total_tokens"):
+                out.append((self.models[attempt], usage))
+        return out
+
+    def finish(self) -> None:
+        if PRIMARY in self.started and not self.primary_recorded and self.can_hedge:
+            breaker.release_probe()
+
+    def on_timeout(self) -> bool:
+        """True if the fallback should be launched (hedge); False if the budget is spent."""
+        if self.winner is None and not self.hedged and self.can_hedge:
+            metrics.LLM_HEDGES.labels("slow").inc()
+            return True
+        self.record_primary(False)
+        return False
+
+
+def hedged_stream(open_stream, primary: str, fallback: str):
+    """
+    open_stream(model) returns an OpenAI chat completion stream.
+    Yields ("delta", text) items, then ("spent", model, usage) for a billed
+    loser, then ("done", model, usage) from whichever model won. Raises the last error if every attempt failed, or TimeoutError
+    when LLM_LATENCY_BUDGET runs out.
+    """
+    race = _Race(primary, fallback)
+    events = queue.Queue()
+    cancel = {PRIMARY: threading.Event(), FALLBACK: threading.Event()}
+    streams = {}
+
+    def close(attempt):
+        stream = streams.pop(attempt, None)
+        if stream is not None:
+            try:
+                getattr(stream, "close", lambda: None)()
+            except Exception:
+                pass
+
+    def stop(attempt):
+        # Closing from here ends a stalled read at once instead of at the next chunk
+        cancel[attempt].set()
+        close(attempt)
+
+    def run(attempt):
+        start = time.perf_counter()
+        first = True
+        try:
+            stream = open_stream(race.models[attempt])
+            streams[attempt] = stream
+            if cancel[attempt].is_set():
+                close(attempt)
+                return
+            for chunk in stream:
+                if cancel[attempt].is_set():
+                    close(attempt)
+                    return
+                usage = _chunk_usage(chunk)
+                if usage:
+                    events.put(("usage", attempt, usage))
+                for delta in _chunk_deltas(chunk):
+                    if first:
+                        events.put(("first", attempt, time.perf_counter() - start))
+                        first = False
+                    events.put(("delta", attempt, delta))
+            events.put(("end", attempt, None))
+        except Exception as e:
+            events.put(("error", attempt, e))
+
+    def launch(attempt):
+        race.started.add(attempt)
+        threading.Thread(target=run, args=(attempt,), daemon=True).start()
+
+    launch(race.first)
+    try:
+        while True:
+            try:
+                kind, attempt, payload = events.get(timeout=race.wait_timeout())
+            except queue.Empty:
+                if race.on_timeout():
+                    launch(FALLBACK)
+                    continue
+                raise TimeoutError(f"LLM latency budget of {LATENCY_BUDGET:.0f}s exceeded")
+
+            if kind == "usage":
+                race.usage[attempt] = payload
+            elif kind == "delta":
+                race.chars[attempt] += len(payload)
+            if race.winner is not None and attempt != race.winner:
+                continue  # leftovers from the cancelled attempt
+            if kind == "first":
+                race.on_first(attempt, payload)
+                for other in cancel:
+                    if other != attempt:
+                        stop(other)
+            elif kind == "delta":
+                yield ("delta", payload)
+            elif kind == "end":
+                if race.winner is None:
+                    race.on_first(attempt, time.perf_counter() - race.start)
+                for spent in race.spent():
+                    yield ("spent", *spent)
+                yield ("done", race.models[attempt], race.usage.get(attempt))
+                return
+            elif kind == "error":
+                if race.winner == attempt:
+                    raise payload
+                if race.on_error(attempt, payload):
+                    launch(FALLBACK)
+                elif race.all_failed():
+                    raise payload
+    finally:
+        race.finish()
+        for attempt in cancel:
+            stop(attempt)
+
+
+async def _aclose(stream) -> None:
+    close = getattr(stream, "close", None) or getattr(stream, "aclose", None)
+    if close is None:
+        return
+    try:
+        result = close()
+        if inspect.isawaitable(result):
+            await result
+    except Exception:
+        pass
+
+
+async def hedged_stream_async(open_stream, primary: str, fallback: str):
+    """Async twin of hedged_stream; open_stream(model) is a coroutine returning an AsyncStream."""
+    race = _Race(primary, fallback)
+    events = asyncio.Queue()
+    tasks = {}
+
+    async def run(attempt):
+        start = time.perf_counter()
+        first = True
+        stream = None
+        try:
+            stream = await open_stream(race.models[attempt])
+            async for chunk in stream:
+                usage = _chunk_usage(chunk)
+                if usage:
+                    events.put_nowait(("usage", attempt, usage))
+                for delta in _chunk_deltas(chunk):
+                    if first:
+                        events.put_nowait(("first", attempt, time.perf_counter() - start))
+                        first = False
+                    events.put_nowait(("delta", attempt, delta))
+            events.put_nowait(("end", attempt, None))
+        except asyncio.CancelledError:
+            # Release the connection now rather than when the stream is collected
+            await _aclose(stream)
+            raise
+        except Exception as e:
+            events.put_nowait(("error", attempt, e))
+
+    def launch(attempt):
+        race.started.add(attempt)
+        tasks[attempt] = asyncio.ensure_future(run(attempt))
+
+    launch(race.first)
+    try:
+        while True:
+            try:
+                kind, attempt, payload = await asyncio.wait_for(events.get(), timeout=race.wait_timeout())
+            except asyncio.TimeoutError:
+                if race.on_timeout():
+                    launch(FALLBACK)
+                    continue
+                raise TimeoutError(f"LLM latency budget of {LATENCY_BUDGET:.0f}s exceeded")
+
+            if kind == "usage":
+                race.usage[attempt] = payload
+            elif kind == "delta":
+                race.chars[attempt] += len(payload)
+            if race.winner is not None and attempt != race.winner:
+                continue
+            if kind == "first":
+                race.on_first(attempt, payload)
+                for other, task in tasks.items():
+                    if other != attempt:
+                        task.cancel()
+            elif kind == "delta":
+                yield ("delta", payload)
+            elif kind == "end":
+                if race.winner is None:
+                    race.on_first(attempt, time.perf_counter() - race.start)
+                for spent in race.spent():
+                    yield ("spent", *spent)
+                yield ("done", race.models[attempt], race.usage.get(attempt))
+                return
+            elif kind == "error":
+                if race.winner == attempt:
+                    raise payload
+                if race.on_error(attempt, payload):
+                    launch(FALLBACK)
+                elif race.all_failed():
+                    raise payload
+    finally:
+        race.finish()
+        for task in tasks.values():
+            task.cancel()
@@ -0,0 +1,232 @@
+"""
+Per-caller limits for the LLM endpoints (/plan, /standup, /gate, /triage, /chat).
+
+A caller is "user:<id>" when logged in, otherwise "ip:<address>". A request
+is admitted only if the caller has fewer than LLM_MAX_INFLIGHT_* calls in
+flight and has used fewer than LLM_DAILY_TOKENS_* tokens in the last 24
+hours; otherwise QuotaExceeded is raised and the endpoint answers 429 with
+Retry-After. The admission check touches only the counters below, never the
+database.
+
+Tokens are counted in hourly buckets (a rolling 24-hour window) from the
+usage the model reports. Every call is also written to the llm_usage ledger
+(db.add_llm_usage) for reporting; see db.top_llm_consumers and
+GET /admin/llm_usage.
+
+Settings (environment):
+  LLM_QUOTA_BACKEND=memory|redis|off   (default: redis if RATELIMIT_STORAGE_URI is redis, else memory)
+  LLM_QUOTA_URL=redis://...            (default: RATELIMIT_STORAGE_URI)
+  LLM_MAX_INFLIGHT_USER=2              concurrent LLM calls per logged-in user (0 = unlimited)
+  LLM_MAX_INFLIGHT_ANON=1              ... per anonymous IP
+  LLM_DAILY_TOKENS_USER=200000         rolling 24h token budget per user (0 = unlimited)
+  LLM_DAILY_TOKENS_ANON=20000          ... per anonymous IP
+
+The memory backend is per process: with several workers and no Redis each
+worker enforces the limits on its own. If Redis fails, calls are admitted.
+"""
+
+import os, math, time, threading
+
+from reply_cache import default_redis_url, default_backend_kind
+
+WINDOW_HOURS = 24
+INFLIGHT_RETRY_AFTER = 2  # seconds; a coach call usually finishes within a few
+# A worker that dies mid-call leaks its Redis slot until this expires
+INFLIGHT_TTL = int(float(os.getenv("LLM_LATENCY_BUDGET", "60"))) + 60
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"LLM quota exceeded ({reason})")
+        self.reason = reason  # 'concurrency' or 'tokens'
+        self.retry_after = max(1, int(retry_after))
+
+
+def subject_for(user_id=None, remote_addr=None) -> str:
+    return f"user:{user_id}" if user_id else f"ip:{remote_addr or 'unknown'}"
+
+
+def current_hour(now: float = None) -> int:
+    return int((now if now is not None else time.time()) // 3600)
+
+
+def retry_after_tokens(buckets: dict, budget: int, now: float = None) -> int:
+    """Seconds until enough of the oldest hourly buckets leave the window to bring usage under budget."""
+    now = now if now is not None else time.time()
+    excess = sum(buckets.values()) - budget + 1
+    dropped = 0
+    for hour in sorted(buckets):
+        dropped += buckets[hour]
+        if dropped >= excess:
+            return math.ceil((hour + WINDOW_HOURS) * 3600 - now)
+    return WINDOW_HOURS * 3600
+
+
+class MemoryCounters:
+    name = "memory"
+
+    def __init__(self):
+        self._inflight = {}  # subject -> calls in flight
+        self._tokens = {}    # subject -> {hour: tokens}
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def acquire(self, subject: str, cap: int) -> bool:
+        with self._lock:
+            n = self._inflight.get(subject, 0)
+            if n >= cap:
+                return False
+            self._inflight[subject] = n + 1
+            return True
+
+    def release(self, subject: str) -> None:
+        with self._lock:
+            n = self._inflight.get(subject, 0) - 1
+            if n > 0:
+                self._inflight[subject] = n
+            else:
+                self._inflight.pop(subject, None)
+
+    def _prune(self, subject: str, hour: int) -> dict:
+        buckets = {h: t for h, t in self._tokens.get(subject, {}).items() if h > hour - WINDOW_HOURS}
+        if buckets:
+            self._tokens[subject] = buckets
+        else:
+            self._tokens.pop(subject, None)
+        return buckets
+
+    def add_tokens(self, subject: str, hour: int, tokens: int) -> None:
+        with self._lock:
+            buckets = self._tokens.setdefault(subject, {})
+            buckets[hour] = buckets.get(hour, 0) + tokens
+            self._writes += 1
+            if self._writes % 1000 == 0:
+                # Forget callers that have been idle for a whole window
+                for s in list(self._tokens):
+                    self._prune(s, hour)
+
+    def window(self, subject: str, hour: int) -> dict:
+        with self._lock:
+            return dict(self._prune(subject, hour))
+
+
+class RedisCounters:
+    name = "redis"
+
+    def __init__(self, url: str, prefix: str = "nc:llmq:"):
+        import redis
+        self.r = redis.Redis.from_url(url)
+        self.r.ping()
+        self.prefix = prefix
+
+    def acquire(self, subject: str, cap: int) -> bool:
+        key = f"{self.prefix}inflight:{subject}"
+        pipe = self.r.pipeline()
+        pipe.incr(key)
+        pipe.expire(key, INFLIGHT_TTL)
+        n = pipe.execute()[0]
+        if n > cap:
+            self.r.decr(key)
+            return False
+        return True
+
+    def release(self, subject: str) -> None:
+        key = f"{self.prefix}inflight:{subject}"
+        if self.r.decr(key) <= 0:
+            self.r.delete(key)
+
+    def add_tokens(self, subject: str, hour: int, tokens: int) -> None:
+        key = f"{self.prefix}tokens:{subject}:{hour}"
+        pipe = self.r.pipeline()
+        pipe.incrby(key, tokens)
+        pipe.expire(key, (WINDOW_HOURS + 1) * 3600)
+        pipe.execute()
+
+    def window(self, subject: str, hour: int) -> dict:
+        hours = list(range(hour - WINDOW_HOURS + 1, hour + 1))
+        values = self.r.mget([f"{self.prefix}tokens:{subject}:{h}" for h in hours])
+        return {h: int(v) for h, v in zip(hours, values) if v}
+
+
+class Lease:
+    """One admitted LLM request: release() frees its in-flight slot, charge() counts its tokens."""
+
+    def __init__(self, quota: "LLMQuota", subject: str, user_id=None, holds_slot: bool = True):
+        self.quota = quota
+        self.subject = subject
+        self.user_id = user_id
+        self._holds_slot = holds_slot
+
+    def release(self) -> None:
+        if self._holds_slot:
+            self._holds_slot = False
+            self.quota._release(self.subject)
+
+    def charge(self, tokens: int) -> None:
+        self.quota._charge(self.subject, tokens)
+
+
+class LLMQuota:
+    def __init__(self, counters, max_inflight_user=2, max_inflight_anon=1, daily_tokens_user=200000, daily_tokens_anon=20000):
+        self.counters = counters
+        self.max_inflight = {"user": max_inflight_user, "ip": max_inflight_anon}
+        self.daily_tokens = {"user": daily_tokens_user, "ip": daily_tokens_anon}
+
+    def admit(self, user_id=None, remote_addr=None) -> Lease:
+        """Lease for one LLM request, or QuotaExceeded. Call lease.release() when the request ends."""
+        subject = subject_for(user_id, remote_addr)
+        if self.counters is None:
+            return Lease(self, subject, user_id, holds_slot=False)
+        tier = subject.split(":", 1)[0]
+        budget = self.daily_tokens[tier]
+        try:
+            if budget > 0:
+                now = time.time()
+                buckets = self.counters.window(subject, current_hour(now))
+                if sum(buckets.values()) >= budget:
+                    raise QuotaExceeded("tokens", retry_after_tokens(buckets, budget, now))
+            cap = self.max_inflight[tier]
+            if cap <= 0:
+                return Lease(self, subject, user_id, holds_slot=False)
+            if not self.counters.acquire(subject, cap):
+                raise QuotaExceeded("concurrency", INFLIGHT_RETRY_AFTER)
+        except QuotaExceeded:
+            raise
+        except Exception as e:
+            print(f"[llm_quota] admit failed, allowing: {e}")
+            return Lease(self, subject, user_id, holds_slot=False)
+        return Lease(self, subject, user_id)
+
+    def _release(self, subject: str) -> None:
+        try:
+            self.counters.release(subject)
+        except Exception as e:
+            print(f"[llm_quota] release failed: {e}")
+
+    def _charge(self, subject: str, tokens: int) -> None:
+        if self.counters is None or not tokens:
+            return
+        try:
+            self.counters.add_tokens(subject, current_hour(), int(tokens))
+        except Exception as e:
+            print(f"[llm_quota] charge failed: {e}")
+
+
+def init_llm_quota() -> LLMQuota:
+    url = default_redis_url("LLM_QUOTA_URL")
+    kind = os.getenv("LLM_QUOTA_BACKEND", default_backend_kind(url)).strip().lower()
+    counters = None
+    if kind == "redis":
+        try:
+            counters = RedisCounters(url)
+        except Exception as e:
+            print(f"[llm_quota] Redis at '{url}' unavailable ({e}); falling back to memory")
+    if kind != "off" and counters is None:
+        counters = MemoryCounters()
+    return LLMQuota(
+        counters,
+        max_inflight_user=int(os.getenv("LLM_MAX_INFLIGHT_USER", "2")),
+        max_inflight_anon=int(os.getenv("LLM_MAX_INFLIGHT_ANON", "1")),
+        daily_tokens_user=int(os.getenv("LLM_DAILY_TOKENS_USER", "200000")),
+        daily_tokens_anon=int(os.getenv("LLM_DAILY_TOKENS_ANON", "20000")),
+    )
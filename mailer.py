@@ -1,6 +1,8 @@
 """
 SMTP mail helper using SendGrid's SMTP relay.
 Reads all settings from environment variables so no secrets are committed.
+They are read when a message is built or a session opened, so importing this
+module (e.g. from app.py) works without them.
 Required env vars:
   SMTP_HOST=smtp.sendgrid.net
   SMTP_PORT=587
@@ -8,42 +10,105 @@ Required env vars:
   SMTP_PASS=<SENDGRID_API_KEY> # set only in .env / Render, never in code
   EMAIL_FROM=support@coro.biz
   EMAIL_REPLY_TO=support@coro.biz  (optional; defaults to EMAIL_FROM)
+  SMTP_STARTTLS=1              (optional; 0 for plain local sinks such as bench/smtp_sink.py)
 """
 
-import os, smtplib, ssl
+import os, smtplib, ssl, time
 from email.message import EmailMessage
 from urllib.parse import urlencode
 
-SMTP_HOST = os.environ["SMTP_HOST"]
-SMTP_PORT = int(os.environ.get("SMTP_PORT", 587))
-SMTP_USER = os.environ["SMTP_USER"]
-SMTP_PASS = os.environ["SMTP_PASS"]
-EMAIL_FROM = os.environ["EMAIL_FROM"]
-EMAIL_REPLY_TO = os.environ.get("EMAIL_REPLY_TO", EMAIL_FROM)
+import metrics
 
-def send_mail(to_addr: str, subject: str, text: str, html: str | None = None):
-    """Send a plain-text (and optional HTML) email via SMTP+STARTTLS."""
+
+def _require(name: str) -> str:
+    value = os.getenv(name)
+    if not value:
+        raise RuntimeError(f"{name} is not set; it is needed to send mail (see mailer.py)")
+    return value
+
+
+def build_message(to_addr: str, subject: str, text: str, html: str | None = None) -> EmailMessage:
     msg = EmailMessage()
-    msg["From"] = EMAIL_FROM
+    msg["From"] = _require("EMAIL_FROM")
     msg["To"] = to_addr
     msg["Subject"] = subject
-    msg["Reply-To"] = EMAIL_REPLY_TO
+    msg["Reply-To"] = os.getenv("EMAIL_REPLY_TO") or msg["From"]
     msg.set_content(text)
     if html:
         msg.add_alternative(html, subtype="html")
+    return msg
+
+
+class SMTPConnection:
+    """
+    A reusable SMTP+STARTTLS session. The handshake (connect, STARTTLS, login)
+    runs once and is reused for many messages; the session is reopened after
+    max_messages sends or when the relay drops it.
+    """
 
-    ctx = ssl.create_default_context()
-    with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as s:
+    def __init__(self, max_messages: int = 100, timeout: float = 30):
+        self.max_messages = max_messages
+        self.timeout = timeout
+        self._smtp = None
+        self._sent = 0
+
+    def _connect(self):
+        self.close()
+        ctx = ssl.create_default_context()
+        s = smtplib.SMTP(_require("SMTP_HOST"), int(os.getenv("SMTP_PORT", "587")), timeout=self.timeout)
         s.ehlo()
-        s.starttls(context=ctx)
-        s.login(SMTP_USER, SMTP_PASS)
-        s.send_message(msg)
+        if os.getenv("SMTP_STARTTLS", "1") != "0":
+            s.starttls(context=ctx)
+        s.login(_require("SMTP_USER"), _require("SMTP_PASS"))
+        self._smtp = s
+        self._sent = 0
 
+    def send(self, msg: EmailMessage) -> None:
+        start = time.perf_counter()
+        try:
+            if self._smtp is None or self._sent >= self.max_messages:
+                self._connect()
+            try:
+                self._smtp.send_message(msg)
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                # Idle relays close long-lived sessions; reconnect once and retry
+                self._connect()
+                self._smtp.send_message(msg)
+        except Exception:
+            metrics.SMTP_ERRORS.inc()
+            raise
+        metrics.SMTP_LATENCY.observe(time.perf_counter() - start)
+        self._sent += 1
 
-def send_password_reset_email(to_addr: str, token: str):
+    def close(self) -> None:
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def send_mail(to_addr: str, subject: str, text: str, html: str | None = None, conn: SMTPConnection | None = None):
+    """Send a plain-text (and optional HTML) email via SMTP+STARTTLS, reusing conn if given."""
+    msg = build_message(to_addr, subject, text, html)
+    if conn is not None:
+        conn.send(msg)
+        return
+    with SMTPConnection(max_messages=1) as c:
+        c.send(msg)
+
+
+def password_reset_email(token: str) -> dict:
     """
-    Compose and send a password reset email.
-    Uses APP_BASE_URL or falls back to request.host_url provided by caller.
+    Compose a password reset email as {subject, text, html}.
+    Uses APP_BASE_URL (defaults to https://nextchapter.onrender.com).
     """
     base_url = os.getenv("APP_BASE_URL", "https://nextchapter.onrender.com")
     reset_path = "/reset"
@@ -55,14 +120,12 @@ def send_password_reset_email(to_addr: str, token: str):
         f"""<p>Click this link to reset your password:</p>
                <p><a href=\"{reset_url}\">{reset_url}</a></p>"""
     )
-
-    # reuse existing helper
-    send_mail(to_addr, subject, text, html)
+    return {"subject": subject, "text": text, "html": html}
 
 
-def send_verification_email(to_addr: str, token: str):
+def verification_email(token: str) -> dict:
     """
-    Compose and send an email verification message.
+    Compose an email verification message as {subject, text, html}.
     Builds a link using APP_BASE_URL (defaults to https://nextchapter.onrender.com).
     """
     base_url = os.getenv("APP_BASE_URL", "https://nextchapter.onrender.com")
@@ -73,5 +136,25 @@ def send_verification_email(to_addr: str, token: str):
     text = f"Please confirm your email by clicking: {verify_url}"
     html = f"""<p>Please confirm your email by clicking the link below:</p>
                <p><a href=\"{verify_url}\">{verify_url}</a></p>"""
+    return {"subject": subject, "text": text, "html": html}
+
 
-    send_mail(to_addr, subject, text, html)
+def weekly_digest_email(phase: str, week_label: str, plan_md: str) -> dict:
+    """
+    Compose the weekly plan digest as {subject, text}; the plan markdown is sent as plain text.
+    Links back to APP_BASE_URL (defaults to https://nextchapter.onrender.com).
+    """
+    base_url = os.getenv("APP_BASE_URL", "https://nextchapter.onrender.com")
+    subject = f"Your {phase.title()} plan for {week_label}" if phase else f"Your plan for {week_label}"
+    text = f"{plan_md.strip()}\n\n--\nOpen your coach: {base_url.rstrip('/')}/\n"
+    return {"subject": subject, "text": text}
+
+
+def send_password_reset_email(to_addr: str, token: str):
+    """Compose and send a password reset email immediately (dev helpers; requests use the outbox)."""
+    send_mail(to_addr, **password_reset_email(token))
+
+
+def send_verification_email(to_addr: str, token: str):
+    """Compose and send an email verification message immediately (dev helpers; requests use the outbox)."""
+    send_mail(to_addr, **verification_email(token))
@@ -0,0 +1,143 @@
+"""
+Prometheus metrics.
+
+Collected:
+  http_request_duration_seconds{method,route,status}   every Flask route
+  llm_request_duration_seconds{kind,model}             OpenAI round-trips (to last token when streaming)
+  llm_tokens_total{kind,model,type}                    prompt/completion tokens from comp.usage
+  llm_errors_total{kind,model}
+  llm_hedges_total{reason}                             fallback launches: slow, error or breaker
+  llm_quota_rejections_total{reason}                   429s from llm_quota: concurrency or tokens
+  db_pool_checkout_wait_seconds                        time spent waiting for a pooled connection
+  db_pool_connections_in_use
+  bcrypt_duration_seconds{op}                          hash / check, including pool hand-off
+  smtp_send_duration_seconds, smtp_errors_total
+  ratelimit_rejections_total{route}                    requests refused by flask-limiter
+
+Multi-process gunicorn: set PROMETHEUS_MULTIPROC_DIR to an empty, writable
+directory before the workers start (gunicorn.conf.py clears dead workers'
+files). /metrics then aggregates across all workers.
+
+GET /metrics requires "Authorization: Bearer $METRICS_TOKEN" and answers 404
+when METRICS_TOKEN is unset, so it is never public by accident.
+"""
+
+import os, time, secrets
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    REGISTRY,
+)
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40)
+
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "Flask request latency",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS,
+)
+LLM_LATENCY = Histogram(
+    "llm_request_duration_seconds", "OpenAI chat completion latency",
+    ["kind", "model"], buckets=LATENCY_BUCKETS,
+)
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens reported by the model", ["kind", "model", "type"])
+LLM_ERRORS = Counter("llm_errors_total", "Failed OpenAI calls", ["kind", "model"])
+LLM_HEDGES = Counter("llm_hedges_total", "Requests sent to FALLBACK_MODEL", ["reason"])
+LLM_QUOTA_REJECTIONS = Counter("llm_quota_rejections_total", "LLM requests refused by llm_quota", ["reason"])
+POOL_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Wait for a pooled DB connection",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5, 30),
+)
+POOL_IN_USE = Gauge(
+    "db_pool_connections_in_use", "Checked-out DB connections", multiprocess_mode="livesum",
+)
+BCRYPT_LATENCY = Histogram(
+    "bcrypt_duration_seconds", "bcrypt hash/check time", ["op"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+SMTP_LATENCY = Histogram("smtp_send_duration_seconds", "SMTP send time per message", buckets=LATENCY_BUCKETS)
+SMTP_ERRORS = Counter("smtp_errors_total", "Failed SMTP sends")
+RATELIMIT_REJECTIONS = Counter("ratelimit_rejections_total", "Requests refused by the rate limiter", ["route"])
+
+
+def record_llm_usage(kind: str, model: str, usage) -> None:
+    """usage is comp.usage (object) or a {prompt_tokens, completion_tokens} dict."""
+    if not usage:
+        return
+    get = usage.get if isinstance(usage, dict) else lambda k: getattr(usage, k, None)
+    prompt, completion = get("prompt_tokens"), get("completion_tokens")
+    if prompt:
+        LLM_TOKENS.labels(kind, model, "prompt").inc(prompt)
+    if completion:
+        LLM_TOKENS.labels(kind, model, "completion").inc(completion)
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long checkouts wait for a free connection."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_WAIT.observe(time.perf_counter() - start)
+
+
+def instrument_engine(engine) -> None:
+    """Track in-use connections; pair with create_engine(..., poolclass=TimedQueuePool) for wait times."""
+    @event.listens_for(engine, "checkout")
+    def _on_checkout(dbapi_conn, conn_record, conn_proxy):
+        POOL_IN_USE.inc()
+
+    @event.listens_for(engine, "checkin")
+    def _on_checkin(dbapi_conn, conn_record):
+        POOL_IN_USE.dec()
+
+
+def on_ratelimit_breach(request_limit):
+    """flask-limiter on_breach callback; returning None keeps the default 429 response."""
+    from flask import request
+    RATELIMIT_REJECTIONS.labels(request.url_rule.rule if request.url_rule else "<unmatched>").inc()
+    return None
+
+
+def _registry():
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def init_app(app) -> None:
+    """Time every request and register GET /metrics."""
+    from flask import Response, g, request
+
+    @app.before_request
+    def _metrics_start():
+        g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _metrics_observe(resp):
+        start = g.pop("_metrics_start", None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule else "<unmatched>"
+            HTTP_LATENCY.labels(request.method, route, str(resp.status_code)).observe(time.perf_counter() - start)
+        return resp
+
+    @app.get("/metrics")
+    def metrics_view():
+        expected = os.getenv("METRICS_TOKEN")
+        if not expected:
+            return "Not found", 404
+        header = request.headers.get("Authorization") or ""
+        if not secrets.compare_digest(header, f"Bearer {expected}"):
+            return "Unauthorized", 401
+        return Response(generate_latest(_registry()), mimetype=CONTENT_TYPE_LATEST)
@@ -0,0 +1,446 @@
+"""
+Versioned schema migrations.
+
+Each migration is a numbered function that runs in its own transaction and
+records its number in schema_version. migrate(engine) is cheap when the schema
+is current: one read of schema_version and no DDL. When migrations are
+pending, a Postgres advisory lock makes sure only one process applies them
+while the others wait and then take the fast path.
+
+CLI (run before or outside web startup):
+  python migrations.py            # apply pending migrations
+  python migrations.py --status   # print current and latest version
+
+To add a migration, append a function to MIGRATIONS with the next number.
+Never edit a migration that has shipped.
+"""
+
+import os, argparse
+from sqlalchemy import create_engine, text
+
+# Arbitrary constant identifying the migration lock in pg_advisory_lock
+ADVISORY_LOCK_KEY = 727274001
+
+
+def _m0001_base_tables(conn):
+    conn.execute(text(
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            email TEXT UNIQUE NOT NULL,
+            password_hash TEXT,
+            is_verified BOOLEAN NOT NULL DEFAULT FALSE,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            phase TEXT NOT NULL DEFAULT 'explore'
+        );
+        """
+    ))
+    conn.execute(text(
+        """
+        CREATE TABLE IF NOT EXISTS email_tokens (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            token_hash TEXT NOT NULL,
+            type TEXT NOT NULL CHECK (type IN ('reset','verify')),
+            purpose TEXT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            expires_at TIMESTAMPTZ NOT NULL,
+            used BOOLEAN NOT NULL DEFAULT FALSE,
+            used_at TIMESTAMPTZ NULL
+        );
+        """
+    ))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_email_tokens_hash ON email_tokens(token_hash);"))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS idx_email_tokens_user_type_used ON email_tokens(user_id, type, used);"
+    ))
+
+
+def _m0002_email_tokens_legacy_cleanup(conn):
+    """Bring email_tokens tables created by early versions in line with 0001."""
+    # Legacy column from early versions
+    conn.execute(text("ALTER TABLE email_tokens DROP COLUMN IF EXISTS token;"))
+    conn.execute(text("ALTER TABLE email_tokens ADD COLUMN IF NOT EXISTS used_at TIMESTAMPTZ NULL;"))
+    conn.execute(text("ALTER TABLE email_tokens ADD COLUMN IF NOT EXISTS purpose TEXT NULL;"))
+    # Clean bad rows so NOT NULL succeeds
+    conn.execute(text("DELETE FROM email_tokens WHERE token_hash IS NULL;"))
+    conn.execute(text("ALTER TABLE email_tokens ALTER COLUMN token_hash SET NOT NULL;"))
+
+
+def _m0003_email_outbox(conn):
+    conn.execute(text(
+        """
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id SERIAL PRIMARY KEY,
+            to_addr TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body_text TEXT NOT NULL,
+            body_html TEXT NULL,
+            status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending','sent','failed')),
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            sent_at TIMESTAMPTZ NULL
+        );
+        """
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS idx_email_outbox_status_next ON email_outbox(status, next_attempt_at);"
+    ))
+
+
+def _m0004_email_tokens_janitor_indexes(conn):
+    """Lookups only ever want live tokens; the janitor scans by expiry / use time."""
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS idx_email_tokens_live_hash ON email_tokens(token_hash) WHERE NOT used;"
+    ))
+    conn.execute(text("DROP INDEX IF EXISTS idx_email_tokens_hash;"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_email_tokens_expires ON email_tokens(expires_at);"))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS idx_email_tokens_used_at ON email_tokens(used_at) WHERE used;"
+    ))
+
+
+def _m0005_conversations(conn):
+    conn.execute(text(
+        """
+        CREATE TABLE IF NOT EXISTS conversations (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            summary TEXT NOT NULL DEFAULT '',
+            summarized_through INTEGER NOT NULL DEFAULT 0,
+            context_md TEXT NOT NULL DEFAULT '',
+            context_kind TEXT NOT NULL DEFAULT '',
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """
+    ))
+    conn.execute(text(
+        """
+        CREATE TABLE IF NOT EXISTS conversation_messages (
+            id SERIAL PRIMARY KEY,
+            conversation_id INTEGER NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+            role TEXT NOT NULL CHECK (role IN ('user','assistant')),
+            content TEXT NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS idx_conversations_user_updated ON conversations(user_id, updated_at);"
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS idx_conversation_messages_conv_id "
+        "ON conversation_messages(conversation_id, id);"
+    ))
+
+
+def _m0006_llm_usage(conn):
+    conn.execute(text(
+        """
+        CREATE TABLE IF NOT EXISTS llm_usage (
+            id BIGSERIAL PRIMARY KEY,
+            subject TEXT NOT NULL,
+            user_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+            kind TEXT NOT NULL,
+            model TEXT NOT NULL,
+            prompt_tokens INTEGER NOT NULL DEFAULT 0,
+            completion_tokens INTEGER NOT NULL DEFAULT 0,
+            total_tokens INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """
+    ))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_llm_usage_created ON llm_usage(created_at);"))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS idx_llm_usage_subject_created ON llm_usage(subject, created_at);"
+    ))
+
+
+def _m0007_journey_states(conn):
+    conn.execute(text(
+        """
+        CREATE TABLE IF NOT EXISTS journey_states (
+            user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+            state JSONB NOT NULL DEFAULT '{}'::jsonb,
+            version INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """
+    ))
+    # Seed from users.phase so existing users keep their phase
+    conn.execute(text(
+        """
+        INSERT INTO journey_states (user_id, state, version)
+        SELECT id, jsonb_build_object('current_phase', phase), 1 FROM users
+        ON CONFLICT (user_id) DO NOTHING;
+        """
+    ))
+
+
+def _m0008_kpi_events(conn):
+    conn.execute(text(
+        """
+        CREATE TABLE IF NOT EXISTS kpi_events (
+            id BIGSERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            metric TEXT NOT NULL,
+            value DOUBLE PRECISION NOT NULL,
+            occurred_at TIMESTAMPTZ NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS idx_kpi_events_user_occurred ON kpi_events(user_id, occurred_at);"
+    ))
+    # Primary key order serves "this user's last N weeks" as one index range scan
+    conn.execute(text(
+        """
+        CREATE TABLE IF NOT EXISTS kpi_weekly (
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            week_start DATE NOT NULL,
+            metric TEXT NOT NULL,
+            events INTEGER NOT NULL DEFAULT 0,
+            total DOUBLE PRECISION NOT NULL DEFAULT 0,
+            min_value DOUBLE PRECISION NULL,
+            max_value DOUBLE PRECISION NULL,
+            last_value DOUBLE PRECISION NULL,
+            last_at TIMESTAMPTZ NULL,
+            PRIMARY KEY (user_id, week_start, metric)
+        );
+        """
+    ))
+
+def _m0009_applications(conn):
+    conn.execute(text(
+        """
+        CREATE TABLE IF NOT EXISTS applications (
+            id BIGSERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            company TEXT NOT NULL,
+            role TEXT NOT NULL DEFAULT '',
+            url TEXT NOT NULL DEFAULT '',
+            source TEXT NOT NULL DEFAULT '',
+            contact TEXT NOT NULL DEFAULT '',
+            location TEXT NOT NULL DEFAULT '',
+            notes TEXT NOT NULL DEFAULT '',
+            status TEXT NOT NULL DEFAULT 'lead',
+            next_follow_up DATE NULL,
+            dedupe_key TEXT NOT NULL,
+            status_changed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            CONSTRAINT uq_applications_user_dedupe UNIQUE (user_id, dedupe_key),
+            CONSTRAINT ck_applications_status CHECK (status IN
+                ('lead','contacted','applied','screening','interviewing','offer','accepted','rejected','withdrawn'))
+        );
+        """
+    ))
+    # Follow-up queue and status filters: one index range scan per user/status
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS idx_applications_user_status_follow_up "
+        "ON applications(user_id, status, next_follow_up);"
+    ))
+    # Keyset pagination of the newest-first list
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS idx_applications_user_id ON applications(user_id, id);"
+    ))
+
+def _m0010_reply_history(conn):
+    conn.execute(text(
+        """
+        CREATE TABLE IF NOT EXISTS reply_blobs (
+            hash VARCHAR(64) PRIMARY KEY,
+            codec TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            data BYTEA NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """
+    ))
+    # Compressed already; skip pglz on the TOASTed value
+    conn.execute(text("ALTER TABLE reply_blobs ALTER COLUMN data SET STORAGE EXTERNAL;"))
+    conn.execute(text(
+        """
+        CREATE TABLE IF NOT EXISTS reply_history (
+            id BIGSERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            blob_hash VARCHAR(64) NOT NULL REFERENCES reply_blobs(hash),
+            kind TEXT NOT NULL,
+            phase TEXT NOT NULL DEFAULT '',
+            week INTEGER NOT NULL DEFAULT 0,
+            model TEXT NOT NULL DEFAULT '',
+            title TEXT NOT NULL DEFAULT '',
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            CONSTRAINT uq_reply_history_user_kind_week_blob UNIQUE (user_id, kind, week, blob_hash)
+        );
+        """
+    ))
+    # Keyset pages of GET /history, all kinds or one
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS idx_reply_history_user_id ON reply_history(user_id, id);"
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS idx_reply_history_user_kind_id ON reply_history(user_id, kind, id);"
+    ))
+    # gc() looks up references by blob_hash
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS idx_reply_history_blob_hash ON reply_history(blob_hash);"
+    ))
+
+def _m0011_search_docs(conn):
+    conn.execute(text(
+        """
+        CREATE TABLE IF NOT EXISTS search_docs (
+            id BIGSERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            source TEXT NOT NULL,
+            kind TEXT NOT NULL DEFAULT '',
+            ref_id BIGINT NULL,
+            config REGCONFIG NOT NULL DEFAULT 'simple',
+            body TEXT NOT NULL,
+            body_hash VARCHAR(64) NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            tsv TSVECTOR GENERATED ALWAYS AS (to_tsvector(config, body)) STORED,
+            CONSTRAINT uq_search_docs_user_source_hash UNIQUE (user_id, source, body_hash)
+        );
+        """
+    ))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_search_docs_tsv ON search_docs USING GIN (tsv);"))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS idx_search_docs_user_created ON search_docs(user_id, created_at);"
+    ))
+
+def _m0012_digest(conn):
+    conn.execute(text(
+        """
+        CREATE TABLE IF NOT EXISTS digest_runs (
+            week_start DATE PRIMARY KEY,
+            started_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            finished_at TIMESTAMPTZ NULL,
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            generated INTEGER NOT NULL DEFAULT 0
+        );
+        """
+    ))
+    conn.execute(text(
+        """
+        CREATE TABLE IF NOT EXISTS digest_deliveries (
+            week_start DATE NOT NULL,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            status TEXT NOT NULL,
+            state_key TEXT NOT NULL DEFAULT '',
+            error TEXT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (week_start, user_id)
+        );
+        """
+    ))
+
+
+MIGRATIONS = [
+    (1, "base_tables", _m0001_base_tables),
+    (2, "email_tokens_legacy_cleanup", _m0002_email_tokens_legacy_cleanup),
+    (3, "email_outbox", _m0003_email_outbox),
+    (4, "email_tokens_janitor_indexes", _m0004_email_tokens_janitor_indexes),
+    (5, "conversations", _m0005_conversations),
+    (6, "llm_usage", _m0006_llm_usage),
+    (7, "journey_states", _m0007_journey_states),
+    (8, "kpi_events", _m0008_kpi_events),
+    (9, "applications", _m0009_applications),
+    (10, "reply_history", _m0010_reply_history),
+    (11, "search_docs", _m0011_search_docs),
+    (12, "digest", _m0012_digest),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn) -> int:
+    """Highest applied migration, or 0 if schema_version does not exist yet."""
+    if conn.dialect.name == "postgresql":
+        exists = conn.execute(text("SELECT to_regclass('schema_version') IS NOT NULL")).scalar()
+        if not exists:
+            return 0
+    else:
+        from sqlalchemy import inspect
+        if not inspect(conn).has_table("schema_version"):
+            return 0
+    return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar() or 0
+
+
+def _apply_pending(engine) -> list:
+    applied = []
+    with engine.begin() as conn:
+        conn.execute(text(
+            """
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+            """
+        ))
+    with engine.connect() as conn:
+        have = current_version(conn)
+    for version, name, fn in MIGRATIONS:
+        if version <= have:
+            continue
+        with engine.begin() as conn:
+            fn(conn)
+            conn.execute(
+                text("INSERT INTO schema_version (version, name) VALUES (:v, :n)"),
+                {"v": version, "n": name},
+            )
+        print(f"[migrations] applied {version:04d}_{name}")
+        applied.append(version)
+    return applied
+
+
+def migrate(engine) -> list:
+    """
+    Apply pending migrations and return the versions applied (empty when the
+    schema was already current, which costs a single query and no DDL).
+    """
+    if engine.dialect.name != "postgresql":
+        # Local stand-ins (SQLite for benchmarks and offline runs): the SQL
+        # above is Postgres-only, so build the schema from the models instead.
+        from models import Base
+        Base.metadata.create_all(engine)
+        return []
+
+    with engine.connect() as conn:
+        if current_version(conn) >= LATEST_VERSION:
+            return []
+
+    # Session-level advisory lock on a dedicated connection; other processes
+    # block here, then find nothing pending once the holder releases it.
+    with engine.connect() as lock_conn:
+        lock_conn.execute(text("SELECT pg_advisory_lock(:k)"), {"k": ADVISORY_LOCK_KEY})
+        try:
+            return _apply_pending(engine)
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": ADVISORY_LOCK_KEY})
+            lock_conn.commit()
+
+
+def main():
+    from dotenv import load_dotenv
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Apply database schema migrations.")
+    parser.add_argument("--status", action="store_true", help="show current and latest version only")
+    args = parser.parse_args()
+
+    engine = create_engine(os.getenv("DATABASE_URL"))
+    if args.status:
+        with engine.connect() as conn:
+            print(f"current={current_version(conn)} latest={LATEST_VERSION}")
+        return
+    applied = migrate(engine)
+    print(f"[migrations] {len(applied)} applied; schema at version {LATEST_VERSION}")
+
+
+if __name__ == "__main__":
+    main()
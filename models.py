@@ -6,8 +6,16 @@ from sqlalchemy import (
     DateTime,
     ForeignKey,
     Index,
-    text,
+    Text,
+    JSON,
+    Float,
+    Date,
+    LargeBinary,
+    UniqueConstraint,
+    CheckConstraint,
 )
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import DDL, event
 from sqlalchemy.orm import declarative_base, relationship
 import datetime
 
@@ -37,90 +45,198 @@ class EmailToken(Base):
     user = relationship("User")
 
 
-Index("idx_email_tokens_hash", EmailToken.token_hash)
-Index("idx_email_tokens_user_type_used", EmailToken.user_id, EmailToken.type, EmailToken.used)
+class EmailOutbox(Base):
+    __tablename__ = "email_outbox"
+    id = Column(Integer, primary_key=True)
+    to_addr = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    body_text = Column(Text, nullable=False)
+    body_html = Column(Text, nullable=True)
+    status = Column(String, nullable=False, default="pending")  # 'pending', 'sent' or 'failed'
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=datetime.datetime.utcnow)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False, default=datetime.datetime.utcnow)
+    sent_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class Conversation(Base):
+    __tablename__ = "conversations"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    summary = Column(Text, nullable=False, default="")
+    summarized_through = Column(Integer, nullable=False, default=0)  # last message id folded into summary
+    context_md = Column(Text, nullable=False, default="")
+    context_kind = Column(String, nullable=False, default="")
+    created_at = Column(DateTime(timezone=True), nullable=False, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime(timezone=True), nullable=False, default=datetime.datetime.utcnow)
+
+
+class ConversationMessage(Base):
+    __tablename__ = "conversation_messages"
+    id = Column(Integer, primary_key=True)
+    conversation_id = Column(Integer, ForeignKey("conversations.id", ondelete="CASCADE"), nullable=False)
+    role = Column(String, nullable=False)  # 'user' or 'assistant'
+    content = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=datetime.datetime.utcnow)
+
+class LLMUsage(Base):
+    """Ledger of LLM calls and the tokens the model reported (see llm_quota.py)."""
+    __tablename__ = "llm_usage"
+    id = Column(Integer, primary_key=True)
+    subject = Column(String, nullable=False)  # 'user:<id>' or 'ip:<address>'
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+    kind = Column(String, nullable=False)  # plan, standup, gate, triage, chat, summary
+    model = Column(String, nullable=False)
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    total_tokens = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=datetime.datetime.utcnow)
+
+class JourneyState(Base):
+    """The user's journey state document (see journey_state.py)."""
+    __tablename__ = "journey_states"
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    state = Column(JSON().with_variant(JSONB(), "postgresql"), nullable=False, default=dict)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), nullable=False, default=datetime.datetime.utcnow)
+
+class KpiEvent(Base):
+    """Append-only KPI log: an increment (count metrics) or a measurement (see kpis.py)."""
+    __tablename__ = "kpi_events"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    metric = Column(String, nullable=False)
+    value = Column(Float, nullable=False)
+    occurred_at = Column(DateTime(timezone=True), nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=datetime.datetime.utcnow)
+
 
+class KpiWeekly(Base):
+    """Per-user, per-metric, per-ISO-week rollup of kpi_events, kept current on every insert."""
+    __tablename__ = "kpi_weekly"
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    week_start = Column(Date, primary_key=True)  # Monday (UTC)
+    metric = Column(String, primary_key=True)
+    events = Column(Integer, nullable=False, default=0)
+    total = Column(Float, nullable=False, default=0)
+    min_value = Column(Float, nullable=True)
+    max_value = Column(Float, nullable=True)
+    last_value = Column(Float, nullable=True)
+    last_at = Column(DateTime(timezone=True), nullable=True)
 
-def create_tables(engine):
-    """Create users and email_tokens tables if they do not exist."""
-    with engine.begin() as conn:
-        conn.execute(
-            text(
-                """
-                CREATE TABLE IF NOT EXISTS users (
-                    id SERIAL PRIMARY KEY,
-                    email TEXT UNIQUE NOT NULL,
-                    password_hash TEXT,
-                    is_verified BOOLEAN NOT NULL DEFAULT FALSE,
-                    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
-                    phase TEXT NOT NULL DEFAULT 'explore'
-                );
-                """
-            )
-        )
-        conn.execute(
-            text(
-                """
-                CREATE TABLE IF NOT EXISTS email_tokens (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                    token_hash TEXT NOT NULL,
-                    type TEXT NOT NULL CHECK (type IN ('reset','verify')),
-                    purpose TEXT NULL,
-                    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
-                    expires_at TIMESTAMPTZ NOT NULL,
-                    used BOOLEAN NOT NULL DEFAULT FALSE,
-                    used_at TIMESTAMPTZ NULL
-                );
-                """
-            )
-        )
-        conn.execute(
-            text(
-                "CREATE INDEX IF NOT EXISTS idx_email_tokens_hash ON email_tokens(token_hash);"
-            )
-        )
-        conn.execute(
-            text(
-                "CREATE INDEX IF NOT EXISTS idx_email_tokens_user_type_used ON email_tokens(user_id, type, used);"
-            )
-        )
-
-
-def safe_migrate(engine):
-    """Idempotent migrations for email_tokens."""
-    with engine.begin() as conn:
-        # Legacy column from early versions
-        conn.execute(text("ALTER TABLE email_tokens DROP COLUMN IF EXISTS token;"))
-        # Clean bad rows so NOT NULL succeeds
-        conn.execute(text("DELETE FROM email_tokens WHERE token_hash IS NULL;"))
-        # Enforce NOT NULL on token_hash
-        conn.execute(text("ALTER TABLE email_tokens ALTER COLUMN token_hash SET NOT NULL;"))
-        # Add used_at if missing
-        conn.execute(text(
-            """
-            DO $$ BEGIN
-            BEGIN
-                ALTER TABLE email_tokens ADD COLUMN used_at TIMESTAMPTZ NULL;
-            EXCEPTION WHEN duplicate_column THEN
-            END; END $$;
-            """
-        ))
-        # Add purpose if missing
-        conn.execute(text(
-            """
-            DO $$ BEGIN
-            BEGIN
-                ALTER TABLE email_tokens ADD COLUMN purpose TEXT NULL;
-            EXCEPTION WHEN duplicate_column THEN
-            END; END $$;
-            """
-        ))
-        # Ensure indexes exist
-        conn.execute(text(
-            "CREATE INDEX IF NOT EXISTS idx_email_tokens_hash ON email_tokens(token_hash)"
-        ))
-        conn.execute(text(
-            "CREATE INDEX IF NOT EXISTS idx_email_tokens_user_type_used "
-            "ON email_tokens(user_id, type, used)"
-        ))
+class Application(Base):
+    """A lead or job application in the tracker (see applications.py)."""
+    __tablename__ = "applications"
+    __table_args__ = (
+        UniqueConstraint("user_id", "dedupe_key", name="uq_applications_user_dedupe"),
+        CheckConstraint(
+            "status IN ('lead','contacted','applied','screening','interviewing','offer','accepted','rejected','withdrawn')",
+            name="ck_applications_status",
+        ),
+    )
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    company = Column(String, nullable=False)
+    role = Column(String, nullable=False, default="")
+    url = Column(String, nullable=False, default="")
+    source = Column(String, nullable=False, default="")  # 'manual', 'import', 'linkedin', ...
+    contact = Column(String, nullable=False, default="")
+    location = Column(String, nullable=False, default="")
+    notes = Column(Text, nullable=False, default="")
+    status = Column(String, nullable=False, default="lead")
+    next_follow_up = Column(Date, nullable=True)
+    dedupe_key = Column(String, nullable=False)  # hash of normalized company|role|url
+    status_changed_at = Column(DateTime(timezone=True), nullable=False, default=datetime.datetime.utcnow)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime(timezone=True), nullable=False, default=datetime.datetime.utcnow)
+
+class ReplyBlob(Base):
+    """One distinct coach reply, keyed by the SHA-256 of its text (see reply_history.py)."""
+    __tablename__ = "reply_blobs"
+    hash = Column(String(64), primary_key=True)
+    codec = Column(String, nullable=False)  # 'zlib' or 'raw'
+    size = Column(Integer, nullable=False)  # uncompressed bytes
+    data = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=datetime.datetime.utcnow)
+
+
+class ReplyHistory(Base):
+    """A coach reply a user received; the text lives in reply_blobs."""
+    __tablename__ = "reply_history"
+    __table_args__ = (
+        UniqueConstraint("user_id", "kind", "week", "blob_hash", name="uq_reply_history_user_kind_week_blob"),
+    )
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    blob_hash = Column(String(64), ForeignKey("reply_blobs.hash"), nullable=False)
+    kind = Column(String, nullable=False)  # plan, standup, gate, triage, chat
+    phase = Column(String, nullable=False, default="")
+    week = Column(Integer, nullable=False, default=0)  # week_in_phase; 0 if unknown
+    model = Column(String, nullable=False, default="")
+    title = Column(String, nullable=False, default="")
+    created_at = Column(DateTime(timezone=True), nullable=False, default=datetime.datetime.utcnow)
+
+class SearchDoc(Base):
+    """A text in a user's search index (see search.py). On Postgres the table also has a generated tsv column."""
+    __tablename__ = "search_docs"
+    __table_args__ = (
+        UniqueConstraint("user_id", "source", "body_hash", name="uq_search_docs_user_source_hash"),
+    )
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    source = Column(String, nullable=False)  # reply, note, message
+    kind = Column(String, nullable=False, default="")  # plan, standup, gate, triage, chat
+    ref_id = Column(Integer, nullable=True)  # reply_history id, or conversation id for messages
+    config = Column(String, nullable=False, default="simple")  # text search config (REGCONFIG on Postgres)
+    body = Column(Text, nullable=False)
+    body_hash = Column(String(64), nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=datetime.datetime.utcnow)
+
+# SQLite stand-in for the tsvector index: an FTS5 table over search_docs.body, kept in step by triggers
+for _ddl in (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5("
+    "body, content='search_docs', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS search_docs_ai AFTER INSERT ON search_docs BEGIN "
+    "INSERT INTO search_fts(rowid, body) VALUES (new.id, new.body); END",
+    "CREATE TRIGGER IF NOT EXISTS search_docs_ad AFTER DELETE ON search_docs BEGIN "
+    "INSERT INTO search_fts(search_fts, rowid, body) VALUES ('delete', old.id, old.body); END",
+):
+    event.listen(SearchDoc.__table__, "after_create", DDL(_ddl).execute_if(dialect="sqlite"))
+
+class DigestRun(Base):
+    """One weekly digest run, keyed by its week; progress is checkpointed here (see digest.py)."""
+    __tablename__ = "digest_runs"
+    week_start = Column(Date, primary_key=True)  # Monday (UTC)
+    started_at = Column(DateTime(timezone=True), nullable=False, default=datetime.datetime.utcnow)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    last_user_id = Column(Integer, nullable=False, default=0)  # keyset checkpoint: users up to here are done
+    generated = Column(Integer, nullable=False, default=0)  # plans requested; users with identical states share one
+
+
+class DigestDelivery(Base):
+    """Per-user outcome of a digest run; a 'sent' row is never mailed again that week."""
+    __tablename__ = "digest_deliveries"
+    week_start = Column(Date, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    status = Column(String, nullable=False)  # 'sent' or 'failed'
+    state_key = Column(String, nullable=False, default="")  # reply cache key of the plan mailed
+    error = Column(Text, nullable=True)
+    updated_at = Column(DateTime(timezone=True), nullable=False, default=datetime.datetime.utcnow)
+
+Index("idx_email_tokens_live_hash", EmailToken.token_hash, postgresql_where=EmailToken.used.is_(False))
+Index("idx_email_tokens_expires", EmailToken.expires_at)
+Index("idx_email_tokens_used_at", EmailToken.used_at, postgresql_where=EmailToken.used.is_(True))
+Index("idx_email_tokens_user_type_used", EmailToken.user_id, EmailToken.type, EmailToken.used)
+Index("idx_email_outbox_status_next", EmailOutbox.status, EmailOutbox.next_attempt_at)
+Index("idx_conversations_user_updated", Conversation.user_id, Conversation.updated_at)
+Index("idx_conversation_messages_conv_id", ConversationMessage.conversation_id, ConversationMessage.id)
+Index("idx_llm_usage_created", LLMUsage.created_at)
+Index("idx_llm_usage_subject_created", LLMUsage.subject, LLMUsage.created_at)
+Index("idx_kpi_events_user_occurred", KpiEvent.user_id, KpiEvent.occurred_at)
+Index("idx_applications_user_status_follow_up", Application.user_id, Application.status, Application.next_follow_up)
+Index("idx_applications_user_id", Application.user_id, Application.id)
+Index("idx_reply_history_user_id", ReplyHistory.user_id, ReplyHistory.id)
+Index("idx_reply_history_user_kind_id", ReplyHistory.user_id, ReplyHistory.kind, ReplyHistory.id)
+Index("idx_reply_history_blob_hash", ReplyHistory.blob_hash)
+Index("idx_search_docs_user_created", SearchDoc.user_id, SearchDoc.created_at)
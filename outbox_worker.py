@@ -0,0 +1,140 @@
+"""
+Email outbox worker.
+
+Drains the email_outbox table over one reused SMTP connection so web requests
+only enqueue. Run it as a separate process next to the web workers:
+
+  python outbox_worker.py            # poll forever
+  python outbox_worker.py --once     # drain what is due, then exit
+
+Settings (environment):
+  OUTBOX_BATCH_SIZE=50         messages claimed per transaction
+  OUTBOX_CLAIM_TTL=300         seconds a claimed message stays invisible to other workers
+  OUTBOX_POLL_INTERVAL=2       seconds to sleep when the outbox is empty
+  OUTBOX_MAX_ATTEMPTS=8        after this many failures a message is marked 'failed'
+  OUTBOX_BACKOFF_BASE=30       retry delay is base * 2**(attempts-1) seconds, capped at 1h
+  OUTBOX_SMTP_IDLE=60          close the SMTP session after this many idle seconds
+
+Several workers can run at once: a short transaction claims due rows with
+FOR UPDATE SKIP LOCKED and moves their next_attempt_at OUTBOX_CLAIM_TTL
+seconds ahead, which is the claim's lease. Sending happens outside any
+transaction and each result is committed on its own, so a slow relay holds
+no row locks and a crash mid-batch loses nothing: unfinished claims just
+come due again when the lease runs out.
+"""
+
+import os, time, argparse
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+load_dotenv()
+
+from models import EmailOutbox
+from mailer import SMTPConnection, build_message
+
+BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "2"))
+MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+BACKOFF_BASE = int(os.getenv("OUTBOX_BACKOFF_BASE", "30"))
+BACKOFF_MAX = 3600
+CLAIM_TTL = int(os.getenv("OUTBOX_CLAIM_TTL", "300"))
+SMTP_IDLE = float(os.getenv("OUTBOX_SMTP_IDLE", "60"))
+
+
+def backoff_seconds(attempts: int) -> int:
+    return min(BACKOFF_BASE * (2 ** max(attempts - 1, 0)), BACKOFF_MAX)
+
+
+def claim_batch(sess, batch_size: int = BATCH_SIZE) -> list:
+    """Lease up to batch_size due messages to this worker; commits, returns their ids."""
+    now = datetime.utcnow()
+    rows = (
+        sess.query(EmailOutbox)
+        .filter(EmailOutbox.status == "pending", EmailOutbox.next_attempt_at <= now)
+        .order_by(EmailOutbox.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    for m in rows:
+        m.next_attempt_at = now + timedelta(seconds=CLAIM_TTL)
+    sess.commit()
+    return [m.id for m in rows]
+
+
+def drain_batch(sess, conn: SMTPConnection, batch_size: int = BATCH_SIZE) -> dict:
+    """
+    Claim up to batch_size due messages, send them over conn and commit each
+    message's status as soon as it is known. Returns counts {sent, retry, failed}.
+    """
+    counts = {"sent": 0, "retry": 0, "failed": 0}
+    for mid in claim_batch(sess, batch_size):
+        m = sess.get(EmailOutbox, mid)
+        if m is None or m.status != "pending":
+            continue
+        try:
+            conn.send(build_message(m.to_addr, m.subject, m.body_text, m.body_html))
+        except Exception as e:
+            m.attempts += 1
+            m.last_error = str(e)[:1000]
+            if m.attempts >= MAX_ATTEMPTS:
+                m.status = "failed"
+                counts["failed"] += 1
+            else:
+                m.next_attempt_at = datetime.utcnow() + timedelta(seconds=backoff_seconds(m.attempts))
+                counts["retry"] += 1
+            # Drop the session so the next message starts from a clean handshake
+            conn.close()
+        else:
+            m.attempts += 1
+            m.status = "sent"
+            m.sent_at = datetime.utcnow()
+            m.last_error = None
+            counts["sent"] += 1
+        sess.commit()
+    return counts
+
+
+def run(once: bool = False, batch_size: int = BATCH_SIZE, interval: float = POLL_INTERVAL) -> None:
+    engine = create_engine(os.getenv("DATABASE_URL"))
+    Session = sessionmaker(bind=engine)
+    last_send = time.monotonic()
+    with SMTPConnection() as conn:
+        while True:
+            sess = Session()
+            try:
+                counts = drain_batch(sess, conn, batch_size)
+            except Exception as e:
+                sess.rollback()
+                print(f"[outbox] batch failed: {e}")
+                counts = {"sent": 0, "retry": 0, "failed": 0}
+            finally:
+                sess.close()
+
+            if any(counts.values()):
+                last_send = time.monotonic()
+                print(f"[outbox] sent={counts['sent']} retry={counts['retry']} failed={counts['failed']}")
+            # A full batch means more may be due; keep draining without sleeping
+            if sum(counts.values()) >= batch_size:
+                continue
+            if once:
+                return
+            if time.monotonic() - last_send > SMTP_IDLE:
+                conn.close()  # don't hold an idle session open against the relay
+            time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send queued emails from email_outbox.")
+    parser.add_argument("--once", action="store_true", help="drain due messages and exit")
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE, help="messages claimed per transaction")
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL, help="idle poll interval (seconds)")
+    args = parser.parse_args()
+    run(once=args.once, batch_size=args.batch, interval=args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Password hashing service (bcrypt).
+
+- Cost factor comes from BCRYPT_ROUNDS (default 12).
+- Hashing and checking run in a bounded process pool (PASSWORD_HASH_WORKERS,
+  default min(4, CPU count); 0 runs inline) so a login burst can't pin every
+  request thread on bcrypt. The pool is created lazily, i.e. after gunicorn forks.
+- The dummy hash is computed on first use (not at import, which would add a
+  bcrypt to every import of app) with the configured cost, under a lock so
+  concurrent first logins compute it once; gunicorn's when_ready warms it in
+  the preload master. Unknown users are checked against it so every login
+  costs exactly one bcrypt.
+- needs_rehash() reports hashes stored with a different cost so callers can
+  upgrade them after a successful login.
+"""
+
+import os, re, threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import bcrypt
+
+import metrics
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", "10"))
+
+BCRYPT_PREFIX_RE = re.compile(r"^\$2[aby]?\$")
+BCRYPT_COST_RE = re.compile(r"^\$2[aby]?\$(\d{2})\$")
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _hashpw(plain: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(plain, bcrypt.gensalt(rounds))
+
+
+def _checkpw(plain: bytes, hashed: bytes) -> bool:
+    return bcrypt.checkpw(plain, hashed)
+
+
+def _get_pool():
+    global _pool, _pool_pid
+    if PASSWORD_HASH_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        # A pool inherited across fork() is unusable; build one per process
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _run(fn, *args):
+    pool = _get_pool()
+    if pool is None:
+        return fn(*args)
+    return pool.submit(fn, *args).result(timeout=PASSWORD_HASH_TIMEOUT)
+
+
+_dummy_hash = None
+_dummy_lock = threading.Lock()
+
+
+def dummy_hash() -> bytes:
+    global _dummy_hash
+    if _dummy_hash is None:
+        with _dummy_lock:
+            # Concurrent first logins would each pay a bcrypt without the re-check
+            if _dummy_hash is None:
+                _dummy_hash = _hashpw(b"nextchapter-timing-equalizer", BCRYPT_ROUNDS)
+    return _dummy_hash
+
+
+def is_bcrypt_hash(h: str) -> bool:
+    return bool(h) and bool(BCRYPT_PREFIX_RE.match(h or ""))
+
+
+def hash_password(plain: str) -> str:
+    with metrics.BCRYPT_LATENCY.labels("hash").time():
+        return _run(_hashpw, plain.encode(), BCRYPT_ROUNDS).decode()
+
+
+def verify_password(plain: str, hashed: Optional[str]) -> bool:
+    """
+    True if hashed is valid bcrypt and matches; otherwise False (no exceptions).
+    Missing or non-bcrypt hashes are checked against dummy_hash() so the caller
+    sees the same cost whether or not the account exists.
+    """
+    real = is_bcrypt_hash(hashed)
+    target = hashed.encode() if real else dummy_hash()
+    try:
+        with metrics.BCRYPT_LATENCY.labels("check").time():
+            ok = _run(_checkpw, plain.encode(), target)
+    except Exception:
+        return False
+    return ok and real
+
+
+def needs_rehash(hashed: Optional[str]) -> bool:
+    """True if hashed is bcrypt with a cost other than BCRYPT_ROUNDS."""
+    m = BCRYPT_COST_RE.match(hashed or "")
+    return bool(m) and int(m.group(1)) != BCRYPT_ROUNDS
@@ -0,0 +1,68 @@
+"""
+User-profile cache for GET /me, keyed by user_id.
+
+Holds the small {id, email, phase} dict /me returns so a page load doesn't
+need a DB session. Writers call invalidate(user_id) after changing any field
+behind the profile (set_phase, mark_user_verified, password changes).
+
+Settings (environment):
+  PROFILE_CACHE_BACKEND=memory|redis|off   (default: redis if RATELIMIT_STORAGE_URI is redis, else off)
+  PROFILE_CACHE_URL=redis://...            (default: RATELIMIT_STORAGE_URI)
+  PROFILE_CACHE_TTL=300                    (seconds)
+  PROFILE_CACHE_MAX_ENTRIES=10000
+
+The cache is off without Redis: a per-process memory cache is only
+invalidated in the worker that did the write, so the others would keep
+serving (and 304-ing) the old profile until the TTL ran out. memory is
+still available for a single-process setup.
+
+Callers use services.get_profile_cache(), which builds it once per process.
+"""
+
+import os, json
+from typing import Optional
+
+from reply_cache import make_backend, default_redis_url, default_backend_kind
+
+
+class ProfileCache:
+    def __init__(self, backend, ttl: int = 300):
+        self.backend = backend
+        self.ttl = ttl
+
+    def get(self, user_id: int) -> Optional[dict]:
+        if self.backend is None:
+            return None
+        try:
+            raw = self.backend.get(str(user_id))
+        except Exception as e:
+            print(f"[profile_cache] get failed: {e}")
+            return None
+        return json.loads(raw) if raw else None
+
+    def put(self, user_id: int, profile: dict) -> None:
+        if self.backend is None:
+            return
+        try:
+            self.backend.set(str(user_id), json.dumps(profile, sort_keys=True), self.ttl)
+        except Exception as e:
+            print(f"[profile_cache] set failed: {e}")
+
+    def invalidate(self, user_id: int) -> None:
+        if self.backend is None:
+            return
+        try:
+            self.backend.delete(str(user_id))
+        except Exception as e:
+            print(f"[profile_cache] delete failed: {e}")
+
+
+def init_profile_cache() -> ProfileCache:
+    """Build the cache from environment settings."""
+    url = default_redis_url("PROFILE_CACHE_URL")
+    default_kind = "redis" if default_backend_kind(url) == "redis" else "off"
+    kind = os.getenv("PROFILE_CACHE_BACKEND", default_kind).strip().lower()
+    ttl = int(os.getenv("PROFILE_CACHE_TTL", "300"))
+    max_entries = int(os.getenv("PROFILE_CACHE_MAX_ENTRIES", "10000"))
+    return ProfileCache(make_backend(kind, url, max_entries, "nc:profile:"), ttl)
+
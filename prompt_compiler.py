@@ -0,0 +1,237 @@
+"""
+Prompt compilation for coach and chat calls.
+
+Messages are assembled from most to least stable so the provider's prompt
+cache can reuse the longest possible prefix:
+
+  1. system: system_prompt.md + the fixed runtime notes below. This is
+     byte-identical for every kind, phase and user.
+  2. user:   the journey_playbook.md section for current_phase (shared by
+     everyone in that phase), then the task, the compact state and the note.
+
+user_state is serialized as compact JSON without nulls, empty values or
+fields still at the schema defaults from system_prompt.md. current_phase and
+week_in_phase are always kept.
+
+Every compiled prompt is logged with an estimated token count
+("[prompt] kind=plan phase=position est_tokens=...").
+PROMPT_LOG_TOKENS=0 turns the log line off.
+"""
+
+import os, re, json, hashlib
+
+BASE_DIR = os.path.dirname(__file__)
+SP_PATH = os.path.join(BASE_DIR, "system_prompt.md")
+PLAYBOOK_PATH = os.path.join(BASE_DIR, "journey_playbook.md")
+
+PROMPT_LOG_TOKENS = os.getenv("PROMPT_LOG_TOKENS", "1") != "0"
+
+DEFAULT_SYSTEM = (
+    "You are JTBD Journey Coach. You coach calmly and concretely through phases: "
+    "stabilize, reframe, position, explore, apply, secure, transition. "
+    "Be concise, practical, and encouraging. Prefer short lists, checklists, and micro-steps."
+)
+
+PHASES = ("stabilize", "reframe", "position", "explore", "apply", "secure", "transition")
+
+# Schema defaults from system_prompt.md; fields equal to these are not sent
+DEFAULT_STATE = {
+    "constraints": {"financial_runway_months": None, "health": None, "family": None},
+    "targets": {"roles": [], "industries": [], "locations": ["CH"]},
+    "artifacts": {"cv": "v0", "linkedin": "draft", "stories": 0},
+    "cadence": {"deep_work_blocks_per_week": 4, "recovery_blocks_per_week": 2},
+    "kpis": {"learning_conversations": 0, "leads": 0, "interviews": 0, "sleep_score": None, "mood": None},
+}
+ALWAYS_KEEP = ("current_phase", "week_in_phase")
+
+RUNTIME_NOTES = (
+    "## Request format\n"
+    "- `State:` is compact JSON. Fields that are null, empty or still at the defaults in the "
+    "state schema above are omitted; do not ask for those.\n"
+    "- `Playbook:` is the journey_playbook.md section for the user's current phase.\n"
+    "- If `Context` is provided, treat it as the user's current panel. When they say 'bullet 1' "
+    "or 'the first item', identify the first actionable bullet from it and help them complete "
+    "it step-by-step with concrete instructions."
+)
+
+TASKS = {
+    "plan": "Produce a **Weekly Plan** using your default output structure.",
+    "standup": "Output a **Daily Stand-up** using the template.",
+    "gate": "Run a **Phase Gate Review** for the current phase.",
+    "triage": "Run **Setback Triage**. Keep it concise and directive.",
+}
+DEFAULT_TASK = "Provide guidance using the default structure."
+
+PHASE_HEADING_RE = re.compile(r"^Phase \d+\s*\S\s*(\w+)", re.IGNORECASE)
+
+
+def _read(path: str) -> str:
+    if not os.path.exists(path):
+        return ""
+    with open(path, "r", encoding="utf-8") as f:
+        return (f.read() or "").strip()
+
+
+def load_playbook(text: str) -> dict:
+    """
+    Split journey_playbook.md on "## " headings.
+    Keys: phase names ("stabilize", ...), "triage" and "switzerland".
+    """
+    sections = {}
+    for block in re.split(r"^## ", text, flags=re.MULTILINE)[1:]:
+        heading, _, body = block.partition("\n")
+        body = body.strip()
+        m = PHASE_HEADING_RE.match(heading)
+        if m:
+            key = m.group(1).lower()
+        elif heading.lower().startswith("setback"):
+            key = "triage"
+        elif heading.lower().startswith("switzerland"):
+            key = "switzerland"
+        else:
+            continue
+        sections[key] = f"{heading.strip()}\n{body}"
+    return sections
+
+
+SYSTEM_PROMPT = _read(SP_PATH) or DEFAULT_SYSTEM
+STATIC_PREFIX = SYSTEM_PROMPT + "\n\n" + RUNTIME_NOTES
+PLAYBOOK = load_playbook(_read(PLAYBOOK_PATH))
+
+# Changes whenever the prompt text or the playbook changes (reply cache keys use it)
+PROMPT_VERSION = hashlib.sha256(
+    (STATIC_PREFIX + json.dumps(PLAYBOOK, sort_keys=True) + json.dumps(TASKS, sort_keys=True)).encode("utf-8")
+).hexdigest()[:12]
+
+
+def _is_empty(value) -> bool:
+    return value is None or value == "" or value == [] or value == {}
+
+
+def _compact(value, defaults):
+    if not isinstance(value, dict):
+        return value
+    out = {}
+    for key, v in value.items():
+        d = defaults.get(key) if isinstance(defaults, dict) else None
+        if isinstance(v, dict):
+            v = _compact(v, d)
+        if _is_empty(v):
+            continue
+        if isinstance(defaults, dict) and key in defaults and v == d:
+            continue
+        out[key] = v
+    return out
+
+
+def compact_state(user_state) -> dict:
+    """user_state without nulls, empty values and schema defaults (phase/week always kept)."""
+    state = user_state if isinstance(user_state, dict) else {}
+    out = _compact({k: v for k, v in state.items() if k not in ALWAYS_KEEP}, DEFAULT_STATE)
+    kept = {k: state[k] for k in ALWAYS_KEEP if not _is_empty(state.get(k))}
+    return {**kept, **out}
+
+
+def serialize_state(user_state) -> str:
+    return json.dumps(compact_state(user_state), sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+def current_phase(user_state) -> str:
+    phase = str((user_state or {}).get("current_phase") or "").strip().lower() if isinstance(user_state, dict) else ""
+    return phase if phase in PHASES else ""
+
+
+def playbook_section(phase: str, kind: str = "") -> str:
+    parts = [PLAYBOOK[phase]] if phase in PLAYBOOK else []
+    if kind == "triage" and "triage" in PLAYBOOK:
+        parts.append(PLAYBOOK["triage"])
+    if phase == "stabilize" and "switzerland" in PLAYBOOK:
+        parts.append(PLAYBOOK["switzerland"])
+    return "\n\n".join(parts)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English/JSON); good enough for trends."""
+    return (len(text) + 3) // 4
+
+
+def _log(kind: str, phase: str, messages: list) -> None:
+    if not PROMPT_LOG_TOKENS:
+        return
+    total = sum(estimate_tokens(m["content"]) for m in messages)
+    static = estimate_tokens(messages[0]["content"])
+    print(f"[prompt] kind={kind} phase={phase or '-'} est_tokens={total} static_prefix={static}")
+
+
+def _context_lines(user_state, kind: str) -> list:
+    phase = current_phase(user_state)
+    lines = []
+    section = playbook_section(phase, kind)
+    if section:
+        lines.append(f"Playbook:\n{section}\n")
+    return lines
+
+
+def compile_coach(kind: str, user_state, note) -> list:
+    """Messages for /plan, /standup, /gate and /triage."""
+    lines = _context_lines(user_state, kind)
+    lines.append("Task: " + TASKS.get(kind, DEFAULT_TASK))
+    lines.append("State: " + serialize_state(user_state))
+    if note:
+        lines.append(f"Note: {note}")
+    messages = [
+        {"role": "system", "content": STATIC_PREFIX},
+        {"role": "user", "content": "\n".join(lines)},
+    ]
+    _log(kind, current_phase(user_state), messages)
+    return messages
+
+
+def compile_chat(
+    user_state,
+    message: str,
+    context_md: str = "",
+    context_kind: str = "",
+    summary: str = "",
+    turns: list = None,
+) -> list:
+    """
+    Messages for /chat: the static prefix, playbook + state, the panel context,
+    the conversation summary, recent turns, then the new message.
+    """
+    lines = _context_lines(user_state, "chat")
+    lines.append("State: " + serialize_state(user_state))
+    messages = [
+        {"role": "system", "content": STATIC_PREFIX},
+        {"role": "user", "content": "\n".join(lines)},
+    ]
+    if context_md:
+        messages.append({
+            "role": "user",
+            "content": f"Context ({context_kind or 'panel'}; markdown the user is seeing):\n{context_md}",
+        })
+    if summary:
+        messages.append({"role": "user", "content": f"Summary of our conversation so far:\n{summary}"})
+    messages.extend(turns or [])
+    messages.append({"role": "user", "content": message})
+    _log("chat", current_phase(user_state), messages)
+    return messages
+
+
+SUMMARY_INSTRUCTIONS = (
+    "You keep the running summary of a coaching chat. Merge the previous summary with the new turns. "
+    "Keep facts about the user, decisions, commitments with dates, and open questions; drop pleasantries "
+    "and anything the coach can regenerate. At most 120 words, terse bullets, no preamble."
+)
+
+
+def compile_summary(previous: str, turns: list) -> list:
+    """Messages that fold turns into previous, for conversations.pending_summary()."""
+    speaker = {"user": "User", "assistant": "Coach"}
+    transcript = "\n".join(f"{speaker.get(t['role'], t['role'])}: {t['content']}" for t in turns)
+    messages = [
+        {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+        {"role": "user", "content": f"Previous summary:\n{previous or '(none)'}\n\nNew turns:\n{transcript}"},
+    ]
+    _log("summary", "", messages)
+    return messages
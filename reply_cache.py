@@ -0,0 +1,197 @@
+"""
+Response cache for coach replies (/plan, /standup, /gate, /triage).
+
+Keys are built from the canonicalized user_state JSON, kind, note, model and a
+hash of the system prompt, so any change to what the model would see produces
+a new key. Entries expire after a TTL and the least recently used entries are
+evicted once the cache holds max_entries.
+
+Settings (environment):
+  REPLY_CACHE_BACKEND=memory|redis|off   (default: redis if RATELIMIT_STORAGE_URI is redis, else memory)
+  REPLY_CACHE_URL=redis://...            (default: RATELIMIT_STORAGE_URI)
+  REPLY_CACHE_TTL=3600                   (seconds)
+  REPLY_CACHE_MAX_ENTRIES=1000
+"""
+
+import os, json, time, hashlib, threading
+from collections import OrderedDict
+from typing import Optional
+
+
+def canonical_state(user_state) -> str:
+    """Compact JSON with sorted keys; whitespace in the client payload does not matter."""
+    return json.dumps(user_state or {}, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+def normalize_note(note) -> str:
+    return " ".join(str(note or "").split())
+
+
+def prompt_version(system_prompt: str) -> str:
+    return hashlib.sha256((system_prompt or "").encode("utf-8")).hexdigest()[:12]
+
+
+def make_key(kind: str, user_state, note, model: str, prompt_ver: str) -> str:
+    raw = "\n".join([kind or "", canonical_state(user_state), normalize_note(note), model or "", prompt_ver or ""])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class MemoryBackend:
+    """In-process LRU with per-entry expiry. Each gunicorn worker has its own copy."""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if not item:
+                return None
+            expires_at, value = item
+            if expires_at <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, ttl: int) -> None:
+        with self._lock:
+            self._data[key] = (time.time() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def size(self) -> int:
+        return len(self._data)
+
+
+class RedisBackend:
+    """
+    Shared cache in Redis. Values use SETEX for the TTL; a sorted set of keys
+    scored by last access time implements LRU trimming to max_entries.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str, max_entries: int = 1000, prefix: str = "nc:reply:"):
+        import redis
+        self.r = redis.Redis.from_url(url)
+        self.r.ping()
+        self.max_entries = max_entries
+        self.prefix = prefix
+        self.lru_key = prefix + "lru"
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.r.get(self.prefix + key)
+        if value is None:
+            self.r.zrem(self.lru_key, key)
+            return None
+        self.r.zadd(self.lru_key, {key: time.time()})
+        return value.decode("utf-8")
+
+    def set(self, key: str, value: str, ttl: int) -> None:
+        pipe = self.r.pipeline()
+        pipe.setex(self.prefix + key, ttl, value.encode("utf-8"))
+        pipe.zadd(self.lru_key, {key: time.time()})
+        pipe.zcard(self.lru_key)
+        count = pipe.execute()[-1]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            evicted = [k.decode("utf-8") for k, _ in self.r.zpopmin(self.lru_key, overflow)]
+            if evicted:
+                self.r.delete(*[self.prefix + k for k in evicted])
+
+    def delete(self, key: str) -> None:
+        pipe = self.r.pipeline()
+        pipe.delete(self.prefix + key)
+        pipe.zrem(self.lru_key, key)
+        pipe.execute()
+
+    def size(self) -> int:
+        return int(self.r.zcard(self.lru_key))
+
+
+class ReplyCache:
+    def __init__(self, backend, ttl: int = 3600):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def get(self, key: str) -> Optional[str]:
+        if self.backend is None:
+            return None
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            self.errors += 1
+            print(f"[reply_cache] get failed: {e}")
+            return None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        if self.backend is None or not value:
+            return
+        try:
+            self.backend.set(key, value, self.ttl)
+        except Exception as e:
+            self.errors += 1
+            print(f"[reply_cache] set failed: {e}")
+
+    def stats(self) -> dict:
+        try:
+            size = self.backend.size() if self.backend is not None else 0
+        except Exception:
+            size = None
+        total = self.hits + self.misses
+        return {
+            "backend": self.backend.name if self.backend is not None else "off",
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_ratio": round(self.hits / total, 3) if total else None,
+            "size": size,
+            "ttl": self.ttl,
+        }
+
+
+def make_backend(kind: str, url: str, max_entries: int, prefix: str):
+    """memory, redis or off (None); falls back to memory if Redis is unreachable."""
+    if kind == "off":
+        return None
+    if kind == "redis":
+        try:
+            return RedisBackend(url, max_entries, prefix=prefix)
+        except Exception as e:
+            print(f"[cache] Redis at '{url}' unavailable ({e}); falling back to memory")
+    return MemoryBackend(max_entries)
+
+
+def default_redis_url(env_name: str) -> str:
+    return os.getenv(env_name) or os.getenv("RATELIMIT_STORAGE_URI", "memory://")
+
+
+def default_backend_kind(url: str) -> str:
+    return "redis" if url.startswith(("redis://", "rediss://")) else "memory"
+
+
+def init_reply_cache() -> ReplyCache:
+    """Build the cache from environment settings."""
+    url = default_redis_url("REPLY_CACHE_URL")
+    kind = os.getenv("REPLY_CACHE_BACKEND", default_backend_kind(url)).strip().lower()
+    ttl = int(os.getenv("REPLY_CACHE_TTL", "3600"))
+    max_entries = int(os.getenv("REPLY_CACHE_MAX_ENTRIES", "1000"))
+    return ReplyCache(make_backend(kind, url, max_entries, "nc:reply:"), ttl)
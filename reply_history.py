@@ -0,0 +1,208 @@
+"""
+History of coach replies (/plan, /standup, /gate, /triage, /chat) for logged-in users.
+
+Reply text is content-addressed: reply_blobs holds each distinct reply once,
+keyed by the SHA-256 of its text and zlib-compressed. reply_history has one
+small row per user and reply (kind, phase, week_in_phase, model, title) that
+points at its blob. A cached reply served to a hundred users, or the same
+plan shown again, costs one blob; the same reply for the same user, kind and
+week is recorded once.
+
+GET /history lists rows newest first with keyset pagination and never reads
+a blob; GET /history/<id> reads one blob, and its ETag is the content hash.
+
+  python reply_history.py --gc    # drop blobs no history row points at any more
+
+Settings (environment):
+  REPLY_HISTORY=1                 set to 0 to stop recording replies
+  REPLY_HISTORY_MIN_COMPRESS=256  replies shorter than this (bytes) are stored uncompressed
+"""
+
+import os, zlib, hashlib, argparse
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import select, delete, exists
+from sqlalchemy.orm import Session
+
+from models import ReplyBlob, ReplyHistory
+import prompt_compiler
+
+REPLY_HISTORY_ENABLED = os.getenv("REPLY_HISTORY", "1") != "0"
+MIN_COMPRESS = int(os.getenv("REPLY_HISTORY_MIN_COMPRESS", "256"))
+PAGE_LIMIT_MAX = 100
+TITLE_MAX_CHARS = 120
+KINDS = ("plan", "standup", "gate", "triage", "chat")
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def encode(text: str) -> tuple:
+    """(codec, bytes) for a reply; compression is kept only when it saves space."""
+    raw = text.encode("utf-8")
+    if len(raw) >= MIN_COMPRESS:
+        packed = zlib.compress(raw, 9)
+        if len(packed) < len(raw):
+            return "zlib", packed
+    return "raw", raw
+
+
+def decode(codec: str, data: bytes) -> str:
+    if codec == "zlib":
+        data = zlib.decompress(data)
+    elif codec != "raw":
+        raise ValueError(f"unknown reply codec '{codec}'")
+    return bytes(data).decode("utf-8")
+
+
+def title_of(text: str) -> str:
+    """First non-empty line without markdown markers, for listing without reading the blob."""
+    for line in text.splitlines():
+        line = line.replace("**", "").replace("__", "").replace("`", "").strip().lstrip("#>*-• ").strip()
+        if line:
+            return line[:TITLE_MAX_CHARS]
+    return ""
+
+
+def _week(user_state) -> int:
+    """week_in_phase, or 0 when the state has none (0 rather than NULL so the unique key applies)."""
+    week = user_state.get("week_in_phase") if isinstance(user_state, dict) else None
+    try:
+        return max(0, int(week or 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _insert(sess: Session):
+    if sess.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def record(sess: Session, user_id: int, kind: str, user_state, model: str, text: str) -> int:
+    """Store text (once) and a history row for the user; returns the row's id. The caller commits."""
+    insert = _insert(sess)
+    digest = content_hash(text)
+    now = datetime.utcnow()
+    codec, data = encode(text)
+    sess.execute(
+        insert(ReplyBlob)
+        .values(hash=digest, codec=codec, size=len(text.encode("utf-8")), data=data, created_at=now)
+        .on_conflict_do_nothing(index_elements=["hash"])
+    )
+    week = _week(user_state)
+    entry_id = sess.execute(
+        insert(ReplyHistory)
+        .values(
+            user_id=user_id,
+            blob_hash=digest,
+            kind=kind,
+            phase=prompt_compiler.current_phase(user_state),
+            week=week,
+            model=model or "",
+            title=title_of(text),
+            created_at=now,
+        )
+        .on_conflict_do_nothing(index_elements=["user_id", "kind", "week", "blob_hash"])
+        .returning(ReplyHistory.id)
+    ).scalar()
+    if entry_id is None:
+        # Already recorded for this user, kind and week
+        entry_id = sess.execute(
+            select(ReplyHistory.id).where(
+                ReplyHistory.user_id == user_id,
+                ReplyHistory.kind == kind,
+                ReplyHistory.week == week,
+                ReplyHistory.blob_hash == digest,
+            )
+        ).scalar()
+    return entry_id
+
+
+def _entry(row) -> dict:
+    return {
+        "id": row.id,
+        "kind": row.kind,
+        "phase": row.phase,
+        "week": row.week or None,
+        "model": row.model,
+        "title": row.title,
+        "hash": row.blob_hash,
+        "size": row.size,
+        "created_at": row.created_at.isoformat() if row.created_at else None,
+    }
+
+
+ENTRY_COLUMNS = (
+    ReplyHistory.id, ReplyHistory.kind, ReplyHistory.phase, ReplyHistory.week, ReplyHistory.model,
+    ReplyHistory.title, ReplyHistory.blob_hash, ReplyBlob.size, ReplyHistory.created_at,
+)
+
+
+def list_page(sess: Session, user_id: int, kind: Optional[str] = None, limit: int = 20, before: Optional[int] = None) -> dict:
+    """{"items": [...], "next_cursor": id|None}, newest first; blobs are not read."""
+    limit = max(1, min(int(limit), PAGE_LIMIT_MAX))
+    q = (
+        select(*ENTRY_COLUMNS)
+        .join(ReplyBlob, ReplyBlob.hash == ReplyHistory.blob_hash)
+        .where(ReplyHistory.user_id == user_id)
+    )
+    if kind:
+        q = q.where(ReplyHistory.kind == kind)
+    if before:
+        q = q.where(ReplyHistory.id < before)
+    rows = sess.execute(q.order_by(ReplyHistory.id.desc()).limit(limit + 1)).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return {"items": [_entry(r) for r in rows], "next_cursor": rows[-1].id if more else None}
+
+
+def get(sess: Session, user_id: int, entry_id: int) -> Optional[dict]:
+    """One history entry with its reply text, or None."""
+    row = sess.execute(
+        select(*ENTRY_COLUMNS, ReplyBlob.codec, ReplyBlob.data)
+        .join(ReplyBlob, ReplyBlob.hash == ReplyHistory.blob_hash)
+        .where(ReplyHistory.id == entry_id, ReplyHistory.user_id == user_id)
+    ).first()
+    if row is None:
+        return None
+    return {**_entry(row), "reply": decode(row.codec, row.data)}
+
+
+def gc(sess: Session) -> int:
+    """Delete blobs that no history row references (left behind by deleted users)."""
+    result = sess.execute(
+        delete(ReplyBlob).where(~exists().where(ReplyHistory.blob_hash == ReplyBlob.hash))
+    )
+    return result.rowcount or 0
+
+
+def main():
+    from dotenv import load_dotenv
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Reply history maintenance.")
+    parser.add_argument("--gc", action="store_true", help="delete unreferenced reply blobs")
+    args = parser.parse_args()
+    if not args.gc:
+        parser.print_help()
+        return
+
+    engine = create_engine(os.getenv("DATABASE_URL"))
+    sess = sessionmaker(bind=engine)()
+    try:
+        n = gc(sess)
+        sess.commit()
+    finally:
+        sess.close()
+    print(f"[reply_history] removed {n} unreferenced blobs")
+
+
+if __name__ == "__main__":
+    main()
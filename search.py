@@ -0,0 +1,223 @@
+"""
+Full-text search over a user's own coach output and what they typed (GET /search).
+
+search_docs has one row per searchable text:
+  source=reply     a coach reply (ref_id: reply_history id, see reply_history.py)
+  source=note      the note sent with /plan, /standup, /gate, /triage (ref_id: the reply it got)
+  source=message   a /chat message the user wrote (ref_id: conversation id)
+Rows are written next to the reply history and chat turns and deduplicated
+per user on the text's hash.
+
+Postgres: each row gets a text search config from detect_config() (german,
+french, english, or simple when unsure) and a stored generated tsvector
+column with a GIN index. A query is parsed with all four configs and OR-ed,
+so "Arbeitslosenkasse" finds "Arbeitslosenkassen" and "ALV" matches as is;
+rows are ranked with ts_rank_cd and only the top rows get a ts_headline
+snippet.
+
+SQLite (local runs): an FTS5 table (unicode61, diacritics folded) kept in
+step with search_docs by triggers; query terms are prefix-matched and ranked
+with bm25().
+
+  python search.py --reindex [--user 42]   # rebuild from reply_history and conversation_messages
+
+Notes sent before this index existed were never stored and cannot be backfilled.
+
+Settings (environment):
+  SEARCH_MAX_BODY_CHARS=20000   longer texts are indexed up to this length
+"""
+
+import os, re, hashlib, argparse
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import select, delete, text
+from sqlalchemy.orm import Session
+
+from models import SearchDoc, ReplyHistory, ReplyBlob, Conversation, ConversationMessage
+import reply_history
+
+MAX_BODY_CHARS = int(os.getenv("SEARCH_MAX_BODY_CHARS", "20000"))
+MAX_QUERY_CHARS = 200
+RESULT_LIMIT_MAX = 50
+SOURCES = ("reply", "note", "message")
+
+# Frequent function words; a text is given the config whose list it hits most
+STOPWORDS = {
+    "german": set("der die das und ist nicht ich du sie wir mit für auf dem den ein eine zu von im bei auch sich wie oder aber wenn noch nach über".split()),
+    "french": set("le la les et est pas je tu il nous vous avec pour sur du des un une dans que qui au aux ce cette mais ou si plus".split()),
+    "english": set("the and is not you we with for on of a an to in that this it are be or but if your have what".split()),
+}
+
+
+def detect_config(body: str) -> str:
+    words = re.findall(r"[a-zàâäçéèêëîïôöùûüß]+", body.lower())[:400]
+    hits = {cfg: sum(1 for w in words if w in stop) for cfg, stop in STOPWORDS.items()}
+    best = max(hits, key=hits.get)
+    # Too few function words (short notes, bullet lists) to tell; don't stem
+    return best if hits[best] >= 3 else "simple"
+
+
+def _insert(sess: Session):
+    if sess.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def index(sess: Session, user_id: int, source: str, kind: str, ref_id: Optional[int], body: str) -> None:
+    """Add one text to the user's index; the same text from the same source is kept once. The caller commits."""
+    body = (body or "").strip()[:MAX_BODY_CHARS]
+    if not body:
+        return
+    insert = _insert(sess)
+    sess.execute(
+        insert(SearchDoc)
+        .values(
+            user_id=user_id,
+            source=source,
+            kind=kind or "",
+            ref_id=ref_id,
+            config=detect_config(body),
+            body=body,
+            body_hash=hashlib.sha256(body.encode("utf-8")).hexdigest(),
+            created_at=datetime.utcnow(),
+        )
+        .on_conflict_do_nothing(index_elements=["user_id", "source", "body_hash"])
+    )
+
+
+# --- query ---
+
+PG_SEARCH = """
+WITH q AS (
+    SELECT websearch_to_tsquery('german', :q) || websearch_to_tsquery('french', :q)
+        || websearch_to_tsquery('english', :q) || websearch_to_tsquery('simple', :q) AS query
+), top AS (
+    SELECT d.id, d.source, d.kind, d.ref_id, d.created_at, d.config, d.body,
+           ts_rank_cd(d.tsv, q.query) AS rank, q.query
+    FROM search_docs d, q
+    WHERE d.user_id = :uid AND d.tsv @@ q.query {filters}
+    ORDER BY rank DESC, d.id DESC
+    LIMIT :limit
+)
+SELECT id, source, kind, ref_id, created_at, rank,
+       ts_headline(config, body, query,
+                   'StartSel=**, StopSel=**, MaxWords=30, MinWords=12, MaxFragments=2, FragmentDelimiter=" … "') AS snippet
+FROM top
+ORDER BY rank DESC, id DESC
+"""
+
+SQLITE_SEARCH = """
+SELECT d.id, d.source, d.kind, d.ref_id, d.created_at, -bm25(search_fts) AS rank,
+       snippet(search_fts, 0, '**', '**', ' … ', 24) AS snippet
+FROM search_fts JOIN search_docs d ON d.id = search_fts.rowid
+WHERE search_fts MATCH :q AND d.user_id = :uid {filters}
+ORDER BY bm25(search_fts), d.id DESC
+LIMIT :limit
+"""
+
+
+def fts5_query(q: str) -> str:
+    """Words as quoted prefix terms, so user input is never read as FTS5 syntax."""
+    words = re.findall(r"\w+", q)
+    return " ".join(f'"{w}"*' for w in words)
+
+
+def search(
+    sess: Session,
+    user_id: int,
+    q: str,
+    source: Optional[str] = None,
+    kind: Optional[str] = None,
+    limit: int = 10,
+) -> list:
+    """Best matches first: [{"source", "kind", "ref_id", "snippet", "rank", "created_at"}]."""
+    q = " ".join((q or "").split())[:MAX_QUERY_CHARS]
+    limit = max(1, min(int(limit), RESULT_LIMIT_MAX))
+    params = {"uid": user_id, "limit": limit}
+    filters = ""
+    if source:
+        filters += " AND d.source = :source"
+        params["source"] = source
+    if kind:
+        filters += " AND d.kind = :kind"
+        params["kind"] = kind
+
+    if sess.bind.dialect.name == "postgresql":
+        sql, params["q"] = PG_SEARCH, q
+    else:
+        sql, params["q"] = SQLITE_SEARCH, fts5_query(q)
+    if not params["q"].strip():
+        return []
+    rows = sess.execute(text(sql.format(filters=filters)), params).all()
+    return [
+        {
+            "source": r.source,
+            "kind": r.kind,
+            "ref_id": r.ref_id,
+            "snippet": r.snippet,
+            "rank": round(float(r.rank), 4),
+            # SQLite hands back the stored text for a raw query
+            "created_at": r.created_at.isoformat() if isinstance(r.created_at, datetime) else str(r.created_at).replace(" ", "T", 1),
+        }
+        for r in rows
+    ]
+
+
+# --- backfill ---
+
+def reindex(sess: Session, user_id: int = None, batch_size: int = 1000) -> int:
+    """Rebuild search_docs for replies and chat messages from the stored history. Returns texts indexed."""
+    sess.execute(delete(SearchDoc).where(
+        SearchDoc.source.in_(("reply", "message")), *([SearchDoc.user_id == user_id] if user_id else [])
+    ))
+    n = 0
+    replies = (
+        select(ReplyHistory.user_id, ReplyHistory.kind, ReplyHistory.id, ReplyBlob.codec, ReplyBlob.data)
+        .join(ReplyBlob, ReplyBlob.hash == ReplyHistory.blob_hash)
+        .where(*([ReplyHistory.user_id == user_id] if user_id else []))
+        .order_by(ReplyHistory.id)
+    )
+    for uid, kind, ref_id, codec, data in sess.execute(replies.execution_options(yield_per=batch_size)):
+        index(sess, uid, "reply", kind, ref_id, reply_history.decode(codec, data))
+        n += 1
+    messages = (
+        select(Conversation.user_id, Conversation.id, ConversationMessage.content)
+        .join(Conversation, Conversation.id == ConversationMessage.conversation_id)
+        .where(ConversationMessage.role == "user", *([Conversation.user_id == user_id] if user_id else []))
+        .order_by(ConversationMessage.id)
+    )
+    for uid, conversation_id, content in sess.execute(messages.execution_options(yield_per=batch_size)):
+        index(sess, uid, "message", "chat", conversation_id, content)
+        n += 1
+    return n
+
+
+def main():
+    from dotenv import load_dotenv
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Search index maintenance.")
+    parser.add_argument("--reindex", action="store_true", help="rebuild the index for replies and chat messages")
+    parser.add_argument("--user", type=int, default=None, help="only this user id")
+    args = parser.parse_args()
+    if not args.reindex:
+        parser.print_help()
+        return
+
+    engine = create_engine(os.getenv("DATABASE_URL"))
+    sess = sessionmaker(bind=engine)()
+    try:
+        n = reindex(sess, args.user)
+        sess.commit()
+    finally:
+        sess.close()
+    print(f"[search] indexed {n} texts")
+
+
+if __name__ == "__main__":
+    main()
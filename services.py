@@ -0,0 +1,79 @@
+"""
+Process-wide services, built on first use instead of at import.
+
+  get_llm()          the LLM backend (llm_backends.make_backend; imports the openai SDK)
+  get_reply_cache()  the reply cache (reply_cache.init_reply_cache; pings Redis when configured)
+  get_quota()        LLM admission and token quotas (llm_quota.init_llm_quota; likewise)
+  get_profile_cache() the /me profile cache (profile_cache.init_profile_cache; likewise)
+
+The database engine is built the same way in db.py (db.get_engine), and the
+mailer reads its settings when it sends, so `import app` opens no connection
+and needs no secrets.
+
+Each service is built once per process. A service the parent built before
+fork() (gunicorn preload_app) is not reused by the child: its HTTP clients,
+Redis pools and sockets would be shared between workers. after_fork()
+forgets them and disposes the inherited DB pool; gunicorn.conf.py calls it
+from post_fork, and the getters call it themselves when they notice the pid
+has changed.
+"""
+
+import os, threading
+
+import db
+import llm_backends
+import llm_quota
+import profile_cache
+import reply_cache
+
+FACTORIES = {
+    "llm": llm_backends.make_backend,
+    "reply_cache": reply_cache.init_reply_cache,
+    "quota": llm_quota.init_llm_quota,
+    "profile_cache": profile_cache.init_profile_cache,
+}
+
+_services = {}
+_pid = os.getpid()
+_lock = threading.Lock()
+
+
+def get(name: str):
+    if _pid != os.getpid():
+        after_fork()
+    service = _services.get(name)
+    if service is None:
+        with _lock:
+            service = _services.get(name)
+            if service is None:
+                service = _services[name] = FACTORIES[name]()
+    return service
+
+
+def loaded(name: str) -> bool:
+    """True if this process has built the service (shutdown hooks shouldn't build one just to close it)."""
+    return _pid == os.getpid() and name in _services
+
+
+def after_fork() -> None:
+    """In a forked child: drop services inherited from the parent and its pooled DB connections."""
+    global _pid
+    _services.clear()
+    _pid = os.getpid()
+    db.dispose_engine()
+
+
+def get_llm():
+    return get("llm")
+
+
+def get_reply_cache() -> reply_cache.ReplyCache:
+    return get("reply_cache")
+
+
+def get_quota() -> llm_quota.LLMQuota:
+    return get("quota")
+
+
+def get_profile_cache() -> profile_cache.ProfileCache:
+    return get("profile_cache")
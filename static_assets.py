@@ -0,0 +1,60 @@
+"""
+Static file serving for web/ or the build_assets.py output.
+
+- Fingerprinted names (style.3f9c0a1b2d.css) get
+  "Cache-Control: public, max-age=31536000, immutable"; everything else
+  (HTML, favicon, unhashed files) gets "no-cache" so browsers revalidate
+  with the ETag.
+- When a .br or .gz sibling exists it is sent instead, chosen by
+  Accept-Encoding (br preferred), with Content-Encoding and
+  "Vary: Accept-Encoding".
+
+Settings (environment):
+  STATIC_DIR=web      directory to serve; build/web after `python build_assets.py`
+"""
+
+import os, re, mimetypes
+
+HASHED_RE = re.compile(r"\.[0-9a-f]{10}\.\w+$")
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def is_fingerprinted(filename: str) -> bool:
+    return bool(HASHED_RE.search(filename))
+
+
+def negotiate(path: str, accept_encodings):
+    """(encoding, suffix) of the best precompressed sibling of path the client accepts, or (None, "")."""
+    for encoding, suffix in ENCODINGS:
+        if accept_encodings[encoding] and os.path.isfile(path + suffix):
+            return encoding, suffix
+    return None, ""
+
+
+def init_app(app) -> None:
+    """Replace Flask's static view with one that sets cache headers and serves precompressed files."""
+    from flask import abort, request, send_file
+    from werkzeug.security import safe_join
+
+    def serve(filename):
+        path = safe_join(app.static_folder, filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        encoding, suffix = negotiate(path, request.accept_encodings)
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        immutable = is_fingerprinted(filename)
+        max_age = IMMUTABLE_MAX_AGE if immutable else None
+        resp = send_file(path + suffix, mimetype=mimetype, conditional=True, etag=True, max_age=max_age)
+        if encoding:
+            resp.headers["Content-Encoding"] = encoding
+        if encoding or any(os.path.isfile(path + s) for _, s in ENCODINGS):
+            resp.vary.add("Accept-Encoding")
+        if immutable:
+            resp.cache_control.no_cache = None
+            resp.cache_control.immutable = True
+        else:
+            resp.cache_control.no_cache = True
+        return resp
+
+    app.view_functions["static"] = serve
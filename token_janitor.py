@@ -0,0 +1,63 @@
+"""
+Purge expired and used rows from email_tokens.
+
+  python token_janitor.py                 # run every TOKEN_JANITOR_INTERVAL seconds
+  python token_janitor.py --once          # one pass (cron / Render cron job)
+
+Settings (environment):
+  TOKEN_RETENTION_HOURS=24      keep expired/used tokens this long (for support lookups)
+  TOKEN_JANITOR_BATCH=1000      rows per DELETE transaction
+  TOKEN_JANITOR_INTERVAL=3600   seconds between passes in loop mode
+"""
+
+import os, time, argparse
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from db import cleanup_tokens
+
+load_dotenv()
+
+RETENTION_HOURS = float(os.getenv("TOKEN_RETENTION_HOURS", "24"))
+BATCH_SIZE = int(os.getenv("TOKEN_JANITOR_BATCH", "1000"))
+INTERVAL = float(os.getenv("TOKEN_JANITOR_INTERVAL", "3600"))
+
+
+def run_once(Session, retention_hours: float = RETENTION_HOURS, batch_size: int = BATCH_SIZE) -> dict:
+    sess = Session()
+    try:
+        start = time.perf_counter()
+        counts = cleanup_tokens(sess, retention_hours=retention_hours, batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+    finally:
+        sess.close()
+    print(f"[token_janitor] deleted expired={counts['expired']} used={counts['used']} in {elapsed:.2f}s")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delete expired and used email tokens in batches.")
+    parser.add_argument("--once", action="store_true", help="run one pass and exit")
+    parser.add_argument("--retention-hours", type=float, default=RETENTION_HOURS)
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE)
+    parser.add_argument("--interval", type=float, default=INTERVAL)
+    args = parser.parse_args()
+
+    engine = create_engine(os.getenv("DATABASE_URL"))
+    Session = sessionmaker(bind=engine)
+    while True:
+        try:
+            run_once(Session, args.retention_hours, args.batch)
+        except Exception as e:
+            print(f"[token_janitor] pass failed: {e}")
+            if args.once:
+                raise
+        if args.once:
+            return
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
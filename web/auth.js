@@ -6,16 +6,27 @@ function readCookie(name) {
   }, '');
 }
 
-document.addEventListener('DOMContentLoaded', () => {
-  const authLinks = document.getElementById('auth-links');
-
-  if (authLinks) {
-    fetch('/me', {credentials: 'include'})
+// One /me request per page: every caller shares the same in-flight promise.
+// Resolves to the parsed body, or null when logged out or on error.
+let mePromise = null;
+window.fetchMe = function () {
+  if (!mePromise) {
+    mePromise = fetch('/me', { credentials: 'include' })
       .then(r => {
         if (r.status === 401) return null;
         if (!r.ok) throw new Error('me failed');
         return r.json();
       })
+      .catch(() => null);
+  }
+  return mePromise;
+};
+
+document.addEventListener('DOMContentLoaded', () => {
+  const authLinks = document.getElementById('auth-links');
+
+  if (authLinks) {
+    window.fetchMe()
       .then(data => {
         if (!data || !data.user) return;
         authLinks.innerHTML = `<span class="muted">Hi, ${data.user.email}</span> <button id="logout" class="btn ghost">Log Out</button>`;
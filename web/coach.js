@@ -0,0 +1,196 @@
+(function () {
+  const panel = document.getElementById('coach');
+  const output = document.getElementById('coach-output');
+  if (!panel || !output) return;
+
+  const fab = document.getElementById('fab');
+  const closeBtn = document.getElementById('coach-close');
+  const form = document.getElementById('coach-form');
+  const input = document.getElementById('coach-input');
+  const openBtn = document.getElementById('btn-open-coach');
+
+  // Markdown of the last coach reply; sent back as context_md for follow-up chat
+  let lastReply = '';
+  let lastKind = '';
+  // Server-side conversation (logged-in users); the panel context is only sent when it changed
+  let conversationId = sessionStorage.getItem('nc_conversation_id') || null;
+  let sentContext = null;
+
+  function setConversation(id) {
+    conversationId = id ? String(id) : null;
+    if (conversationId) sessionStorage.setItem('nc_conversation_id', conversationId);
+    else sessionStorage.removeItem('nc_conversation_id');
+  }
+
+  function setOpen(on) {
+    panel.classList.toggle('open', on);
+    panel.setAttribute('aria-hidden', on ? 'false' : 'true');
+    if (fab) fab.setAttribute('aria-expanded', String(on));
+    if (on && input) input.focus();
+  }
+
+  function renderMarkdown(el, md) {
+    if (window.marked && window.DOMPurify) {
+      el.innerHTML = window.DOMPurify.sanitize(window.marked.parse(md));
+    } else {
+      el.textContent = md;
+    }
+  }
+
+  function addMessage(cls, text) {
+    const el = document.createElement('div');
+    el.className = `msg ${cls}`;
+    if (text) el.textContent = text;
+    output.appendChild(el);
+    el.scrollIntoView({ block: 'end' });
+    return el;
+  }
+
+  function userState() {
+    const state = {};
+    const phase = document.getElementById('intake-phase');
+    const week = document.getElementById('week-input');
+    if (phase && phase.value) state.current_phase = phase.value;
+    if (week && week.value) state.week_in_phase = Number(week.value);
+    return state;
+  }
+
+  // Logged-in users keep their state on the server (PATCH /state), so coach calls can omit it
+  let syncedState = null;
+  async function syncState() {
+    const csrf = typeof readCookie === 'function' ? readCookie('csrf_token') : '';
+    if (!csrf) return false;
+    const state = JSON.stringify(userState());
+    if (state === syncedState) return true;
+    try {
+      const resp = await fetch('/state', {
+        method: 'PATCH',
+        credentials: 'include',
+        headers: { 'Content-Type': 'application/merge-patch+json', 'X-CSRF-Token': csrf },
+        body: state
+      });
+      if (!resp.ok) return false;
+      syncedState = state;
+      return true;
+    } catch (_) {
+      return false;
+    }
+  }
+
+  // Parse an SSE byte stream from fetch() and call onEvent(name, data) per frame.
+  async function readEvents(resp, onEvent) {
+    const reader = resp.body.getReader();
+    const decoder = new TextDecoder();
+    let buf = '';
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buf += decoder.decode(value, { stream: true });
+      let idx;
+      while ((idx = buf.indexOf('\n\n')) !== -1) {
+        const frame = buf.slice(0, idx);
+        buf = buf.slice(idx + 2);
+        let name = 'message';
+        const data = [];
+        frame.split('\n').forEach(line => {
+          if (line.startsWith('event:')) name = line.slice(6).trim();
+          else if (line.startsWith('data:')) data.push(line.slice(5).trim());
+        });
+        if (data.length) {
+          try { onEvent(name, JSON.parse(data.join('\n'))); } catch (_) {}
+        }
+      }
+    }
+  }
+
+  function post(path, body) {
+    return fetch(path, {
+      method: 'POST',
+      credentials: 'include',
+      headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
+      body: JSON.stringify(body)
+    });
+  }
+
+  async function ask(path, body, kind) {
+    const el = addMessage('msg-coach', '…');
+    let md = '';
+    try {
+      const stored = await syncState();
+      const withState = (b) => (stored ? b : { user_state: userState(), ...b });
+      let resp = await post(path, withState(body()));
+      if (resp.status === 404 && conversationId) {
+        // Conversation belongs to another login or was removed: start over with full context
+        setConversation(null);
+        sentContext = null;
+        resp = await post(path, withState(body()));
+      }
+      const type = resp.headers.get('Content-Type') || '';
+      if (!resp.ok || !type.includes('text/event-stream')) {
+        // Non-streaming reply (validation message or error) keeps the JSON contract
+        const data = await resp.json().catch(() => ({}));
+        md = data.reply || data.error || 'Coach is unavailable right now.';
+        if (resp.status === 429) {
+          md = data.reason === 'tokens'
+            ? "You've reached today's coaching limit. Please try again later."
+            : 'Still answering your previous request. Try again in a moment.';
+        }
+        if (data.conversation_id) setConversation(data.conversation_id);
+        renderMarkdown(el, md);
+        return;
+      }
+      await readEvents(resp, (name, data) => {
+        if (name === 'done' && data.conversation_id) {
+          setConversation(data.conversation_id);
+        } else if (name === 'chunk') {
+          md += data.delta || '';
+          renderMarkdown(el, md);
+          el.scrollIntoView({ block: 'end' });
+        } else if (name === 'error') {
+          md += `\n\n_${data.error || 'Coach is unavailable right now.'}_`;
+          renderMarkdown(el, md);
+        }
+      });
+      if (!md) renderMarkdown(el, 'Coach is unavailable right now.');
+    } catch (_) {
+      renderMarkdown(el, md || 'Coach is unavailable right now.');
+    }
+    // Stored conversations already hold chat replies; only coach panels become context
+    if (md && (kind || !conversationId)) {
+      lastReply = md;
+      if (kind) lastKind = kind;
+    }
+  }
+
+  if (fab) fab.addEventListener('click', () => setOpen(!panel.classList.contains('open')));
+  if (openBtn) openBtn.addEventListener('click', () => setOpen(true));
+  if (closeBtn) closeBtn.addEventListener('click', () => setOpen(false));
+
+  panel.querySelectorAll('.coach-tools [data-kind]').forEach(btn => {
+    btn.addEventListener('click', () => {
+      const kind = btn.dataset.kind;
+      panel.querySelectorAll('.coach-tools [data-kind]').forEach(b => b.setAttribute('aria-pressed', String(b === btn)));
+      addMessage('msg-user', btn.textContent.trim());
+      ask(`/${kind}`, () => ({ note: '' }), kind);
+    });
+  });
+
+  if (form && input) {
+    form.addEventListener('submit', (e) => {
+      e.preventDefault();
+      const message = input.value.trim();
+      if (!message) return;
+      input.value = '';
+      addMessage('msg-user', message);
+      ask('/chat', () => {
+        const body = { message, conversation_id: conversationId };
+        if (!conversationId || sentContext !== lastReply) {
+          body.context_md = lastReply;
+          body.context_kind = lastKind;
+          sentContext = lastReply;
+        }
+        return body;
+      });
+    });
+  }
+})();
@@ -130,12 +130,9 @@ document.addEventListener('DOMContentLoaded', () => {
     });
   })();
 
-  fetch('/me', {credentials: 'include'})
-    .then(r => {
-      if (r.status === 401) return null;
-      if (!r.ok) throw new Error('me failed');
-      return r.json();
-    })
+  const me = window.fetchMe ? window.fetchMe() : Promise.resolve(null);
+
+  me
     .then(data => {
       if (!data || !data.user) return;
       const phase = String(data.user.phase || '').toLowerCase();
@@ -153,8 +150,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
   const pathname = window.location.pathname;
   if (pathname.endsWith('/signin.html') || pathname.endsWith('/signup.html')) {
-    fetch('/me', { credentials: 'include' })
-      .then(r => r.ok ? r.json() : null)
+    me
       .then(data => { if (data && data.user) window.location.href = '/'; })
       .catch(() => {});
   }